@@ -0,0 +1,282 @@
+#  Copyright (c) 2020.  InValidFire
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+#  associated documentation files (the "Software"), to deal in the Software without restriction, including
+#  without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the
+#  following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all copies or substantial
+#  portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+#  CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+#  OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Local stand-in for the parts of the Github API ghau uses, serving synthetic repositories.
+
+Repositories are generated from their name, ``bench/f<files>-s<size>`` holding <files> files of <size> bytes each.
+Every repository has two releases, v0.9.0 and v1.0.0, with 5% of the files changed and one file removed between
+them, and a single asset the size of the whole repository. Responses carry ETags and answer conditional requests
+with a 304, and API responses carry X-RateLimit headers, so ghau's caching and rate limit tracking behave like they
+do against Github.
+
+Besides the Github endpoints, ``GET /_stats`` returns the requests served since the last ``POST /_reset``.
+
+Run it on its own with ``python benchmarks/fake_github.py --port 8800``."""
+import re
+import sys
+import json
+import base64
+import random
+import hashlib
+import zipfile
+import argparse
+import threading
+import http.server
+import urllib.parse
+from io import BytesIO
+
+LATEST = "v1.0.0"
+PREVIOUS = "v0.9.0"
+RATE_LIMIT = 5000
+_REPO = re.compile(r"^bench/f(\d+)-s(\d+)$")
+
+
+def _blob_sha(data: bytes) -> str:
+    """Git blob SHA-1 of the given file contents."""
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+class SyntheticRepo:
+    """Deterministic repository with the given amount of files of the given size, spread over ten packages."""
+    def __init__(self, name: str, files: int, size: int):
+        rng = random.Random(name)
+        self.name = name
+        latest = {}
+        for i in range(files):
+            raw = rng.getrandbits(size * 6).to_bytes(size * 6 // 8, "little") if size > 0 else b""
+            latest["pkg{}/module{}.py".format(i % 10, i)] = base64.b64encode(raw)[:size]  # compresses like source.
+        previous = dict(latest)
+        for i, path in enumerate(sorted(latest)):
+            if i % 20 == 0:
+                previous[path] = previous[path][::-1]
+        previous["removed.py"] = b"# removed in " + LATEST.encode()
+        self.files = {LATEST: latest, PREVIOUS: previous}
+        asset_size = files * size
+        self.asset = rng.getrandbits(asset_size * 8).to_bytes(asset_size, "little") if asset_size > 0 else b""
+        self.asset_name = "bench-{}.tar.gz".format(LATEST.lstrip("v"))
+        self._zips = {}
+        self._lock = threading.Lock()
+
+    def zipball(self, tag: str) -> bytes:
+        """Return the source archive of the given tag, wrapped in a folder like Github's zipballs."""
+        with self._lock:
+            if tag not in self._zips:
+                buffer = BytesIO()
+                prefix = "{}-{}/".format(self.name.replace("/", "-"), tag)
+                with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+                    zf.writestr(prefix, "")
+                    for path, data in sorted(self.files[tag].items()):
+                        zf.writestr(prefix + path, data)
+                self._zips[tag] = buffer.getvalue()
+            return self._zips[tag]
+
+    def tree(self, tag: str) -> dict:
+        """Return the recursive git tree of the given tag."""
+        return {"truncated": False, "tree": [{"path": path, "mode": "100644", "type": "blob", "sha": _blob_sha(data),
+                                              "size": len(data)} for path, data in sorted(self.files[tag].items())]}
+
+    def release(self, base: str, tag: str) -> dict:
+        """Return the release data of the given tag."""
+        release_id = 2 if tag == LATEST else 1
+        assets = []
+        if tag == LATEST:
+            assets.append({"id": 1, "name": self.asset_name, "size": len(self.asset),
+                           "digest": "sha256:" + hashlib.sha256(self.asset).hexdigest(),
+                           "browser_download_url": "{}/download/{}/{}/{}".format(base, self.name, tag,
+                                                                                self.asset_name)})
+        return {"id": release_id, "tag_name": tag, "name": tag, "draft": False, "prerelease": False,
+                "zipball_url": "{}/repos/{}/zipball/{}".format(base, self.name, tag),
+                "assets_url": "{}/repos/{}/releases/{}/assets".format(base, self.name, release_id),
+                "assets": assets}
+
+
+class FakeGithub(http.server.ThreadingHTTPServer):
+    """HTTP server answering like Github for the synthetic repositories."""
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0)):
+        super().__init__(address, _Handler)
+        self.repos = {}
+        self.lock = threading.Lock()
+        self.reset()
+
+    @property
+    def url(self) -> str:
+        """Base url of the server, to use as the api_url of ghau."""
+        return "http://{}:{}".format(*self.server_address)
+
+    def reset(self):
+        """Reset the request statistics and the rate limit budget."""
+        with self.lock:
+            self.remaining = RATE_LIMIT
+            self.stats = {"api_requests": 0, "not_modified": 0, "downloads": 0, "bytes_served": 0}
+
+    def repo(self, name: str):
+        """Return the synthetic repository of the given name, or None if the name doesn't describe one."""
+        match = _REPO.match(name)
+        if match is None:
+            return None
+        with self.lock:
+            if name not in self.repos:
+                self.repos[name] = SyntheticRepo(name, int(match.group(1)), int(match.group(2)))
+            return self.repos[name]
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # headers and body are written separately, don't wait on delayed ACKs.
+
+    def log_message(self, format, *args):
+        pass
+
+    def _count(self, key: str, amount: int = 1):
+        """Add to one of the request statistics."""
+        with self.server.lock:
+            self.server.stats[key] += amount
+
+    def _rate_headers(self):
+        """Send the rate limit headers of an API response."""
+        self.send_header("X-RateLimit-Limit", str(RATE_LIMIT))
+        self.send_header("X-RateLimit-Remaining", str(self.server.remaining))
+        self.send_header("X-RateLimit-Reset", "4102444800")
+        self.send_header("X-RateLimit-Resource", "core")
+
+    def _json(self, data, code: int = 200, counted: bool = True, headers: dict = None):
+        """Send an API response, answering a matching conditional request with a 304."""
+        body = json.dumps(data).encode()
+        etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+        if counted:
+            self._count("api_requests")
+        if code == 200 and self.headers.get("If-None-Match") == etag:
+            self._count("not_modified")
+            self.send_response(304)
+            self._rate_headers()
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if counted:
+            with self.server.lock:
+                self.server.remaining = max(0, self.server.remaining - 1)
+        self.send_response(code)
+        self._rate_headers()
+        self.send_header("ETag", etag)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _raw(self, data: bytes):
+        """Send a download, honouring single Range requests."""
+        start, end, code = 0, len(data) - 1, 200
+        match = re.match(r"bytes=(\d+)-(\d*)$", self.headers.get("Range", ""))
+        if match is not None:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), end) if match.group(2) else end
+            if start > end:
+                self.send_response(416)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            code = 206
+        chunk = data[start:end + 1]
+        self._count("downloads")
+        self._count("bytes_served", len(chunk))
+        self.send_response(code)
+        self.send_header("Content-Length", str(len(chunk)))
+        self.send_header("Accept-Ranges", "bytes")
+        if code == 206:
+            self.send_header("Content-Range", "bytes {}-{}/{}".format(start, end, len(data)))
+        self.end_headers()
+        self.wfile.write(chunk)
+
+    def do_POST(self):
+        if self.path == "/_reset":
+            self.server.reset()
+            return self._json({}, counted=False)
+        self._json({"message": "Not Found"}, 404, counted=False)
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        path = urllib.parse.unquote(url.path)
+        query = urllib.parse.parse_qs(url.query)
+        base = self.server.url
+        if path == "/_stats":
+            return self._json(self.server.stats, counted=False)
+        if path == "/rate_limit":  # doesn't count against the rate limit on Github either.
+            return self._json({"resources": {"core": {"limit": RATE_LIMIT, "remaining": self.server.remaining,
+                                                      "reset": 4102444800}}}, counted=False)
+        match = re.match(r"^/(repos|raw|download|codeload)/([^/]+/[^/]+)(.*)$", path)
+        repo = self.server.repo(match.group(2)) if match is not None else None
+        if repo is None:
+            return self._json({"message": "Not Found"}, 404)
+        kind, rest = match.group(1), match.group(3)
+        if kind == "raw":
+            tag, _, file_path = rest.lstrip("/").partition("/")
+            if file_path not in repo.files.get(tag, {}):
+                return self._json({"message": "Not Found"}, 404, counted=False)
+            return self._raw(repo.files[tag][file_path])
+        if kind == "download":
+            return self._raw(repo.asset)
+        if kind == "codeload":
+            tag = rest.rsplit("/", 1)[-1]
+            return self._raw(repo.zipball(tag)) if tag in repo.files else self._json({}, 404, counted=False)
+        if rest == "":
+            return self._json({"url": "{}/repos/{}".format(base, repo.name), "full_name": repo.name})
+        if rest == "/releases/latest":
+            return self._json(repo.release(base, LATEST))
+        if rest == "/releases":
+            per_page = int(query.get("per_page", ["30"])[0])
+            return self._json([repo.release(base, tag) for tag in (LATEST, PREVIOUS)][:per_page])
+        if re.match(r"^/releases/\d+/assets$", rest):
+            release = repo.release(base, LATEST if rest.split("/")[2] == "2" else PREVIOUS)
+            return self._json(release["assets"])
+        if rest.startswith("/git/trees/") and rest[len("/git/trees/"):] in repo.files:
+            return self._json(repo.tree(rest[len("/git/trees/"):]))
+        if rest.startswith("/zipball/"):  # Github redirects archive downloads to codeload.
+            self._count("api_requests")
+            with self.server.lock:
+                self.server.remaining = max(0, self.server.remaining - 1)
+            self.send_response(302)
+            self._rate_headers()
+            self.send_header("Location", "{}/codeload/{}/zip/{}".format(base, repo.name, rest[len("/zipball/"):]))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self._json({"message": "Not Found"}, 404)
+
+
+def start(port: int = 0) -> FakeGithub:
+    """Start a fake Github server on a background thread, listening on the given port of the loopback interface."""
+    server = FakeGithub(("127.0.0.1", port))
+    threading.Thread(target=server.serve_forever, name="fake-github", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve synthetic repositories like the Github API does.")
+    parser.add_argument("--port", type=int, default=0, help="port to listen on, defaults to any free port")
+    args = parser.parse_args(sys.argv[1:])
+    fake = FakeGithub(("127.0.0.1", args.port))
+    print(fake.url, flush=True)
+    try:
+        fake.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,109 @@
+#  Copyright (c) 2020.  InValidFire
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+#  associated documentation files (the "Software"), to deal in the Software without restriction, including
+#  without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the
+#  following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all copies or substantial
+#  portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+#  CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+#  OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Import time regression check for ghau's start up and the paths skipping an update check.
+
+Runs each case in a fresh interpreter with ``python -X importtime`` and fails when:
+
+- a dependency only needed by the network and filesystem phases (requests, zipfile, http.server, ...) is loaded by
+  ``import ghau``, when booting after an update or when the next check isn't due yet. Modules the interpreter
+  already loaded at start up, for example through site-packages, are not counted.
+- ``import ghau`` takes longer than the budget, taking the fastest of the repeated runs to filter out noise.
+
+Cases:
+
+- import: ``import ghau``.
+- loop-prevention: ``Update.update()`` right after booting into an update, with -ghau in the arguments.
+- not-due: ``Update.update()`` when the check schedule isn't due yet.
+
+Usage::
+
+    python benchmarks/import_time.py --budget 50
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ["requests", "urllib3", "zipfile", "http.server", "concurrent.futures", "subprocess", "socket", "select",
+         "ghau.artifacts"]
+CASES = {
+    "import": "",
+    "loop-prevention": "sys.argv = ['app.py', '-ghau']\n"
+                       "ghau.Update('v1.0.0', 'bench/app', program_dir=tempfile.mkdtemp(), api_url=URL).update()\n",
+    "not-due": "update = ghau.Update('v1.0.0', 'bench/app', program_dir=tempfile.mkdtemp(), api_url=URL,\n"
+               "                    check_interval=3600)\n"
+               "update.schedule.success()\n"
+               "update.update()\n",
+}
+_SCRIPT = """import sys, json, tempfile
+sys.path.insert(0, {root!r})
+URL = "http://127.0.0.1:9"  # closed port, a case reaching the network fails right away instead of waiting on Github.
+HEAVY = {heavy!r}
+started = set(sys.modules)
+import ghau
+{case}
+print(json.dumps([name for name in HEAVY if name in sys.modules and name not in started
+                  and type(sys.modules[name]).__name__ != "_LazyModule"]))
+"""
+
+
+def run_case(case: str) -> tuple:
+    """Run the given case in a fresh interpreter.
+
+    :returns tuple: the heavy modules it loaded and the cumulative import time of ghau in milliseconds."""
+    script = _SCRIPT.format(root=ROOT, heavy=HEAVY, case=CASES[case])
+    p = subprocess.run([sys.executable, "-X", "importtime", "-c", script], cwd=ROOT, stdout=subprocess.PIPE,
+                       stderr=subprocess.PIPE, universal_newlines=True)
+    if p.returncode != 0:
+        raise RuntimeError("Case {} failed:\n{}".format(case, p.stderr))
+    loaded = json.loads(p.stdout.strip().splitlines()[-1])
+    import_ms = None
+    for line in p.stderr.splitlines():
+        fields = line.split("|")
+        if line.startswith("import time:") and len(fields) == 3 and fields[2].strip() == "ghau":
+            import_ms = int(fields[1]) / 1000
+    return loaded, import_ms
+
+
+def main(args: list) -> int:
+    """Run every case, returning 1 if any of them loaded a heavy module or the import went over budget."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--budget", type=float, default=50, help="milliseconds import ghau may take, defaults to 50")
+    parser.add_argument("--repeat", type=int, default=5, help="runs of each case, defaults to 5")
+    options = parser.parse_args(args)
+    failed = False
+    timings = {}
+    for case in CASES:
+        runs = [run_case(case) for _ in range(options.repeat)]
+        loaded = sorted(set(name for names, _ in runs for name in names))
+        import_ms = timings[case] = min(ms for _, ms in runs)
+        print("{:<16} import ghau {:7.1f} ms, heavy modules loaded: {}".format(case, import_ms,
+                                                                               ", ".join(loaded) or "none"))
+        if loaded:
+            failed = True
+    if timings["import"] > options.budget:
+        print("import ghau took {:.1f} ms, over the budget of {:.1f} ms".format(timings["import"], options.budget))
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
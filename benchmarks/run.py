@@ -0,0 +1,250 @@
+#  Copyright (c) 2020.  InValidFire
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+#  associated documentation files (the "Software"), to deal in the Software without restriction, including
+#  without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the
+#  following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all copies or substantial
+#  portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+#  CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+#  OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Offline benchmark of ghau's update paths against a local stand-in for Github.
+
+Each measurement runs ``Update.update()`` once in a fresh interpreter, against a program directory holding the
+previous release of a synthetic repository (see fake_github.py). Recorded for each run:
+
+- seconds: wall time of ``Update.update()``, excluding interpreter start up and ``import ghau``.
+- import_seconds: time ``import ghau`` took.
+- api_calls: Github API requests served, of which not_modified were answered with a 304.
+- bytes_downloaded: bytes of zipballs, assets and raw files served.
+- bytes_written: bytes passed to write calls by the process (Linux only, None elsewhere).
+- peak_rss_kb: peak resident memory of the process (None on Windows).
+
+Scenarios:
+
+- no-update: the installed version is the latest, with an empty cache.
+- no-update-warm: the same check a second time, so conditional requests are answered with 304s.
+- zip, stream, delta, asset: update from v0.9.0 to v1.0.0 in the given download mode.
+
+Results are written as JSON along with the commit they were measured on, so runs can be compared::
+
+    python benchmarks/run.py --output before.json
+    git checkout my-branch
+    python benchmarks/run.py --output after.json --compare before.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import zipfile
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import urllib.request
+from io import BytesIO
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)  # measure the working tree, not an installed ghau.
+
+import fake_github  # noqa: E402
+
+SCENARIOS = {
+    "no-update": {"version": fake_github.LATEST},
+    "no-update-warm": {"version": fake_github.LATEST, "warm": True},
+    "zip": {"version": fake_github.PREVIOUS},
+    "stream": {"version": fake_github.PREVIOUS, "options": {"stream_zip": True}},
+    "delta": {"version": fake_github.PREVIOUS, "options": {"delta": True}},
+    "asset": {"version": fake_github.PREVIOUS, "options": {"download": "asset", "asset": "bench-1.0.0.tar.gz"}},
+}
+REPOS = ["bench/f100-s1000", "bench/f1000-s4000", "bench/f5000-s1000"]
+METRICS = ["seconds", "import_seconds", "api_calls", "not_modified", "bytes_downloaded", "bytes_written",
+           "peak_rss_kb"]
+
+
+def _written_bytes():
+    """Bytes this process passed to write calls so far, or None if the platform doesn't report it."""
+    try:
+        with open("/proc/self/io", "r") as fd:
+            for line in fd:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+
+
+def _peak_rss_kb():
+    """Peak resident memory of this process in KiB, or None if the platform doesn't report it."""
+    try:  # unlike ru_maxrss, VmHWM isn't inherited from the parent process on Linux.
+        with open("/proc/self/status", "r") as fd:
+            for line in fd:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak  # macOS reports bytes, Linux KiB.
+
+
+def _request(url: str, method: str = "GET") -> bytes:
+    """Send a request with urllib, so the harness doesn't import anything ghau may import lazily."""
+    with urllib.request.urlopen(urllib.request.Request(url, method=method)) as r:
+        return r.read()
+
+
+def _prepare(url: str, repo: str) -> str:
+    """Extract the previous release of the given repository into a new template directory and return it."""
+    template = tempfile.mkdtemp(prefix="ghau-bench-template-")
+    archive = _request("{}/codeload/{}/zip/{}".format(url, repo, fake_github.PREVIOUS))
+    with zipfile.ZipFile(BytesIO(archive)) as zf:
+        for item in zf.infolist():
+            relative = item.filename.split("/", 1)[1]
+            if relative and not item.is_dir():
+                os.makedirs(os.path.join(template, os.path.dirname(relative)), exist_ok=True)
+                with open(os.path.join(template, relative), "wb") as fd:
+                    fd.write(zf.read(item))
+    return template
+
+
+def measure(url: str, repo: str, scenario: str, program_dir: str) -> dict:
+    """Run a single measurement in this process against the given program directory and return its results."""
+    config = SCENARIOS[scenario]
+    sys.argv = [os.path.join(program_dir, "main.py")]
+    started = time.perf_counter()
+    import ghau
+    import_seconds = time.perf_counter() - started
+
+    def run():
+        update = ghau.Update(config["version"], repo, api_url=url, raw_url=url + "/raw", program_dir=program_dir,
+                             **config.get("options", {}))
+        try:
+            update.update()
+        except SystemExit:  # exits to reboot once installed.
+            pass
+
+    if config.get("warm"):
+        run()
+    _request(url + "/_reset", "POST")
+    written = _written_bytes()
+    started = time.perf_counter()
+    run()
+    seconds = time.perf_counter() - started
+    written = _written_bytes() - written if written is not None else None
+    stats = json.loads(_request(url + "/_stats").decode())
+    return {"seconds": seconds, "import_seconds": import_seconds, "api_calls": stats["api_requests"],
+            "not_modified": stats["not_modified"], "bytes_downloaded": stats["bytes_served"],
+            "bytes_written": written, "peak_rss_kb": _peak_rss_kb()}
+
+
+def _summarize(runs: list) -> dict:
+    """Median of each metric over the given runs, along with the fastest run."""
+    summary = {}
+    for metric in METRICS:
+        values = [run[metric] for run in runs if run[metric] is not None]
+        summary[metric] = statistics.median(values) if values else None
+    summary["min_seconds"] = min(run["seconds"] for run in runs)
+    summary["runs"] = len(runs)
+    return summary
+
+
+def _commit() -> str:
+    """Commit of the working tree being measured, marked dirty if it has uncommitted changes."""
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                         stderr=subprocess.DEVNULL).decode().strip()
+        dirty = subprocess.call(["git", "diff", "--quiet", "HEAD", "--", "ghau"], cwd=ROOT) != 0
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return commit + ("-dirty" if dirty else "")
+
+
+def _format(metric: str, value) -> str:
+    """Format a metric value for the results table."""
+    if value is None:
+        return "-"
+    if metric.endswith("seconds"):
+        return "{:.1f}ms".format(value * 1000)
+    if metric.startswith("bytes"):
+        return "{:.1f}KiB".format(value / 1024)
+    return str(int(value))
+
+
+def _print_table(results: dict, baseline: dict = None):
+    """Print the results, with the relative change to the baseline when one is given."""
+    columns = ["seconds", "api_calls", "bytes_downloaded", "bytes_written", "peak_rss_kb"]
+    print("{:<20} {:<16}".format("repo", "scenario") + "".join("{:>22}".format(c) for c in columns))
+    for key, summary in results.items():
+        repo, scenario = key.split(" ")
+        cells = []
+        for metric in columns:
+            cell = _format(metric, summary[metric])
+            old = (baseline or {}).get(key, {}).get(metric)
+            if old and summary[metric] is not None:
+                cell += " ({:+.0f}%)".format((summary[metric] - old) / old * 100)
+            cells.append("{:>22}".format(cell))
+        print("{:<20} {:<16}".format(repo, scenario) + "".join(cells))
+
+
+def main(args: list):
+    """Run the benchmarks, or a single measurement when called with --measure."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement, defaults to 3")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="scenario to run, can be repeated, defaults to all")
+    parser.add_argument("--repo", action="append",
+                        help="synthetic repository bench/f<files>-s<size> to run against, can be repeated")
+    parser.add_argument("--output", help="file to write the results to as JSON")
+    parser.add_argument("--compare", help="results of an earlier run to compare against")
+    parser.add_argument("--measure", nargs=4, metavar=("URL", "REPO", "SCENARIO", "DIR"), help=argparse.SUPPRESS)
+    options = parser.parse_args(args)
+    if options.measure is not None:  # a single measurement, run in a fresh interpreter by the parent.
+        print(json.dumps(measure(*options.measure)))
+        return
+    server = fake_github.start()
+    results = {}
+    for repo in options.repo or REPOS:
+        template = _prepare(server.url, repo)
+        for scenario in options.scenario or list(SCENARIOS):
+            runs = []
+            for _ in range(options.repeat):
+                program_dir = os.path.join(tempfile.mkdtemp(prefix="ghau-bench-"), "program")
+                shutil.copytree(template, program_dir)
+                try:
+                    output = subprocess.check_output([sys.executable, os.path.abspath(__file__), "--measure",
+                                                      server.url, repo, scenario, program_dir], cwd=ROOT)
+                finally:
+                    shutil.rmtree(os.path.dirname(program_dir), ignore_errors=True)
+                runs.append(json.loads(output.decode().strip().splitlines()[-1]))
+            results["{} {}".format(repo, scenario)] = _summarize(runs)
+            print("measured {} {}: {}".format(repo, scenario, _format("seconds", results[repo + " " + scenario]
+                                                                     ["seconds"])), file=sys.stderr)
+        shutil.rmtree(template, ignore_errors=True)
+    server.shutdown()
+    baseline = None
+    if options.compare is not None:
+        with open(options.compare, "r") as fd:
+            baseline = json.load(fd)["results"]
+    _print_table(results, baseline)
+    if options.output is not None:
+        with open(options.output, "w") as fd:
+            json.dump({"commit": _commit(), "python": platform.python_version(), "platform": platform.platform(),
+                       "repeat": options.repeat, "results": results}, fd, indent=2)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -17,10 +17,12 @@
 #  OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 from .update import *
+from .manager import UpdateManager
 
 __all__ = [
     "python",
     "exe",
     "cmd",
-    "Update"
+    "Update",
+    "UpdateManager"
 ]
@@ -0,0 +1,177 @@
+#  Copyright (c) 2020.  InValidFire
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+#  associated documentation files (the "Software"), to deal in the Software without restriction, including
+#  without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the
+#  following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all copies or substantial
+#  portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+#  CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+#  OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Command line interface of ghau, run with ``python -m ghau``.
+
+Commands:
+
+- verify: compare an installed program against the release it claims to be, optionally repairing drifted files.
+- supervise: run a program under a :class:`ghau.daemon.Supervisor`, updating it without dropping connections.
+- make-patch: create the binary patch between two versions of a release asset, to publish with the new release.
+- send-webhook: post a recorded webhook payload to a :class:`ghau.webhook.WebhookListener`, signed like Github does.
+
+Webhook secrets are read from the GHAU_WEBHOOK_SECRET environment variable.
+"""
+import os
+import sys
+import logging
+import argparse
+
+import ghau.api as api
+import ghau.daemon as gd
+import ghau.errors as ge
+import ghau.files as gf
+import ghau.patch as gp
+import ghau.update as gu
+import ghau.webhook as gw
+
+
+def verify(options) -> int:
+    """Run the verify command, returning 0 if the installed files match the release, 1 if some drifted and weren't
+    repaired."""
+    update = gu.Update(options.version, options.repo, auth=options.auth, program_dir=options.dir,
+                       cache_dir=options.cache_dir, api_url=options.api_url, metrics_file=options.metrics_file)
+    if options.whitelist:
+        update.wl_files(*options.whitelist)
+    drift = update.verify(options.repair, options.workers, options.full)
+    for path in drift.modified:
+        print("modified: {}".format(path))
+    for path in drift.missing:
+        print("missing: {}".format(path))
+    print("{} files checked, {} hashed, {} modified, {} missing{}".format(
+        drift.checked, drift.hashed, len(drift.modified), len(drift.missing),
+        ", repaired" if options.repair and (drift.modified or drift.missing) else ""))
+    return 0 if options.repair or not (drift.modified or drift.missing) else 1
+
+
+def supervise(options) -> int:
+    """Run the supervise command until the supervisor is stopped."""
+    update = gu.Update(options.version, options.repo, auth=options.auth, program_dir=options.dir,
+                       cache_dir=options.cache_dir, api_url=options.api_url, metrics_file=options.metrics_file,
+                       staged=options.staged, check_interval=options.check_interval)
+    if options.whitelist:
+        update.wl_files(*options.whitelist)
+    webhook = None
+    if options.webhook:
+        if not options.webhook_secret:
+            gf.message("Set the GHAU_WEBHOOK_SECRET environment variable to listen for webhooks.", "critical")
+            return 2
+        webhook = gw.WebhookListener(update, options.webhook_secret, options.webhook)
+    sockets = {}
+    for listen in options.listen or []:
+        name, _, address = listen.rpartition("=")
+        sockets[name or "socket{}".format(len(sockets))] = gd.listen(address)
+    gd.Supervisor(update, options.command, sockets, options.ready_timeout, options.stop_timeout,
+                  webhook=webhook).run()
+    return 0
+
+
+def make_patch(options) -> int:
+    """Run the make-patch command, writing the patch named after the new file and both tags."""
+    name = gp.patch_name(os.path.basename(options.new), options.from_tag, options.to_tag)
+    path = os.path.join(options.out, name)
+    size = gp.create(options.old, options.new, path, options.block_size)
+    print("{}: {} bytes, {:.1%} of {}".format(path, size, size / max(os.path.getsize(options.new), 1),
+                                              os.path.basename(options.new)))
+    return 0
+
+
+def send_webhook(options) -> int:
+    """Run the send-webhook command, returning 0 if the listener accepted the payload."""
+    if not options.webhook_secret:
+        gf.message("Set the GHAU_WEBHOOK_SECRET environment variable to sign the payload.", "critical")
+        return 2
+    with open(options.payload, "rb") as fd:
+        body = fd.read()
+    status = gw.send(options.url, body, options.webhook_secret, options.event)
+    print("{}: {}".format(options.url, status))
+    return 0 if status < 300 else 1
+
+
+def main(args: list) -> int:
+    """Parse the given arguments and run the command, returning the exit code."""
+    parser = argparse.ArgumentParser(prog="python -m ghau", description="Github auto updater.")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+    parser_verify = commands.add_parser("verify", help="check the installed files against the release manifest")
+    parser_verify.add_argument("repo", help="github repository the program is released in")
+    parser_verify.add_argument("version", help="installed version")
+    parser_verify.add_argument("--dir", default=os.getcwd(), help="program directory, defaults to the current one")
+    parser_verify.add_argument("--repair", action="store_true", help="download and restore the drifted files")
+    parser_verify.add_argument("--whitelist", action="append",
+                               help="pattern of files expected to differ, can be repeated")
+    parser_verify.add_argument("--full", action="store_true",
+                               help="hash every file, ignoring the sizes and mtimes recorded by earlier runs")
+    parser_verify.add_argument("--workers", type=int, help="threads hashing files, defaults to the amount of CPUs")
+    parser_verify.add_argument("--cache-dir", help="cache directory, defaults to .ghau in the program directory")
+    parser_verify.add_argument("--api-url", default=api.API_URL, help=argparse.SUPPRESS)
+    parser_verify.add_argument("--metrics-file", help="file to export the timings of the run to")
+    parser_verify.add_argument("--debug", action="store_true", help="log debug messages")
+    parser_verify.set_defaults(run=verify)
+    parser_supervise = commands.add_parser("supervise", help="run a program, updating it without dropping connections")
+    parser_supervise.add_argument("repo", help="github repository the program is released in")
+    parser_supervise.add_argument("version", help="installed version")
+    parser_supervise.add_argument("command", nargs="+", help="command running the program, after a --")
+    parser_supervise.add_argument("--dir", default=os.getcwd(), help="program directory, defaults to the current one")
+    parser_supervise.add_argument("--listen", action="append",
+                                  help="socket passed to the program as name=host:port or name=unix:/path, "
+                                       "can be repeated")
+    parser_supervise.add_argument("--check-interval", type=float, default=3600,
+                                  help="seconds between update checks, defaults to 3600")
+    parser_supervise.add_argument("--webhook", metavar="ADDRESS",
+                                  help="listen for release webhooks on host:port, installing releases right away")
+    parser_supervise.add_argument("--staged", action="store_true",
+                                  help="stage updates next to the program directory, rolling back failed starts")
+    parser_supervise.add_argument("--whitelist", action="append", help="pattern of files to keep, can be repeated")
+    parser_supervise.add_argument("--ready-timeout", type=float, default=30,
+                                  help="seconds a new version has to become ready, defaults to 30")
+    parser_supervise.add_argument("--stop-timeout", type=float, default=10,
+                                  help="seconds an old version has to exit before it is killed, defaults to 10")
+    parser_supervise.add_argument("--cache-dir", help="cache directory, defaults to .ghau in the program directory")
+    parser_supervise.add_argument("--api-url", default=api.API_URL, help=argparse.SUPPRESS)
+    parser_supervise.add_argument("--metrics-file", help="file to export the timings of each update to")
+    parser_supervise.add_argument("--debug", action="store_true", help="log debug messages")
+    parser_supervise.set_defaults(run=supervise)
+    parser_patch = commands.add_parser("make-patch", help="create the binary patch between two versions of an asset")
+    parser_patch.add_argument("old", help="asset of the previous release")
+    parser_patch.add_argument("new", help="asset of the new release, the patch is named after it")
+    parser_patch.add_argument("from_tag", help="tag of the previous release")
+    parser_patch.add_argument("to_tag", help="tag of the new release")
+    parser_patch.add_argument("--out", default=os.getcwd(), help="directory to write the patch to")
+    parser_patch.add_argument("--block-size", type=int, default=256, help="size of the blocks matched, defaults to 256")
+    parser_patch.add_argument("--debug", action="store_true", help="log debug messages")
+    parser_patch.set_defaults(run=make_patch)
+    parser_send = commands.add_parser("send-webhook", help="post a recorded webhook payload to a listener")
+    parser_send.add_argument("url", help="url of the listener")
+    parser_send.add_argument("payload", help="file holding the JSON payload")
+    parser_send.add_argument("--event", default="release", help="name of the event, defaults to release")
+    parser_send.add_argument("--debug", action="store_true", help="log debug messages")
+    parser_send.set_defaults(run=send_webhook)
+    options = parser.parse_args(args)
+    options.auth = os.environ.get("GITHUB_TOKEN")  # read from the environment to keep it out of process listings.
+    options.webhook_secret = os.environ.get("GHAU_WEBHOOK_SECRET")
+    gf.log.setLevel(logging.DEBUG if options.debug else logging.INFO)
+    try:
+        return options.run(options)
+    except ge.GhauError as e:
+        gf.message(e.message, "critical")
+        return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,282 @@
+#  Copyright (c) 2020.  InValidFire
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+#  associated documentation files (the "Software"), to deal in the Software without restriction, including
+#  without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the
+#  following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all copies or substantial
+#  portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+#  CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+#  OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import time
+import hashlib
+import threading
+import functools
+from urllib.parse import quote
+
+import ghau.errors as ge
+import ghau.files as gf
+import ghau.lazy as lazy
+
+requests = lazy.module("requests")
+
+API_URL = "https://api.github.com"
+RAW_URL = "https://raw.githubusercontent.com"
+API_ACCEPT = "application/vnd.github.v3+json"
+_RATE_SECTION = "rate_limit"  # cache section of the tracked budgets, never a repository name as those contain a /.
+
+
+@functools.lru_cache(maxsize=None)
+def _timeout_adapter():
+    """Return the adapter class used by :func:`build_session`, defined on first use so requests is only loaded
+    once a session is needed."""
+    class _TimeoutAdapter(requests.adapters.HTTPAdapter):
+        """HTTPAdapter applying a default timeout to every request that does not set its own."""
+        def __init__(self, timeout, **kwargs):
+            self.timeout = timeout
+            super().__init__(**kwargs)
+
+        def send(self, request, **kwargs):
+            if kwargs.get("timeout") is None:
+                kwargs["timeout"] = self.timeout
+            return super().send(request, **kwargs)
+    return _TimeoutAdapter
+
+
+def build_session(auth: str = None, pool_size: int = 10, timeout=(5, 30)) -> "requests.Session":
+    """Build the connection pooled session shared by every network phase of an update.
+
+    :param auth: authentication token sent with every request, defaults to None.
+    :type auth: str, optional
+    :param pool_size: connections kept alive per host, defaults to 10.
+    :type pool_size: int, optional
+    :param timeout: default connect and read timeout in seconds, either a number or a (connect, read) tuple,
+        defaults to (5, 30).
+    :type timeout: float or tuple, optional"""
+    session = requests.Session()
+    adapter = _timeout_adapter()(timeout, pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    if auth is not None:
+        session.headers["Authorization"] = "token {}".format(auth)
+    return session
+
+
+_trackers_lock = threading.Lock()
+
+
+class _RateTracker:
+    """Response hook tracking the core rate limit budget reported by the API responses of a session.
+
+    Registered once per session and API url, so every client sharing the session shares the budget, which Github
+    counts per token, instead of each adding a hook handling every response."""
+    def __init__(self, api_url: str):
+        self.api_url = api_url
+        self.rate = None
+        self.lock = threading.Lock()
+
+    def __call__(self, r: "requests.Response", *args, **kwargs):
+        if not r.url.startswith(self.api_url) or "X-RateLimit-Remaining" not in r.headers:
+            return
+        if r.headers.get("X-RateLimit-Resource", "core") != "core":  # graphql and search have their own budgets.
+            return
+        self.set(int(r.headers["X-RateLimit-Remaining"]), int(r.headers.get("X-RateLimit-Reset", 0)),
+                 int(r.headers.get("X-RateLimit-Limit", 0)))
+
+    def set(self, remaining: int, reset: int, limit: int):
+        """Record the current core rate limit budget."""
+        with self.lock:
+            self.rate = {"remaining": remaining, "reset": reset, "limit": limit}
+
+
+def _rate_tracker(session: "requests.Session", api_url: str) -> _RateTracker:
+    """Return the rate tracker of the given session and API url, registering it on first use."""
+    with _trackers_lock:
+        trackers = session.__dict__.setdefault("_ghau_rate_trackers", {})
+        if api_url not in trackers:
+            trackers[api_url] = _RateTracker(api_url)
+            session.hooks["response"].append(trackers[api_url])
+        return trackers[api_url]
+
+
+class Client:
+    """Thin wrapper around the Github REST API, owning the HTTP session used throughout an update.
+
+    The session is shared by the rate limit check, the release lookup and the download, so connections are
+    kept alive and reused between them instead of doing a new TLS handshake for each phase.
+
+    Every GET is sent as a conditional request when a previous response for the same url is cached.
+    Github answers those with a 304 when nothing changed, which does not count against the rate limit,
+    so repeated update checks against an unchanged repository are free.
+
+    :param auth: authentication token used for accessing the Github API, defaults to None.
+    :type auth: str, optional
+    :param cache: cache used to store response bodies along with their ETag/Last-Modified headers.
+    :type cache: ghau.cache.Cache, optional
+    :param api_url: base url of the Github API, defaults to https://api.github.com.
+        Point this at a local server to test against a stand-in for Github.
+    :type api_url: str, optional
+    :param session: session to send requests through, defaults to one built by :func:`build_session`.
+        An injected session is used as is, so it must carry its own authentication and timeouts.
+    :type session: requests.Session, optional
+    :param pool_size: connections kept alive per host when building the session, defaults to 10.
+    :type pool_size: int, optional
+    :param timeout: default timeout in seconds when building the session, defaults to (5, 30).
+    :type timeout: float or tuple, optional
+    :param raw_url: base url single repository files are downloaded from, defaults to
+        https://raw.githubusercontent.com. Downloads from it don't count against the API rate limit.
+    :type raw_url: str, optional
+
+    The core rate limit budget is tracked from the X-RateLimit headers of every API response sent through the session,
+    including 304s and downloads, shared by every client using the same session, and persisted in the cache per
+    authentication token (or once for anonymous access, which Github limits per IP). See :meth:`rate_limit`.
+    """
+    def __init__(self, auth: str = None, cache=None, api_url: str = API_URL, session: "requests.Session" = None,
+                 pool_size: int = 10, timeout=(5, 30), raw_url: str = RAW_URL):
+        self.cache = cache
+        self.api_url = api_url.rstrip("/")
+        self.raw_url = raw_url.rstrip("/")
+        self.calls = 0  # requests sent to the API, including ones answered with a 304.
+        self.session = session if session is not None else build_session(auth, pool_size, timeout)
+        self.rate_key = "anonymous" if auth is None else hashlib.sha256(auth.encode()).hexdigest()[:16]
+        self._tracker = _rate_tracker(self.session, self.api_url)
+        cached_rate = cache.get(_RATE_SECTION, self.rate_key) if cache is not None else None
+        with self._tracker.lock:
+            if self._tracker.rate is None:
+                self._tracker.rate = cached_rate
+
+    @property
+    def rate(self):
+        """Core rate limit budget last reported for the session, as a dict with the remaining, reset and limit keys,
+        None if unknown."""
+        return self._tracker.rate
+
+    def _url(self, path: str) -> str:
+        """Build an absolute url from the given API path. Absolute urls are returned unchanged."""
+        if path.startswith("http://") or path.startswith("https://"):
+            return path
+        return self.api_url + "/" + path.lstrip("/")
+
+    def get(self, path: str, repo: str = None, cached: bool = True) -> tuple:
+        """Send a conditional GET request for the given path, serving the cached data on a 304.
+
+        :param path: API path or absolute url to request.
+        :type path: str
+        :param repo: repository the request is made for, used as the cache key and in error messages.
+        :type repo: str, optional
+        :param cached: look up and store the response in the cache, defaults to True.
+        :type cached: bool, optional
+
+        :returns tuple: the parsed response body and the url of the next page, if there is one.
+
+        :exception ghau.errors.GithubRateLimitError: Github refused the request because the rate limit is hit.
+        :exception ghau.errors.RepositoryNotFoundError: Github returned a 404 for the request."""
+        url = self._url(path)
+        use_cache = cached and self.cache is not None
+        entry = self.cache.get(repo, url) if use_cache else None
+        headers = {"Accept": API_ACCEPT}
+        if entry is not None:
+            if entry.get("etag") is not None:
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified") is not None:
+                headers["If-Modified-Since"] = entry["last_modified"]
+        r = self.session.get(url, headers=headers)
+        self.calls += 1
+        self._store_rate()
+        if r.status_code == 304 and entry is not None:
+            gf.message("Not modified, using cached response for {}".format(url), "debug")
+            return entry["data"], entry.get("next")
+        check_response(r, repo)
+        data = r.json()
+        next_url = r.links.get("next", {}).get("url")
+        if use_cache and ("ETag" in r.headers or "Last-Modified" in r.headers):
+            self.cache.set(repo, url, {"etag": r.headers.get("ETag"),
+                                       "last_modified": r.headers.get("Last-Modified"),
+                                       "next": next_url,
+                                       "data": data})
+        return data, next_url
+
+    def file_url(self, repo: str, ref: str, path: str) -> str:
+        """Return the url of a single file of the repository at the given ref."""
+        return "{}/{}/{}/{}".format(self.raw_url, repo, quote(ref, safe=""), quote(path))
+
+    def get_json(self, path: str, repo: str = None, cached: bool = True):
+        """Return the parsed body of a conditional GET request for the given path. See :meth:`get`."""
+        return self.get(path, repo, cached)[0]
+
+    def get_pages(self, path: str, repo: str, cached: bool = True) -> list:
+        """Return the combined items of every page of a paginated API listing, following the Link headers.
+
+        See :meth:`get`."""
+        items = []
+        url = path
+        while url is not None:
+            data, url = self.get(url, repo, cached)
+            items.extend(data)
+        return items
+
+    def _store_rate(self):
+        """Keep the tracked budget in the cache, so the next run knows it without asking the API."""
+        rate = self.rate
+        if self.cache is not None and rate is not None:
+            self.cache.set(_RATE_SECTION, self.rate_key, rate)
+
+    def set_rate(self, remaining: int, reset: int, limit: int):
+        """Record the current core rate limit budget.
+
+        :param remaining: requests left in the current window.
+        :type remaining: int
+        :param reset: time the window resets at, in seconds since the epoch.
+        :type reset: int
+        :param limit: requests allowed per window.
+        :type limit: int"""
+        self._tracker.set(remaining, reset, limit)
+        self._store_rate()
+
+    def rate_limit(self, refresh: bool = False) -> dict:
+        """Return the core rate limit budget, as a dict with the remaining, reset and limit keys.
+
+        The tracked budget is used while its window lasts. Once the window has reset, the full limit is available
+        again. The budget is only requested from the API when nothing is known about it yet, which does not count
+        against the rate limit.
+
+        :param refresh: request the budget from the API even if it is known, defaults to False.
+        :type refresh: bool, optional
+
+        :returns dict: the remaining requests, the reset time in seconds since the epoch and the limit per window."""
+        rate = self.rate
+        now = time.time()
+        if not refresh and rate is not None:
+            if rate["reset"] > now:
+                return rate
+            if rate["limit"] > 0:
+                return {"remaining": rate["limit"], "reset": int(now), "limit": rate["limit"]}
+        core = self.get_json("rate_limit", cached=False)["resources"]["core"]
+        self.set_rate(core["remaining"], core["reset"], core["limit"])
+        return self.rate
+
+    def save(self):
+        """Persist the response cache, if one is in use."""
+        if self.cache is not None:
+            self._store_rate()
+            self.cache.save()
+
+
+def check_response(r: "requests.Response", repo: str):
+    """Raise the matching ghau exception for an unsuccessful API response.
+
+    :exception ghau.errors.GithubRateLimitError: Github refused the request because the rate limit is hit.
+    :exception ghau.errors.RepositoryNotFoundError: Github returned a 404 for the request."""
+    if r.status_code in (403, 429) and r.headers.get("X-RateLimit-Remaining") == "0":
+        raise ge.GithubRateLimitError(int(r.headers.get("X-RateLimit-Reset", 0)))
+    if r.status_code == 404:
+        raise ge.RepositoryNotFoundError(repo)
+    r.raise_for_status()
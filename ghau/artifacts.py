@@ -0,0 +1,443 @@
+#  Copyright (c) 2020.  InValidFire
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+#  associated documentation files (the "Software"), to deal in the Software without restriction, including
+#  without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the
+#  following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all copies or substantial
+#  portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+#  CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+#  OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import os
+import sys
+import hmac
+import hashlib
+import argparse
+import uuid
+import http.server
+from urllib.parse import quote, unquote
+
+import ghau.api as api
+import ghau.files as gf
+import ghau.lazy as lazy
+
+requests = lazy.module("requests")
+
+_CHUNK = 1024 * 1024
+TOKEN_VARIABLE = "GHAU_ARTIFACT_TOKEN"  # environment variable holding the token allowing uploads to a server.
+
+
+def file_sha256(path: str) -> str:
+    """Return the SHA-256 hex digest of the given file."""
+    h = hashlib.sha256()
+    with open(path, "rb") as fd:
+        for block in iter(lambda: fd.read(_CHUNK), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _ref_path(repo: str, tag: str, name: str) -> str:
+    """Relative path of the reference naming the artifact of the given repository, tag and name."""
+    path = "/".join([quote(repo, safe="/"), quote(tag, safe=""), quote(name, safe="")])
+    if any(part in ("", ".", "..") for part in path.split("/")):
+        raise ValueError("invalid artifact reference {}".format(path))
+    return path
+
+
+def _copy_verified(src, dest: str, sha256: str) -> bool:
+    """Copy the given readable file object to dest through a uniquely named temporary file, keeping it only if its
+    SHA-256 matches the given digest."""
+    h = hashlib.sha256()
+    tmp_path = "{}.{}.part".format(dest, uuid.uuid4().hex)
+    with open(tmp_path, "wb") as fd:
+        for block in iter(lambda: src.read(_CHUNK), b""):
+            h.update(block)
+            fd.write(block)
+    if h.hexdigest() != sha256:
+        os.remove(tmp_path)
+        return False
+    os.replace(tmp_path, dest)
+    return True
+
+
+class ArtifactStore:
+    """Content addressed store of downloaded release artifacts, in a directory that can be shared between machines.
+
+    Artifacts are stored once under their SHA-256 in ``objects/``. Small reference files in ``refs/`` name the
+    artifact of a repository, tag and asset (``zipball`` for source archives), so artifacts without a published
+    checksum can be found too. Every file is written to a temporary name and renamed into place, so concurrent
+    writers on a network filesystem never see partial files. Retrieving an artifact refreshes its modification
+    time, and the least recently used ones are evicted once the store grows past max_size.
+
+    Artifacts without a published checksum, such as every ``zipball``, are only checked against the digest in
+    their reference, so whoever can write to the store decides what those installs contain. Only share the store
+    with machines trusted to publish releases.
+
+    :param path: directory of the store.
+    :type path: str
+    :param max_size: maximum total size of the stored artifacts in bytes, defaults to 1 GiB.
+    :type max_size: int, optional
+    """
+    def __init__(self, path: str, max_size: int = 1024 ** 3):
+        self.path = path
+        self.max_size = max_size
+        self.objects = os.path.join(path, "objects")
+        self.refs = os.path.join(path, "refs")
+
+    def _object_path(self, sha256: str) -> str:
+        """Path the artifact with the given SHA-256 is stored at."""
+        return os.path.join(self.objects, sha256[:2], sha256)
+
+    def lookup(self, repo: str, tag: str, name: str):
+        """Return the SHA-256 of the artifact stored for the given repository, tag and name, or None."""
+        try:
+            with open(os.path.join(self.refs, _ref_path(repo, tag, name)), "r") as fd:
+                return fd.read().strip()
+        except OSError:
+            return None
+
+    def has(self, sha256: str) -> bool:
+        """Return True if the artifact with the given SHA-256 is stored."""
+        return os.path.isfile(self._object_path(sha256))
+
+    def open(self, sha256: str):
+        """Open the artifact with the given SHA-256 for reading, marking it as recently used.
+        Returns None if it is not stored."""
+        path = self._object_path(sha256)
+        try:
+            fd = open(path, "rb")
+        except OSError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:  # read only share, eviction order is left as is.
+            pass
+        return fd
+
+    def get(self, repo: str, tag: str, name: str, dest: str, sha256: str = None) -> bool:
+        """Copy the stored artifact to dest, verifying its checksum.
+
+        :param repo: repository the artifact belongs to.
+        :type repo: str
+        :param tag: release tag of the artifact.
+        :type tag: str
+        :param name: asset name of the artifact, ``zipball`` for the source archive.
+        :type name: str
+        :param dest: file to copy the artifact to.
+        :type dest: str
+        :param sha256: published SHA-256 of the artifact, defaults to the digest recorded when it was stored.
+        :type sha256: str, optional
+
+        :returns bool: True if the artifact was found and copied to dest."""
+        sha256 = sha256 or self.lookup(repo, tag, name)
+        if sha256 is None:
+            return False
+        fd = self.open(sha256)
+        if fd is None:
+            return False
+        with fd:
+            if _copy_verified(fd, dest, sha256):
+                gf.message("Using cached artifact {} for {} {} {}".format(sha256, repo, tag, name), "debug")
+                return True
+        gf.message("Cached artifact {} is corrupt, removing it.".format(sha256), "info")
+        self._remove(self._object_path(sha256))
+        return False
+
+    def put(self, repo: str, tag: str, name: str, path: str, sha256: str = None) -> str:
+        """Store the given file as the artifact of the given repository, tag and name, then evict old artifacts.
+
+        :param path: downloaded file to store. It is copied, the file itself is left in place.
+        :type path: str
+        :param sha256: SHA-256 of the file, computed if not given.
+        :type sha256: str, optional
+
+        :returns str: the SHA-256 the artifact is stored under."""
+        sha256 = sha256 or file_sha256(path)
+        if not self.has(sha256):
+            with open(path, "rb") as fd:
+                self.put_object(sha256, fd)
+        self.put_ref(repo, tag, name, sha256)
+        self.evict()
+        return sha256
+
+    def put_object(self, sha256: str, src) -> bool:
+        """Store the contents of the given readable file object under the given SHA-256, if they match it."""
+        dest = self._object_path(sha256)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        return _copy_verified(src, dest, sha256)
+
+    def put_ref(self, repo: str, tag: str, name: str, sha256: str):
+        """Record the given SHA-256 as the artifact of the given repository, tag and name."""
+        ref = os.path.join(self.refs, _ref_path(repo, tag, name))
+        os.makedirs(os.path.dirname(ref), exist_ok=True)
+        tmp_path = "{}.{}.part".format(ref, uuid.uuid4().hex)
+        with open(tmp_path, "w") as fd:
+            fd.write(sha256)
+        os.replace(tmp_path, ref)
+
+    def evict(self):
+        """Remove the least recently used artifacts until the store fits in max_size."""
+        entries = []
+        for dirpath, _, filenames in os.walk(self.objects):
+            for filename in filenames:
+                if filename.endswith(".part"):  # still being written.
+                    continue
+                try:
+                    st = os.stat(os.path.join(dirpath, filename))
+                except OSError:  # evicted by another machine in the meantime.
+                    continue
+                entries.append((st.st_mtime, st.st_size, os.path.join(dirpath, filename)))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            gf.message("Evicting cached artifact {}".format(path), "debug")
+            self._remove(path)
+            total -= size
+
+    @staticmethod
+    def _remove(path: str):
+        """Remove the given file, if another process did not already."""
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class HttpArtifactStore:
+    """Client of an artifact store shared over HTTP by :func:`serve`, with the interface of :class:`ArtifactStore`.
+
+    A store that can't be reached is treated as a cache miss, so updates fall back to downloading from Github.
+
+    Uploads need the token the server was started with. Without one the store is only read from, and artifacts
+    downloaded from Github aren't shared.
+
+    :param url: base url of the artifact server.
+    :type url: str
+    :param session: session to send requests through, defaults to one built by :func:`ghau.api.build_session`,
+        without the Github token and with its default timeouts, so an unreachable server can't hang an update.
+    :type session: requests.Session, optional
+    :param token: token allowing uploads, defaults to the GHAU_ARTIFACT_TOKEN environment variable.
+    :type token: str, optional
+    """
+    def __init__(self, url: str, session: "requests.Session" = None, token: str = None):
+        self.url = url.rstrip("/")
+        self.session = session or api.build_session()
+        self.token = token or os.environ.get(TOKEN_VARIABLE)
+
+    def lookup(self, repo: str, tag: str, name: str):
+        """Return the SHA-256 of the artifact stored for the given repository, tag and name, or None."""
+        try:
+            r = self.session.get("{}/refs/{}".format(self.url, _ref_path(repo, tag, name)))
+        except requests.RequestException:
+            return None
+        return r.text.strip() if r.status_code == 200 else None
+
+    def get(self, repo: str, tag: str, name: str, dest: str, sha256: str = None) -> bool:
+        """Download the stored artifact to dest, verifying its checksum. See :meth:`ArtifactStore.get`."""
+        sha256 = sha256 or self.lookup(repo, tag, name)
+        if sha256 is None:
+            return False
+        try:
+            with self.session.get("{}/objects/{}".format(self.url, sha256), stream=True) as r:
+                if r.status_code != 200:
+                    return False
+                if _copy_verified(gf.ResponseReader(r), dest, sha256):
+                    gf.message("Using cached artifact {} for {} {} {}".format(sha256, repo, tag, name), "debug")
+                    return True
+        except requests.RequestException as e:
+            gf.message("Artifact server unavailable: {}".format(e), "info")
+        return False
+
+    def put(self, repo: str, tag: str, name: str, path: str, sha256: str = None) -> str:
+        """Upload the given file as the artifact of the given repository, tag and name. See :meth:`ArtifactStore.put`.
+        """
+        sha256 = sha256 or file_sha256(path)
+        if self.token is None:
+            gf.message("No artifact server token, not uploading {} {} {}".format(repo, tag, name), "debug")
+            return sha256
+        headers = {"Authorization": "Bearer {}".format(self.token)}
+        try:
+            with open(path, "rb") as fd:
+                self.session.put("{}/objects/{}".format(self.url, sha256), data=fd, headers=headers).raise_for_status()
+            r = self.session.put("{}/refs/{}".format(self.url, _ref_path(repo, tag, name)), data=sha256.encode(),
+                                 headers=headers)
+            if r.status_code == 409:
+                gf.message("Artifact server holds a different {} {} {}, keeping it".format(repo, tag, name), "warning")
+            else:
+                r.raise_for_status()
+        except requests.RequestException as e:
+            gf.message("Could not upload artifact to {}: {}".format(self.url, e), "info")
+        return sha256
+
+
+def open_store(location, session: "requests.Session" = None, max_size: int = 1024 ** 3):
+    """Return the artifact store at the given location.
+
+    :param location: directory of a local or shared store, url of an artifact server, or a store to use as is.
+    :type location: str or ghau.artifacts.ArtifactStore or ghau.artifacts.HttpArtifactStore
+    :param session: session used to reach an artifact server. It should not carry the Github token.
+    :type session: requests.Session, optional
+    :param max_size: maximum size of a directory store in bytes, defaults to 1 GiB.
+    :type max_size: int, optional"""
+    if not isinstance(location, str):
+        return location
+    if location.startswith("http://") or location.startswith("https://"):
+        return HttpArtifactStore(location, session)
+    return ArtifactStore(location, max_size)
+
+
+def _is_sha256(value: str) -> bool:
+    """Return True if the given value is a SHA-256 hex digest, so it can't be used to escape the store."""
+    return len(value) == 64 and all(c in "0123456789abcdef" for c in value)
+
+
+class _StoreHandler(http.server.BaseHTTPRequestHandler):
+    """Serves an :class:`ArtifactStore` at /objects/<sha256> and /refs/<repo>/<tag>/<name>.
+
+    Uploads need the server's token as a bearer token, and are refused when the server has none. References are
+    never overwritten, so once a release is published in the store it can't be swapped for other content."""
+    protocol_version = "HTTP/1.1"
+    store = None
+    token = None
+
+    def log_message(self, format, *args):
+        gf.message("Artifact server: " + format % args, "debug")
+
+    def _split(self) -> tuple:
+        """Split the request path into its kind, objects or refs, and the rest of the path."""
+        kind, _, rest = self.path.lstrip("/").partition("/")
+        return kind, rest
+
+    def _reply(self, code: int, body: bytes = b""):
+        """Send a response with the given status code and body."""
+        self.send_response(code)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _ref(self, rest: str):
+        """Return the repository, tag and name of a reference path, or None if it is not one."""
+        parts = [unquote(part) for part in rest.split("/")]
+        if len(parts) < 4:
+            return None
+        ref = ("/".join(parts[:-2]), parts[-2], parts[-1])
+        try:
+            _ref_path(*ref)
+        except ValueError:
+            return None
+        return ref
+
+    def do_GET(self):
+        kind, rest = self._split()
+        if kind == "refs":
+            ref = self._ref(rest)
+            sha256 = self.store.lookup(*ref) if ref is not None else None
+            return self._reply(200, sha256.encode()) if sha256 else self._reply(404)
+        fd = self.store.open(rest) if kind == "objects" and _is_sha256(rest) else None
+        if fd is None:
+            return self._reply(404)
+        with fd:
+            self.send_response(200)
+            self.send_header("Content-Length", str(os.fstat(fd.fileno()).st_size))
+            self.end_headers()
+            for block in iter(lambda: fd.read(_CHUNK), b""):
+                self.wfile.write(block)
+
+    def _authorized(self) -> bool:
+        """Return True if the request carries the token of the server."""
+        if self.token is None:
+            return False
+        expected = "Bearer {}".format(self.token).encode()
+        return hmac.compare_digest(expected, self.headers.get("Authorization", "").encode(errors="replace"))
+
+    def do_PUT(self):
+        kind, rest = self._split()
+        body = _LimitedReader(self.rfile, int(self.headers.get("Content-Length", 0)))
+        if not self._authorized():
+            body.drain()
+            return self._reply(403 if self.token is None else 401)
+        if kind == "objects" and _is_sha256(rest):
+            stored = self.store.put_object(rest, body)
+            body.drain()
+            self.store.evict()
+            return self._reply(201 if stored else 400)
+        if kind == "refs":
+            ref = self._ref(rest)
+            sha256 = body.read(128).decode(errors="replace").strip()
+            if ref is not None and _is_sha256(sha256) and self.store.has(sha256):
+                body.drain()
+                current = self.store.lookup(*ref)
+                if current is not None and current != sha256:
+                    gf.message("Refused to overwrite artifact reference {}".format("/".join(ref)), "warning")
+                    return self._reply(409)
+                if current is None:
+                    self.store.put_ref(*ref, sha256)
+                return self._reply(201)
+        body.drain()
+        self._reply(400)
+
+
+class _LimitedReader:
+    """Reads at most the given amount of bytes from a request body."""
+    def __init__(self, fd, length: int):
+        self.fd = fd
+        self.left = length
+
+    def read(self, size: int) -> bytes:
+        data = self.fd.read(min(size, self.left)) if self.left > 0 else b""
+        self.left -= len(data)
+        return data
+
+    def drain(self):
+        while self.read(_CHUNK):
+            pass
+
+
+def serve(path: str, host: str = "127.0.0.1", port: int = 8750, max_size: int = 1024 ** 3, token: str = None):
+    """Share the artifact store in the given directory over HTTP until interrupted.
+
+    Point the artifact_cache option of :class:`ghau.update.Update` at ``http://<host>:<port>`` on every machine
+    of a fleet, so each release is downloaded from Github once. Machines allowed to fill the store need the token
+    in their GHAU_ARTIFACT_TOKEN environment variable. Installs of artifacts without a published checksum trust the
+    store, see :class:`ArtifactStore`.
+
+    :param path: directory of the store.
+    :type path: str
+    :param host: address to listen on, defaults to 127.0.0.1. Only listen on other interfaces within a trusted
+        network.
+    :type host: str, optional
+    :param port: port to listen on, defaults to 8750.
+    :type port: int, optional
+    :param max_size: maximum total size of the stored artifacts in bytes, defaults to 1 GiB.
+    :type max_size: int, optional
+    :param token: token clients need to upload artifacts, defaults to a read only server.
+    :type token: str, optional"""
+    handler = type("StoreHandler", (_StoreHandler,), {"store": ArtifactStore(path, max_size), "token": token})
+    server = http.server.ThreadingHTTPServer((host, port), handler)
+    gf.message("Serving artifacts from {} on {}:{}{}".format(path, host, port, "" if token else ", read only"), "info")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m ghau.artifacts", description="Share a ghau artifact store.")
+    parser.add_argument("path", help="directory of the store")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on, defaults to 127.0.0.1")
+    parser.add_argument("--port", type=int, default=8750)
+    parser.add_argument("--max-size", type=int, default=1024 ** 3, help="maximum store size in bytes")
+    args = parser.parse_args(sys.argv[1:])
+    # the upload token is read from the environment to keep it out of process listings.
+    serve(args.path, args.host, args.port, args.max_size, os.environ.get(TOKEN_VARIABLE))
@@ -0,0 +1,219 @@
+#  Copyright (c) 2020.  InValidFire
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+#  associated documentation files (the "Software"), to deal in the Software without restriction, including
+#  without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the
+#  following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all copies or substantial
+#  portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+#  CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+#  OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import re
+import sys
+import threading
+import collections
+
+import ghau.errors as ge
+import ghau.files as gf
+import ghau.lazy as lazy
+import ghau.patch as gp
+
+platform = lazy.module("platform")
+
+CHECKSUM_LISTS = ["SHA256SUMS", "SHA256SUMS.txt", "sha256sums.txt", "checksums.txt"]
+_PLACEHOLDER = re.compile(r"\{(\w+)\}")
+_SYSTEMS = {
+    "linux": ["linux"],
+    "darwin": ["macos", "darwin", "osx", "apple-darwin", "mac"],
+    "win32": ["windows", "win64", "win32", "win", "pc-windows"],
+}
+_MACHINES = {
+    "x86_64": ["x86_64", "amd64", "x64", "x86-64"],
+    "aarch64": ["aarch64", "arm64"],
+    "i386": ["i386", "i686", "x86", "386", "win32"],
+    "armv7l": ["armv7l", "armv7", "armhf", "arm"],
+}
+_MACHINE_ALIASES = {"amd64": "x86_64", "arm64": "aarch64", "i686": "i386", "x86": "i386"}
+
+Asset = collections.namedtuple("Asset", ["name", "url", "size", "sha256"])
+Asset.__doc__ = """Release asset picked by :meth:`AssetIndex.select`: its name, download url, size and SHA-256, which is
+None if the release doesn't publish one."""
+
+
+def _system_names(system: str) -> list:
+    """Names the given sys.platform value goes by in asset names."""
+    for key, names in _SYSTEMS.items():
+        if system.startswith(key):
+            return names
+    return [system]
+
+
+def _machine_names(machine: str) -> list:
+    """Names the given platform.machine() value goes by in asset names."""
+    machine = machine.lower()
+    return _MACHINES.get(_MACHINE_ALIASES.get(machine, machine), [machine])
+
+
+class AssetIndex:
+    """Index of the assets of a release, built from the asset list already included in the release data.
+
+    Picking an asset doesn't cost any API request. Asset names are looked up as:
+
+    - a compiled regular expression, matched against the whole name.
+    - an exact name.
+    - a pattern with shell style wildcards (``*``, ``?``, ``[seq]``) and placeholders: ``{version}`` (the tag without
+      a leading v), ``{tag}``, ``{os}`` and ``{arch}``. The platform placeholders match the usual names of the
+      running platform, so ``myapp-{version}-{os}-{arch}.tar.gz`` matches ``myapp-2.1.0-linux-amd64.tar.gz`` on a
+      64 bit Linux machine. Placeholders are matched case insensitively.
+
+    Binary patches (see :mod:`ghau.patch`) are only found by their exact name.
+
+    :param release: release data, as returned by the Github API.
+    :type release: dict
+    :param assets: asset list of the release, defaults to the one included in the release data.
+    :type assets: list, optional
+    :param system: platform used for the {os} placeholder, defaults to sys.platform.
+    :type system: str, optional
+    :param machine: architecture used for the {arch} placeholder, defaults to platform.machine().
+    :type machine: str, optional
+    """
+    def __init__(self, release: dict, assets: list = None, system: str = None, machine: str = None):
+        self.tag = release["tag_name"]
+        self.assets = release.get("assets", []) if assets is None else assets
+        self.names = {asset["name"]: asset for asset in self.assets}
+        self.placeholders = {
+            "tag": [self.tag],
+            "version": [self.tag[1:] if self.tag[:1] in ("v", "V") else self.tag],
+            "os": _system_names(system or sys.platform),
+            "arch": _machine_names(machine or platform.machine()),
+        }
+        self._checksums = {}  # checksum listing name to its parsed contents.
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.assets)
+
+    def find(self, pattern=None) -> dict:
+        """Return the data of the first asset matching the given pattern. Without a pattern, the first asset that
+        isn't a checksum listing is returned.
+
+        :param pattern: exact name, pattern or compiled regular expression to look for.
+        :type pattern: str or re.Pattern, optional
+
+        :exception ghau.errors.ReleaseAssetError: No asset matches the pattern."""
+        if pattern is None:
+            candidates = [asset for asset in self.assets
+                          if not self._is_checksum(asset["name"]) and not gp.is_patch(asset["name"])]
+        elif isinstance(pattern, str) and pattern in self.names:
+            candidates = [self.names[pattern]]
+        else:
+            regex = pattern if not isinstance(pattern, str) else self._compile(pattern)
+            candidates = [asset for asset in self.assets
+                          if regex.fullmatch(asset["name"]) and not gp.is_patch(asset["name"])]
+        if len(candidates) == 0:
+            raise ge.ReleaseAssetError(self.tag, getattr(pattern, "pattern", pattern))
+        if len(candidates) > 1:
+            gf.message("{} assets match {}, using {}".format(len(candidates), pattern, candidates[0]["name"]), "debug")
+        gf.message("Found asset {} with URL: {}".format(candidates[0]["name"], candidates[0]["browser_download_url"]),
+                   "debug")
+        return candidates[0]
+
+    def select(self, pattern=None, session=None) -> Asset:
+        """Return the url, size and SHA-256 of the first asset matching the given pattern. See :meth:`find`.
+
+        The SHA-256 is taken from the digest Github reports for the asset, or else from a published
+        ``<asset>.sha256`` file or checksum listing such as ``SHA256SUMS``, downloaded at most once per index.
+
+        :param pattern: exact name, pattern or compiled regular expression to look for.
+        :type pattern: str or re.Pattern, optional
+        :param session: session checksum files are downloaded through.
+        :type session: requests.Session, optional
+
+        :exception ghau.errors.ReleaseAssetError: No asset matches the pattern."""
+        asset = self.find(pattern)
+        return Asset(asset["name"], asset["browser_download_url"], asset["size"], self.checksum(asset, session))
+
+    def checksum(self, asset: dict, session=None):
+        """Return the SHA-256 published for the given asset, or None if there is none."""
+        digest = asset.get("digest") or ""
+        if digest.startswith("sha256:"):
+            return digest[len("sha256:"):].lower()
+        if session is None:
+            return None
+        name = asset["name"]
+        for listing in [name + ".sha256", name + ".sha256sum"] + CHECKSUM_LISTS:
+            if listing not in self.names:
+                continue
+            sums = self._load_checksums(listing, session)
+            checksum = sums.get(name, sums.get(None)) if listing.startswith(name) else sums.get(name)
+            if checksum is not None:
+                gf.message("Found SHA-256 for {} in {}".format(name, listing), "debug")
+                return checksum
+        return None
+
+    def _load_checksums(self, listing: str, session) -> dict:
+        """Download and parse a checksum file in the sha256sum output format, mapping file names to their SHA-256.
+        A bare hash is stored under None."""
+        with self._lock:
+            if listing not in self._checksums:
+                r = session.get(self.names[listing]["browser_download_url"])
+                r.raise_for_status()
+                sums = {}
+                for line in r.text.splitlines():
+                    parts = line.split()
+                    if len(parts) == 1:
+                        sums[None] = parts[0].lower()
+                    elif len(parts) == 2:
+                        sums[parts[1].lstrip("*")] = parts[0].lower()
+                self._checksums[listing] = sums
+            return self._checksums[listing]
+
+    @staticmethod
+    def _is_checksum(name: str) -> bool:
+        """Return True if the given asset name is a checksum file."""
+        return name in CHECKSUM_LISTS or name.endswith(".sha256") or name.endswith(".sha256sum")
+
+    def _compile(self, pattern: str):
+        """Translate a pattern with wildcards and placeholders into a regular expression."""
+        parts = []
+        for i, piece in enumerate(_PLACEHOLDER.split(pattern)):
+            if i % 2 == 1 and piece in self.placeholders:
+                names = sorted(self.placeholders[piece], key=len, reverse=True)  # longest alias first.
+                parts.append("(?i:{})".format("|".join(re.escape(name) for name in names)))
+            elif i % 2 == 1:  # unknown placeholder, kept literally.
+                parts.append(re.escape("{" + piece + "}"))
+            else:
+                parts.append(_translate(piece))
+        return re.compile("".join(parts))
+
+
+def _translate(pattern: str) -> str:
+    """Translate shell style wildcards into a regular expression. Asset names have no directories, so unlike
+    :func:`ghau.files._translate` a * matches anything."""
+    regex = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "*":
+            regex.append(".*")
+        elif c == "?":
+            regex.append(".")
+        elif c == "[" and pattern.find("]", i + 2) != -1:
+            end = pattern.find("]", i + 2)
+            body = pattern[i + 1:end]
+            if body.startswith("!"):
+                body = "^" + body[1:]
+            regex.append("[{}]".format(body.replace("\\", "\\\\")))
+            i = end
+        else:
+            regex.append(re.escape(c))
+        i += 1
+    return "".join(regex)
@@ -0,0 +1,73 @@
+#  Copyright (c) 2020.  InValidFire
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+#  associated documentation files (the "Software"), to deal in the Software without restriction, including
+#  without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the
+#  following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all copies or substantial
+#  portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+#  CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+#  OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import os
+import json
+import uuid
+import threading
+
+import ghau.files as gf
+
+
+class Cache:
+    """Small on-disk JSON store used to keep metadata between update checks.
+
+    Entries are grouped in sections (usually the repository name) and only written to disk when
+    :meth:`save` is called. A missing or unreadable cache file is treated as an empty cache. Safe to share between
+    threads.
+
+    :param path: file to load the cache from and save it to.
+    :type path: str
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.data = self._load()
+        self._lock = threading.RLock()
+
+    def _load(self) -> dict:
+        """Load the cache file, returning an empty cache if it does not exist or is corrupt."""
+        try:
+            with open(self.path, "r") as fd:
+                data = json.load(fd)
+        except (OSError, ValueError):
+            gf.message("No usable cache found at {}".format(self.path), "debug")
+            return {}
+        if not isinstance(data, dict):
+            return {}
+        return data
+
+    def get(self, section: str, key: str, default=None):
+        """Return the cached value stored under the given section and key."""
+        with self._lock:
+            return self.data.get(section, {}).get(key, default)
+
+    def set(self, section: str, key: str, value):
+        """Store a value under the given section and key."""
+        with self._lock:
+            self.data.setdefault(section, {})[key] = value
+
+    def save(self):
+        """Write the cache to disk. The file is replaced atomically so a crash never leaves it half written."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = "{}.{}.tmp".format(self.path, uuid.uuid4().hex)  # unique, as other processes may save too.
+        with self._lock:
+            text = json.dumps(self.data, separators=(",", ":"))
+        with open(tmp_path, "w") as fd:
+            fd.write(text)
+        os.replace(tmp_path, self.path)
+        gf.message("Saved cache to {}".format(self.path), "debug")
@@ -0,0 +1,260 @@
+#  Copyright (c) 2020.  InValidFire
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+#  associated documentation files (the "Software"), to deal in the Software without restriction, including
+#  without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the
+#  following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all copies or substantial
+#  portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+#  CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+#  OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Supervisor running a program as a child process, updating it without dropping connections.
+
+The supervisor owns the program's listening sockets and passes them to each version of the program it starts,
+through file descriptor inheritance. When an update is installed, the new version is started on the same sockets
+and the old one is only stopped once the new one is ready, so connections are never refused: both versions accept
+from the same socket while they overlap and the socket itself is never closed.
+
+Programs pick up their sockets with :func:`inherited_sockets` and signal they are ready with :func:`notify_ready`::
+
+    sockets = ghau.daemon.inherited_sockets()
+    server = make_server(sockets["http"])
+    ghau.daemon.notify_ready()
+    server.serve_forever()
+
+Only available on POSIX systems.
+"""
+import os
+import sys
+import time
+import signal
+import threading
+
+import ghau.files as gf
+import ghau.lazy as lazy
+
+socket = lazy.module("socket")
+select = lazy.module("select")
+subprocess = lazy.module("subprocess")
+
+LISTEN_FDS = "GHAU_LISTEN_FDS"  # inherited sockets, as comma separated name=fd pairs.
+READY_FD = "GHAU_READY_FD"  # pipe the program writes to once it's ready.
+SUPERVISED = "GHAU_SUPERVISED"  # set for programs run by a supervisor, which handles their updates.
+_MAX_RESTART_DELAY = 60
+
+
+def supervised() -> bool:
+    """Return True if this process was started by a :class:`Supervisor`, which handles its updates."""
+    return os.environ.get(SUPERVISED) == "1"
+
+
+def listen(address: str, backlog: int = 128) -> "socket.socket":
+    """Open a listening socket on the given address.
+
+    :param address: ``host:port``, ``[ipv6 host]:port`` or ``unix:/path/of/socket``.
+    :type address: str
+    :param backlog: connections queued before the program accepts them, defaults to 128.
+    :type backlog: int, optional"""
+    if address.startswith("unix:"):
+        path = address[len("unix:"):]
+        if os.path.exists(path):
+            os.remove(path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(path)
+    else:
+        host, _, port = address.rpartition(":")
+        host = host.strip("[]")
+        family = socket.AF_INET6 if ":" in host else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host, int(port)))
+    sock.listen(backlog)
+    return sock
+
+
+def inherited_sockets() -> dict:
+    """Return the listening sockets passed on by the supervisor, by name. Empty when not supervised.
+
+    :returns dict: socket name to :class:`socket.socket`."""
+    sockets = {}
+    for pair in filter(None, os.environ.get(LISTEN_FDS, "").split(",")):
+        name, _, fd = pair.rpartition("=")
+        sockets[name] = socket.socket(fileno=int(fd))
+    return sockets
+
+
+def notify_ready():
+    """Tell the supervisor this version of the program is ready to serve, so it can stop the previous one.
+
+    Does nothing when not supervised. Programs that never call it are considered ready once the supervisor's ready
+    timeout passes."""
+    fd = os.environ.pop(READY_FD, None)
+    if fd is None:
+        return
+    try:
+        os.write(int(fd), b"1")
+        os.close(int(fd))
+    except OSError:
+        pass
+
+
+class Supervisor:
+    """Runs a program as a child process, checks for updates on the schedule of the given
+    :class:`ghau.update.Update` and switches to each installed version without dropping connections.
+
+    The program is restarted if it exits on its own, waiting restart_delay seconds, doubled on every consecutive
+    quick exit. SIGHUP restarts it the same way as an update, SIGTERM and SIGINT stop it along with the supervisor.
+
+    :param update: update configuration of the program. Its check_interval sets how often updates are checked,
+        defaulting to hourly when not set. The update keeps the installed version in its cache, so it is used instead
+        of the given version after a restart unless the given one is newer.
+    :type update: ghau.update.Update
+    :param command: command starting the program, as a list of arguments. Run in the program directory.
+    :type command: list
+    :param sockets: listening sockets passed to the program, by name. See :func:`listen`.
+    :type sockets: dict, optional
+    :param ready_timeout: seconds to wait for a new version to call :func:`notify_ready`, defaults to 30.
+        A version still running after it is considered ready.
+    :type ready_timeout: float, optional
+    :param stop_timeout: seconds a version has to exit after SIGTERM before it is killed, defaults to 10.
+    :type stop_timeout: float, optional
+    :param restart_delay: seconds before restarting a program that exited, defaults to 1.
+    :type restart_delay: float, optional
+    :param webhook: listener receiving release webhooks, each release it receives is installed right away instead
+        of waiting for the next scheduled check. Started by :meth:`run`.
+    :type webhook: ghau.webhook.WebhookListener, optional
+    """
+    def __init__(self, update, command: list, sockets: dict = None, ready_timeout: float = 30,
+                 stop_timeout: float = 10, restart_delay: float = 1, webhook=None):
+        self.update = update
+        self.command = command
+        self.sockets = sockets or {}
+        self.ready_timeout = ready_timeout
+        self.stop_timeout = stop_timeout
+        self.restart_delay = restart_delay
+        self.webhook = webhook
+        self.child = None
+        if update.schedule.interval <= 0:
+            update.schedule.interval = 3600
+        self._stop = threading.Event()
+        self._reload = threading.Event()
+
+    def run(self):
+        """Start the program and supervise it until stopped by SIGTERM, SIGINT or :meth:`stop`."""
+        signal.signal(signal.SIGTERM, lambda *args: self.stop())
+        signal.signal(signal.SIGINT, lambda *args: self.stop())
+        signal.signal(signal.SIGHUP, lambda *args: self._reload.set())
+        if self.webhook is not None:
+            self.webhook.start()
+        delay = self.restart_delay
+        self.child = self._start()
+        started = time.monotonic()
+        release = None
+        try:
+            while not self._stop.is_set():
+                release = self._wait() or release
+                if self._stop.is_set():
+                    break
+                if self.child is None or self.child.poll() is not None:
+                    code = None if self.child is None else self.child.returncode
+                    gf.message("Program exited with {}, restarting in {:.0f}s".format(code, delay), "warning")
+                    if self._stop.wait(delay):
+                        break
+                    delay = delay * 2 if time.monotonic() - started < _MAX_RESTART_DELAY else self.restart_delay
+                    delay = min(delay, _MAX_RESTART_DELAY)
+                    self.child = self._start()
+                    started = time.monotonic()
+                    continue
+                if self._reload.is_set():
+                    self._reload.clear()
+                    self.replace()
+                if release is not None or self.update.schedule.due():
+                    self._update(release)
+                    release = None
+        finally:
+            if self.webhook is not None:
+                self.webhook.stop()
+            self._retire(self.child)
+
+    def stop(self):
+        """Stop the program and the supervisor."""
+        self._stop.set()
+
+    def _wait(self):
+        """Wait a second between two rounds of :meth:`run`, returning the release received by the webhook listener
+        in the meantime if any."""
+        if self.webhook is None:
+            self._stop.wait(1)
+            return None
+        return self.webhook.wait(1)
+
+    def _update(self, release: dict = None):
+        """Install an update if there is one and switch to it. When the new version fails to start, the running one
+        is kept, and a staged install is rolled back and its release skipped by later checks.
+
+        :param release: release received by the webhook listener, checked instead of looking up the latest one."""
+        previous = self.update.version
+        pending = self.update.update(reboot=False, release=release)
+        if pending is None:
+            return
+        if not self.replace() and self.update.staged:
+            gf.message("{} failed to start, rolling back to {}".format(pending.tag, previous), "warning")
+            self.update.rollback(skip=True)
+
+    def replace(self) -> bool:
+        """Start a new instance of the program and stop the running one once the new one is ready.
+
+        :returns bool: False if the new instance exited before being ready, the running one is kept then."""
+        child = self._start()
+        if child is None:
+            return False
+        gf.message("Started {} (pid {}), stopping pid {}".format(self.command[0], child.pid,
+                                                                 getattr(self.child, "pid", None)), "info")
+        self._retire(self.child)
+        self.child = child
+        return True
+
+    def _start(self):
+        """Start the program on the sockets and wait until it's ready. Returns None if it exited before that."""
+        env = dict(os.environ)
+        env[SUPERVISED] = "1"
+        env[LISTEN_FDS] = ",".join("{}={}".format(name, sock.fileno()) for name, sock in self.sockets.items())
+        ready_read, ready_write = os.pipe()
+        env[READY_FD] = str(ready_write)
+        fds = [sock.fileno() for sock in self.sockets.values()] + [ready_write]
+        try:
+            child = subprocess.Popen(self.command, cwd=self.update.program_dir, env=env, pass_fds=fds)
+        finally:
+            os.close(ready_write)
+        try:
+            ready, _, _ = select.select([ready_read], [], [], self.ready_timeout)
+            if ready and os.read(ready_read, 1) == b"":  # closed without notifying, the program most likely exited.
+                child.wait(self.ready_timeout)
+        except subprocess.TimeoutExpired:
+            pass
+        finally:
+            os.close(ready_read)
+        if child.poll() is not None:
+            gf.message("{} exited with {} before being ready".format(self.command[0], child.returncode), "warning")
+            return None
+        return child
+
+    def _retire(self, child):
+        """Stop the given instance of the program, killing it if it doesn't exit within the stop timeout."""
+        if child is None or child.poll() is not None:
+            return
+        child.terminate()
+        try:
+            child.wait(self.stop_timeout)
+        except subprocess.TimeoutExpired:
+            gf.message("Pid {} didn't exit within {}s, killing it".format(child.pid, self.stop_timeout), "warning")
+            child.kill()
+            child.wait()
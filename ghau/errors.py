@@ -18,9 +18,6 @@
 
 import datetime
 
-from github import Github
-from wcmatch import wcmatch
-
 import ghau.files as files
 
 
@@ -38,6 +35,7 @@ class GitRepositoryFoundError(GhauError):
 class GithubRateLimitError(GhauError):
     """Raised when exceeding GitHub's API rate."""
     def __init__(self, resettime):
+        self.resettime = resettime
         self.message = ("Current Github API rate limit reached. Cannot check for updates at this time.\n" 
                         "Scheduled to reset on " +
                         datetime.datetime.fromtimestamp(resettime).strftime('%B %d at %H:%M:%S'))
@@ -73,6 +71,18 @@ class InvalidDownloadTypeError(GhauError):
         self.message = ("'download' parameter value '{}' is not expected.".format(download))
 
 
+class InvalidVersionConstraintError(GhauError):
+    """Raised when the version constraint given to :class:`ghau.update.Update` can't be parsed."""
+    def __init__(self, constraint):
+        self.message = ("Version constraint '{}' is not valid.".format(constraint))
+
+
+class ManifestNotFoundError(GhauError):
+    """Raised when no file manifest is available to verify the installed release against."""
+    def __init__(self, tag: str):
+        self.message = ("No file manifest available for release {}, its file tree is too large.".format(tag))
+
+
 class FileNotExeError(GhauError):
     """Raised when the file given is not an executable."""
     def __init__(self, file: str):
@@ -91,6 +101,30 @@ class LoopPreventionError(GhauError):
         self.message = "Booting after update install, skipping update check."
 
 
+class DownloadVerificationError(GhauError):
+    """Raised when a downloaded file does not match its expected size or checksum."""
+    def __init__(self, file: str, expected: str, actual: str):
+        self.message = ("Download of '{}' failed verification, expected {} but got {}.".format(file, expected, actual))
+
+
+class PatchError(GhauError):
+    """Raised when a binary patch can't be applied, see :func:`ghau.patch.apply`."""
+    def __init__(self, patch: str, reason: str):
+        self.message = ("Binary patch '{}' could not be applied: {}.".format(patch, reason))
+
+
+class UpdateCancelledError(GhauError):
+    """Raised when a background update check is cancelled or runs out of time."""
+    def __init__(self):
+        self.message = "Update check cancelled."
+
+
+class NoPreviousVersionError(GhauError):
+    """Raised when rolling back without a previous version kept by a staged install."""
+    def __init__(self, path: str):
+        self.message = ("No previous version found at '{}' to roll back to.".format(path))
+
+
 class NoPureWildcardsAllowedError(GhauError):
     """Raised when a pure '*' entry is found in either the whitelist or cleanlist. This is to protect programs
      from accidentally wiping too much. Be more specific in your searches."""
@@ -98,28 +132,41 @@ class NoPureWildcardsAllowedError(GhauError):
         self.message = ("Found a pure '*' entry in the {} list. Please remove it.".format(listname))
 
 
-def devtest(root):  # TODO Improve dev environment detection
+def devtest(root, scan=None):  # TODO Improve dev environment detection
     """Tests for an active dev environment.
 
+    :param root: program directory to test.
+    :type root: str
+    :param scan: result of a :func:`ghau.files.scan` of the root that already checked for a dev environment,
+        saving another walk of the directory.
+    :type scan: ghau.files.ScanResult, optional
+
     :exception ghau.errors.GitRepositoryFoundError: stops the update process if a .git folder is found within
      the program directory"""
-    pl = wcmatch.WcMatch(root, ".git/*", "", flags=wcmatch.RECURSIVE | wcmatch.DIRPATHNAME | wcmatch.FILEPATHNAME |
-                         wcmatch.HIDDEN).match()
-    if len(pl) > 0:
+    if scan is None:
+        scan = files.scan(root)
+    if scan.dev:
         raise GitRepositoryFoundError
 
 
-def ratetest(ratemin: int, token=None):
+def ratetest(ratemin: int, client):
     """Tests available Github API rate.
 
+    Uses the budget tracked from previous API responses, so this normally does not touch the network.
+    See :meth:`ghau.api.Client.rate_limit`.
+
+    :param ratemin: minimum amount of API requests left before updates will stop.
+    :type ratemin: int
+    :param client: client tracking the rate limit.
+    :type client: ghau.api.Client
+
     :exception ghau.errors.GithubRateLimitError: stops the update process if the available rates are below
      the ratemin."""
-    g = Github(token)
-    rl = g.get_rate_limit()
-    if rl.core.remaining <= ratemin:
-        raise GithubRateLimitError(rl.core.reset.timestamp())
+    core = client.rate_limit()
+    if core["remaining"] <= ratemin:
+        raise GithubRateLimitError(core["reset"])
     else:
-        files.message("API requests remaining: " + str(rl.core.remaining), "info")
+        files.message("API requests remaining: " + str(core["remaining"]), "info")
 
 
 def argtest(args: list, arg: str):
@@ -17,135 +17,849 @@
 #  OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 import os
+import re
 import sys
+import json
+import time
+import zlib
 import shutil
-import zipfile
+import struct
+import hashlib
 import logging
+import threading
+import functools
+import collections
 
-import requests
-from wcmatch import wcmatch
+import ghau.errors as errors
+import ghau.fsplan as fsplan
+import ghau.lazy as lazy
+
+requests = lazy.module("requests")
+urllib3 = lazy.module("urllib3")
+zipfile = lazy.module("zipfile")
+futures = lazy.module("concurrent.futures")
 
 log = logging.getLogger("ghau")
-log.addHandler(logging.StreamHandler)
+log.addHandler(logging.StreamHandler())
+
+_MIN_CHUNK = 64 * 1024  # download read sizes adapt between these bounds.
+_MAX_CHUNK = 4 * 1024 * 1024
+_CHUNK_TARGET_TIME = 0.25  # seconds a single download read should take.
+_SEGMENT_MIN_SIZE = 16 * 1024 * 1024  # smaller files aren't worth splitting into segments.
 
-def message(msg, mode: str = "debug"):  # TODO: Change to utilize 'logging' module, much more flexible.
-    """Sends a message to the console if send is true. Used to easily control debug and error message output."""
+def message(msg, mode: str = "debug"):
+    """Sends the given message to the ghau logger at the level of the given mode. Used to easily control debug and
+    error message output.
+
+    :param msg: message to log.
+    :type msg: str
+    :param mode: debug, info, warning, critical or exception, defaults to debug.
+    :type mode: str, optional"""
     if mode == "debug":
-        log.debug(message)
+        log.debug(msg)
     elif mode == "info":
-        log.info(message)
+        log.info(msg)
     elif mode == "warning":
-        log.warning(message)
+        log.warning(msg)
     elif mode == "critical":
-        log.critical(message)
+        log.critical(msg)
     elif mode == "exception":
-        log.exception(message)
+        log.exception(msg)
 
 
-def download(url: str, save_file: str, debug: bool):
+def download(url: str, save_file: str, debug: bool, session: "requests.Session" = None, size: int = None,
+             sha256: str = None, progress_interval: float = 1.0, cancel: threading.Event = None):
     """Download a file from the given url and save it to the given save_file.
 
+    The file is streamed into a temporary ``.part`` file next to save_file using adaptive read sizes. If a
+    ``.part`` file is left over from an interrupted download of the same url, the transfer is resumed from where it
+    stopped using an HTTP Range request, conditional on the ETag or Last-Modified recorded next to it in a
+    ``.part.json`` file. Leftovers of another url, without a validator, or of a file that changed since are
+    discarded. Once complete, its size and SHA-256 are verified and it is atomically renamed into place, so
+    save_file is never left half written.
+
     :param url: url of the file to download.
     :type url: str
     :param save_file: file to save the downloaded to.
     :type save_file: str
     :param debug: send debug messages
-    :type debug: bool"""
-    r = requests.get(url, stream=True)
-    with open(save_file, "wb") as fd:
-        i = 0
-        for chunk in r.iter_content(chunk_size=512):
-            if chunk:
-                i += 1
+    :type debug: bool
+    :param session: session to download through, reusing its pooled connections. Defaults to a one-off request.
+    :type session: requests.Session, optional
+    :param size: expected size of the file in bytes, defaults to the size reported by the server.
+    :type size: int, optional
+    :param sha256: expected SHA-256 hex digest of the file, skips the hash check if not given.
+    :type sha256: str, optional
+    :param progress_interval: minimum amount of seconds between progress messages, defaults to 1.
+    :type progress_interval: float, optional
+    :param cancel: event stopping the download when set. The partial file is kept so it can be resumed.
+    :type cancel: threading.Event, optional
+
+    :returns int: bytes transferred, which excludes the part of a resumed download that was already on disk.
+
+    :exception ghau.errors.DownloadVerificationError: the downloaded file does not match the expected size or hash.
+    :exception ghau.errors.UpdateCancelledError: the given cancel event was set."""
+    part_file = save_file + ".part"
+    validator = _part_validator(part_file, url)
+    offset = os.path.getsize(part_file) if validator is not None else 0
+    headers = {"Range": "bytes={}-".format(offset), "If-Range": validator} if offset > 0 else {}
+    r = (session or requests).get(url, stream=True, headers=headers)
+    if r.status_code == 416 or (r.status_code == 206 and _validator(r) not in (None, validator)):
+        r.close()  # nothing left to fetch, or the leftover doesn't belong to this file. start over.
+        offset = 0
+        r = (session or requests).get(url, stream=True)
+    r.raise_for_status()
+    if offset > 0 and r.status_code == 206:
+        message("Resuming download of {} at byte {}".format(save_file, offset), "debug")
+    else:  # a 200 answers an If-Range whose file changed, the leftover is replaced.
+        offset = 0
+        _write_part_info(part_file, url, _validator(r))
+    if size is None:
+        size = _response_size(r, offset)
+    digest = hashlib.sha256()
+    if offset > 0:  # hash what is already on disk so the final digest covers the whole file.
+        with open(part_file, "rb") as fd:
+            for block in iter(lambda: fd.read(_MAX_CHUNK), b""):
+                digest.update(block)
+    written = offset
+    chunk_size = _MIN_CHUNK
+    last_report = time.monotonic()
+    body = ResponseReader(r)
+    with open(part_file, "ab" if offset > 0 else "wb") as fd:
+        while True:
+            if cancel is not None and cancel.is_set():
+                r.close()
+                raise errors.UpdateCancelledError
+            started = time.monotonic()
+            chunk = body.read(chunk_size)
+            if not chunk:
+                break
+            fd.write(chunk)
+            digest.update(chunk)
+            written += len(chunk)
+            elapsed = time.monotonic() - started
+            if elapsed < _CHUNK_TARGET_TIME / 2 and chunk_size < _MAX_CHUNK:  # grow reads on fast links.
+                chunk_size *= 2
+            elif elapsed > _CHUNK_TARGET_TIME * 2 and chunk_size > _MIN_CHUNK:  # shrink them on slow ones.
+                chunk_size //= 2
+            if time.monotonic() - last_report >= progress_interval:
+                last_report = time.monotonic()
+                message("Downloaded {} of {} bytes to {}".format(written, size or "?", save_file), "debug")
+    r.close()
+    try:
+        if size is not None and written != size:
+            raise errors.DownloadVerificationError(save_file, "size {}".format(size), "size {}".format(written))
+        if sha256 is not None and digest.hexdigest() != sha256.lower():
+            raise errors.DownloadVerificationError(save_file, "SHA-256 " + sha256.lower(), digest.hexdigest())
+    except errors.DownloadVerificationError:
+        os.remove(part_file)  # a corrupt partial file can't be resumed, so start fresh next time.
+        _remove_part_info(part_file)
+        raise
+    os.replace(part_file, save_file)
+    _remove_part_info(part_file)
+    message("Downloaded {} bytes to {}".format(written, save_file), "debug")
+    return written - offset
+
+
+def _validator(r: "requests.Response"):
+    """Return the ETag of the given response, or its Last-Modified date if it has none, for If-Range requests.
+    Weak ETags can't be used for range requests, so they count as none."""
+    etag = r.headers.get("ETag")
+    if etag is not None and not etag.startswith("W/"):
+        return etag
+    return r.headers.get("Last-Modified")
+
+
+def _part_validator(part_file: str, url: str):
+    """Return the validator recorded for the given partial download if it can be resumed from url, else None."""
+    if not os.path.isfile(part_file):
+        return None
+    try:
+        with open(part_file + ".json", "r") as fd:
+            info = json.load(fd)
+    except (OSError, ValueError):
+        info = None
+    if not isinstance(info, dict) or info.get("url") != url or not info.get("validator"):
+        message("Discarding partial download {}, it can't be resumed".format(part_file), "debug")
+        return None
+    return info["validator"]
+
+
+def _write_part_info(part_file: str, url: str, validator):
+    """Record the url and validator of a partial download next to it, so only the same file is resumed."""
+    with open(part_file + ".json", "w") as fd:
+        json.dump({"url": url, "validator": validator}, fd)
+
+
+def _remove_part_info(part_file: str):
+    """Remove the record of a partial download."""
+    try:
+        os.remove(part_file + ".json")
+    except OSError:
+        pass
+
+
+class ResponseReader:
+    """Readable file object over the decoded body of a streamed response.
+
+    Reading the raw body raises urllib3's exceptions when the connection breaks, which aren't
+    :class:`requests.RequestException`. They are raised as the requests exceptions
+    :meth:`requests.Response.iter_content` raises instead, so every network error is handled alike.
+
+    :param response: response requested with stream=True.
+    :type response: requests.Response
+    """
+    def __init__(self, response: "requests.Response"):
+        self.response = response
+
+    def read(self, size: int = -1) -> bytes:
+        try:
+            return self.response.raw.read(None if size is None or size < 0 else size, decode_content=True)
+        except urllib3.exceptions.ProtocolError as e:
+            raise requests.exceptions.ChunkedEncodingError(e)
+        except urllib3.exceptions.DecodeError as e:
+            raise requests.exceptions.ContentDecodingError(e)
+        except urllib3.exceptions.HTTPError as e:
+            raise requests.exceptions.ConnectionError(e)
+
+    def tell(self) -> int:
+        """Return the amount of raw bytes read from the connection."""
+        return self.response.raw.tell()
+
+
+def download_segmented(url: str, save_file: str, debug: bool, session: "requests.Session" = None, size: int = None,
+                       sha256: str = None, segments: int = 4, cancel: threading.Event = None):
+    """Download a large file over several parallel connections, each fetching one byte range of it.
+
+    Files smaller than 16 MiB, files of unknown size and servers that don't support range requests are downloaded
+    over a single connection with :func:`download` instead. Segments are written straight to their place in a
+    ``.part`` file, which is verified and then atomically renamed into place like :func:`download` does.
+
+    :param url: url of the file to download.
+    :type url: str
+    :param save_file: file to save the downloaded to.
+    :type save_file: str
+    :param debug: send debug messages
+    :type debug: bool
+    :param session: session to download through. Its pool should allow as many connections as segments.
+    :type session: requests.Session, optional
+    :param size: size of the file in bytes, required to split it into segments.
+    :type size: int, optional
+    :param sha256: expected SHA-256 hex digest of the file, skips the hash check if not given.
+    :type sha256: str, optional
+    :param segments: amount of parallel connections, defaults to 4.
+    :type segments: int, optional
+    :param cancel: event stopping the download when set.
+    :type cancel: threading.Event, optional
+
+    :returns int: bytes transferred.
+
+    :exception ghau.errors.DownloadVerificationError: the downloaded file does not match the expected hash.
+    :exception ghau.errors.UpdateCancelledError: the given cancel event was set."""
+    if size is None or segments < 2 or size < _SEGMENT_MIN_SIZE:
+        return download(url, save_file, debug, session, size=size, sha256=sha256, cancel=cancel)
+    session = session or requests.Session()
+    part_file = save_file + ".part"
+    with open(part_file, "wb") as fd:
+        fd.truncate(size)
+    step = -(-size // segments)  # ceiling division, so the last segment is the shortest.
+    ranges = [(start, min(start + step, size) - 1) for start in range(0, size, step)]
+    message("Downloading {} in {} segments".format(save_file, len(ranges)), "debug")
+    try:
+        with futures.ThreadPoolExecutor(len(ranges)) as pool:
+            for future in [pool.submit(_download_range, url, part_file, session, start, end, cancel)
+                           for start, end in ranges]:
+                future.result()
+    except _RangesUnsupported:
+        os.remove(part_file)
+        message("Server doesn't support range requests, downloading {} in one piece".format(save_file), "debug")
+        return download(url, save_file, debug, session, size=size, sha256=sha256, cancel=cancel)
+    except BaseException:
+        os.remove(part_file)  # segments can't be resumed, don't leave a preallocated file behind.
+        raise
+    if sha256 is not None:
+        digest = hashlib.sha256()
+        with open(part_file, "rb") as fd:
+            for block in iter(lambda: fd.read(_MAX_CHUNK), b""):
+                digest.update(block)
+        if digest.hexdigest() != sha256.lower():
+            os.remove(part_file)
+            raise errors.DownloadVerificationError(save_file, "SHA-256 " + sha256.lower(), digest.hexdigest())
+    os.replace(part_file, save_file)
+    message("Downloaded {} bytes to {}".format(size, save_file), "debug")
+    return size
+
+
+class _RangesUnsupported(Exception):
+    """Raised by :func:`_download_range` when the server ignores the Range header."""
+
+
+def _download_range(url: str, part_file: str, session: "requests.Session", start: int, end: int,
+                    cancel: threading.Event):
+    """Download the inclusive byte range start-end of url into the same range of part_file.
+
+    :exception ghau.errors.DownloadVerificationError: the server sent fewer bytes than requested."""
+    with session.get(url, stream=True, headers={"Range": "bytes={}-{}".format(start, end)}) as r:
+        if r.status_code == 200:
+            raise _RangesUnsupported
+        r.raise_for_status()
+        written = 0
+        with open(part_file, "r+b") as fd:
+            fd.seek(start)
+            for chunk in r.iter_content(_MAX_CHUNK):
+                if cancel is not None and cancel.is_set():
+                    raise errors.UpdateCancelledError
                 fd.write(chunk)
-                message("Wrote chunk {} to {}".format(str(i), save_file), "debug")
+                written += len(chunk)
+    if written != end - start + 1:
+        raise errors.DownloadVerificationError(part_file, "{} bytes at offset {}".format(end - start + 1, start),
+                                               "{} bytes".format(written))
+
+
+def _response_size(r: "requests.Response", offset: int):
+    """Return the full size of the file being downloaded by the given response, or None if the server doesn't say."""
+    content_range = r.headers.get("Content-Range")
+    if content_range is not None and not content_range.endswith("/*"):
+        return int(content_range.rsplit("/", 1)[1])
+    if "Content-Length" in r.headers and r.headers.get("Content-Encoding") is None:
+        return offset + int(r.headers["Content-Length"])
+    return None
+
+
+def _member_path(name: str):
+    """Return the path relative to the program directory the given zipball member is installed to,
+    or None if it isn't a file to install.
+
+    Github zipballs wrap everything in a single ``owner-repo-sha/`` folder, which is stripped here."""
+    parts = name.replace("\\", "/").split("/", 1)
+    if len(parts) < 2 or parts[1] == "" or parts[1].endswith("/"):  # the wrapping folder, or a directory entry.
+        return None
+    relative = os.path.normpath(parts[1])
+    if os.path.isabs(relative) or relative.split(os.sep)[0] == "..":  # never write outside the extract_path.
+        message("Skipping unsafe zip member: {}".format(name), "warning")
+        return None
+    return relative.replace(os.sep, "/")
+
+
+def is_protected(extract_path: str, path: str, wl) -> bool:
+    """Return True if the whitelist protects the given relative path from being overwritten.
+
+    Only files that already exist are protected, so whitelisted files missing locally are still installed.
+
+    :param extract_path: directory the path is relative to.
+    :type extract_path: str
+    :param path: relative path using '/' separators.
+    :type path: str
+    :param wl: compiled whitelist.
+    :type wl: ghau.files.Matcher"""
+    return wl.match(path) and os.path.lexists(os.path.join(extract_path, path))
+
+
+def _install_member(extract_path: str, name: str, chunks, wl) -> bool:
+    """Write one zipball member straight to its final location unless it is whitelisted.
+
+    The given chunks are always consumed, so streamed archives stay in sync. Returns True if the file was written."""
+    relative = _member_path(name)
+    if relative is None or is_protected(extract_path, relative, wl):
+        if relative is not None:
+            message("Skipping whitelisted file: {}".format(relative), "debug")
+        for _ in chunks:
+            pass
+        return False
+    dest = os.path.join(extract_path, relative)
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    if os.path.lexists(dest):  # unlink first, writing through a hardlink would change the staged-from version.
+        os.remove(dest)
+    with open(dest, "wb") as fd:
+        for chunk in chunks:
+            fd.write(chunk)
+    return True
 
 
-def extract_zip(extract_path, file_path, wl: list, debug: bool = False):
-    """Extracts files from the given zip file_path into the given extract_path and performs cleanup operations.
+def extract_zip(extract_path, file_path, wl, debug: bool = False, workers: int = 8, timings: dict = None):
+    """Installs the files from the given zip file_path into the given extract_path, then removes the zip.
 
-    Will not overwrite files present in the given whitelist.
+    Members are read straight from the archive and written once to their final location, with the zipball's
+    wrapping folder stripped. Files present in the given whitelist are skipped before anything is written.
+    Files are written in parallel through a :class:`ghau.fsplan.FilePlan`.
 
     :param extract_path: path to extract the contents of the given zip to.
     :type extract_path: str
     :param file_path: path of the zip to extract.
     :type file_path: str
-    :param wl: whitelist to avoid overwriting files from.
-    :type wl: list
+    :param wl: compiled whitelist to avoid overwriting files from.
+    :type wl: ghau.files.Matcher
     :param debug: send debug messages
-    :type debug: bool"""
-    program_dir = os.path.realpath(os.path.dirname(sys.argv[0]))
+    :type debug: bool
+    :param workers: files written at the same time, defaults to 8.
+    :type workers: int, optional
+    :param timings: dict the seconds spent on each file operation phase are added to, see
+        :meth:`ghau.fsplan.FilePlan.execute`.
+    :type timings: dict, optional
+
+    :returns int: amount of files installed."""
     message("Extracting: {}".format(file_path), "debug")
+    extract_path = os.path.realpath(extract_path)
+    plan = fsplan.FilePlan(workers)
     with zipfile.ZipFile(file_path, "r") as zf:
-        zf.extractall(extract_path)
         for item in zf.infolist():
-            if item.is_dir():
-                extract_folder = os.path.join(program_dir, item.filename)
-                break
-    for filename in os.listdir(os.path.join(extract_path, extract_folder)):
-        message("Comparing: file {}".format(filename), "debug")
-        in_whitelist = False
-        for item in wl:  # don't overwrite whitelisted items.
-            message("Comparing against whitelist item: {}".format(item), "debug")
-            if filename == os.path.split(item)[1]:
-                in_whitelist = True
-                message("{} matched {}".format(item, filename), "debug")
-        if in_whitelist:
-            message("Skipping to next file.")
-            continue
-        message("Extracting file: {}".format(filename), "debug")
-        source = os.path.join(extract_path, extract_folder, filename)
-        dest = os.path.join(extract_path, filename)
-        shutil.move(source, dest)
-    shutil.rmtree(extract_folder)
+            relative = None if item.is_dir() else _member_path(item.filename)
+            if relative is None:
+                continue
+            if is_protected(extract_path, relative, wl):
+                message("Skipping whitelisted file: {}".format(relative), "debug")
+                continue
+            plan.write(os.path.join(extract_path, relative), functools.partial(_extract_member, zf, item))
+        plan.execute(timings)
     os.remove(file_path)
+    message("Installed {} files from {}".format(len(plan), file_path), "debug")
+    return len(plan)
+
+
+def _extract_member(zf: "zipfile.ZipFile", item: "zipfile.ZipInfo", dest: str):
+    """Write a single zip member to dest."""
+    with zf.open(item) as member, open(dest, "wb") as fd:
+        shutil.copyfileobj(member, fd, _MIN_CHUNK)
+
+
+def extract_zip_stream(extract_path, stream, wl, debug: bool = False):
+    """Installs the files of a zip archive while it is being read from the given stream, such as a download.
+
+    Unlike :func:`extract_zip` this never stages the archive on disk. Members are decompressed as they arrive and
+    written once to their final location, following the same whitelist rules.
+
+    :param extract_path: path to extract the contents of the given zip to.
+    :type extract_path: str
+    :param stream: readable binary file object positioned at the start of the archive.
+    :param wl: compiled whitelist to avoid overwriting files from.
+    :type wl: ghau.files.Matcher
+    :param debug: send debug messages
+    :type debug: bool
+
+    :returns int: amount of files installed.
+
+    :exception ghau.errors.DownloadVerificationError: a member failed its CRC check or the archive can't be streamed."""
+    extract_path = os.path.realpath(extract_path)
+    reader = _StreamReader(stream)
+    written = 0
+    for name, chunks in _iter_zip_stream(reader):
+        if _install_member(extract_path, name, chunks, wl):
+            written += 1
+    message("Installed {} files from stream".format(written), "debug")
+    return written
+
+
+class _StreamReader:
+    """Buffered reader over a non-seekable stream that allows pushing back over-read data."""
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffer = b""
+
+    def read(self, size: int) -> bytes:
+        """Read up to size bytes, fewer only at the end of the stream."""
+        while len(self.buffer) < size:
+            data = self.stream.read(max(size - len(self.buffer), _MIN_CHUNK))
+            if not data:
+                break
+            self.buffer += data
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def read_some(self) -> bytes:
+        """Read whatever is buffered, or the next block of the stream."""
+        if self.buffer:
+            data, self.buffer = self.buffer, b""
+            return data
+        return self.stream.read(_MIN_CHUNK)
+
+    def unread(self, data: bytes):
+        """Push data back to be returned by the next read."""
+        self.buffer = data + self.buffer
+
+
+_LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+_LOCAL_HEADER_SIG = 0x04034b50
+_DESCRIPTOR_SIG = 0x08074b50
+_END_SIGS = (0x02014b50, 0x06054b50, 0x06064b50)  # central directory, its end record and the zip64 end record.
+_TRUNCATED = "a truncated download"
+
+
+def _iter_zip_stream(reader: _StreamReader):
+    """Yield (name, chunks) for each member of a zip archive read sequentially through its local headers.
+
+    Each chunks generator must be consumed before advancing to the next member.
+
+    :exception ghau.errors.DownloadVerificationError: a member failed its CRC check, uses an unsupported layout, or
+        the stream ended before the central directory."""
+    while True:
+        header = reader.read(_LOCAL_HEADER.size)
+        sig = struct.unpack("<I", header[:4])[0] if len(header) >= 4 else None
+        if sig in _END_SIGS:
+            return  # reached the central directory, nothing left to install.
+        if sig != _LOCAL_HEADER_SIG or len(header) < _LOCAL_HEADER.size:
+            raise errors.DownloadVerificationError("zipball", "a zip member or the central directory",
+                                                   _TRUNCATED if len(header) < _LOCAL_HEADER.size else "unknown data")
+        sig, _, flags, method, _, _, crc, csize, usize, name_len, extra_len = _LOCAL_HEADER.unpack(header)
+        data = reader.read(name_len + extra_len)
+        if len(data) < name_len + extra_len:
+            raise errors.DownloadVerificationError("zipball", "a zip member header", _TRUNCATED)
+        name = data[:name_len].decode("utf-8" if flags & 0x800 else "cp437")
+        extra = data[name_len:]
+        zip64 = _zip64_extra(extra)
+        if zip64 is not None:
+            usize, csize = _zip64_sizes(zip64, usize, csize)
+        has_descriptor = bool(flags & 0x08)
+        if method not in (0, 8) or (method == 0 and has_descriptor):
+            raise errors.DownloadVerificationError(name, "a streamable zip member", "compression method {}".format(
+                method))
+        state = {"crc": 0, "complete": False}
+        yield name, _member_chunks(reader, method, csize, has_descriptor, state)
+        if not state["complete"]:
+            raise errors.DownloadVerificationError(name, "the complete member", _TRUNCATED)
+        if has_descriptor:
+            crc = _read_descriptor(reader, name, zip64 is not None)
+        if state["crc"] != crc:
+            raise errors.DownloadVerificationError(name, "CRC {:08x}".format(crc), "CRC {:08x}".format(state["crc"]))
+
+
+def _member_chunks(reader: _StreamReader, method: int, csize: int, has_descriptor: bool, state: dict):
+    """Yield the decompressed data of the current member, updating its running CRC and completion in state."""
+    if method == 0:  # stored, size is known from the header.
+        remaining = csize
+        while remaining > 0:
+            data = reader.read(min(remaining, _MAX_CHUNK))
+            if not data:
+                break
+            remaining -= len(data)
+            state["crc"] = zlib.crc32(data, state["crc"])
+            yield data
+        state["complete"] = remaining == 0
+        return
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    remaining = None if has_descriptor else csize  # deflate marks its own end when sizes come later.
+    while not decompressor.eof:
+        data = reader.read_some() if remaining is None else reader.read(min(remaining, _MAX_CHUNK))
+        if not data:
+            break
+        if remaining is not None:
+            remaining -= len(data)
+        out = decompressor.decompress(data)
+        if out:
+            state["crc"] = zlib.crc32(out, state["crc"])
+            yield out
+    state["complete"] = decompressor.eof
+    if decompressor.unused_data:
+        reader.unread(decompressor.unused_data)
+
+
+def _zip64_extra(extra: bytes):
+    """Return the zip64 extra field of a local header, or None if the member isn't stored as zip64."""
+    pos = 0
+    while pos + 4 <= len(extra):
+        tag, length = struct.unpack("<HH", extra[pos:pos + 4])
+        if tag == 0x0001:
+            return extra[pos + 4:pos + 4 + length]
+        pos += 4 + length
+    return None
+
+
+def _zip64_sizes(values: bytes, usize: int, csize: int) -> tuple:
+    """Read the real sizes of a member from its zip64 extra field, where the header doesn't hold them."""
+    if usize == 0xFFFFFFFF and len(values) >= 8:
+        usize, values = struct.unpack("<Q", values[:8])[0], values[8:]
+    if csize == 0xFFFFFFFF and len(values) >= 8:
+        csize = struct.unpack("<Q", values[:8])[0]
+    return usize, csize
+
+
+def _read_descriptor(reader: _StreamReader, name: str, zip64: bool) -> int:
+    """Read the data descriptor following the given member and return the CRC it records."""
+    data = reader.read(4)
+    if len(data) == 4 and struct.unpack("<I", data)[0] == _DESCRIPTOR_SIG:  # the signature is optional.
+        data = reader.read(4)
+    sizes = reader.read(16 if zip64 else 8)  # already known from the decompressed data.
+    if len(data) < 4 or len(sizes) < (16 if zip64 else 8):
+        raise errors.DownloadVerificationError(name, "a data descriptor", _TRUNCATED)
+    return struct.unpack("<I", data)[0]
+
+
+def link_tree(src: str, dst: str, skip: set, prune: set):
+    """Recreate the src directory tree at dst, hardlinking every file instead of copying it.
+
+    Files are copied when hardlinks aren't supported, and symlinks are recreated as symlinks.
+
+    :param src: directory to recreate.
+    :type src: str
+    :param dst: directory to create, must not exist yet.
+    :type dst: str
+    :param skip: absolute paths of files to leave out.
+    :type skip: set
+    :param prune: absolute paths of directories to leave out along with their contents.
+    :type prune: set"""
+    for dirpath, dirnames, filenames in os.walk(src):
+        target = os.path.join(dst, os.path.relpath(dirpath, src))
+        os.makedirs(target, exist_ok=True)
+        for dirname in list(dirnames):
+            path = os.path.join(dirpath, dirname)
+            if path in prune:
+                dirnames.remove(dirname)
+            elif os.path.islink(path):  # os.walk doesn't follow directory symlinks, recreate them instead.
+                os.symlink(os.readlink(path), os.path.join(target, dirname))
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            if path in skip:
+                continue
+            if os.path.islink(path):
+                os.symlink(os.readlink(path), os.path.join(target, filename))
+                continue
+            try:
+                os.link(path, os.path.join(target, filename))
+            except OSError:
+                shutil.copy2(path, os.path.join(target, filename))
+
+
+def replace_symlink(link: str, target: str):
+    """Atomically point the given symlink at a new target, creating it if needed.
+
+    :param link: symlink to replace.
+    :type link: str
+    :param target: path the symlink should point to.
+    :type target: str"""
+    tmp_link = link + ".ghau-tmp"
+    if os.path.lexists(tmp_link):
+        os.remove(tmp_link)
+    os.symlink(target, tmp_link, target_is_directory=True)
+    os.replace(tmp_link, link)
 
 
-def clean_files(file_list: list, debug: bool):
+def clean_files(file_list: list, debug: bool, workers: int = 8, timings: dict = None):
     """Delete all files in the file_list. Used to perform cleaning if ghau.update.Update.clean is enabled.
 
+    Files are deleted in parallel through a :class:`ghau.fsplan.FilePlan`.
+
     :param file_list: list of files to delete.
     :type file_list: list
     :param debug: send debug messages.
-    :type: debug: bool"""
+    :type: debug: bool
+    :param workers: files deleted at the same time, defaults to 8.
+    :type workers: int, optional
+    :param timings: dict the seconds spent on each file operation phase are added to, see
+        :meth:`ghau.fsplan.FilePlan.execute`.
+    :type timings: dict, optional"""
+    plan = fsplan.FilePlan(workers)
     for path in file_list:
         message("Removing path {}".format(path), "debug")
-        os.remove(path)
+        plan.delete(path)
+    plan.execute(timings)
+
+
+class Matcher:
+    """Compiled form of a whitelist or cleanlist dictionary, built once and reused for every path lookup.
+
+    Keys mapped to False are file patterns and keys mapped to True are directory exclusions, following the glob
+    rules the lists have always used: patterns match full paths relative to the program directory, ``*`` and ``?``
+    stay within one directory and don't match hidden names, ``**`` matches any number of directories, and a leading
+    ``!`` negates a file pattern. Hidden files and files in hidden directories are never matched, even when named
+    explicitly. Literal patterns are kept in a hash set, and every wildcard pattern is combined into a single regular
+    expression, so each lookup costs one set lookup and at most one regex match.
+
+    :param dictobj: unprocessed dictionary to compile.
+    :type dictobj: dict
+    """
+    def __init__(self, dictobj: dict):
+        files, negated, dirs = [], [], []
+        for key, value in dictobj.items():
+            for pattern in key.split("|"):
+                pattern = pattern.strip("/")
+                if value is True:
+                    dirs.append(pattern)
+                elif pattern.startswith("!"):
+                    negated.append(pattern[1:])
+                else:
+                    files.append(pattern)
+        self.literals, self.pattern = _compile(files)
+        self.negated_literals, self.negated_pattern = _compile(negated)
+        self.dir_literals, self.dir_pattern = _compile(dirs)
+
+    @property
+    def empty(self) -> bool:
+        """True if this matcher can't match any file."""
+        return len(self.literals) == 0 and self.pattern is None
+
+    def excluded(self, directory: str) -> bool:
+        """Return True if the given relative directory is excluded, along with everything beneath it."""
+        return directory in self.dir_literals or (self.dir_pattern is not None and
+                                                  self.dir_pattern.fullmatch(directory) is not None)
+
+    def match(self, path: str) -> bool:
+        """Return True if the given relative file path, using '/' separators, is matched."""
+        if path.startswith(".") or "/." in path:  # hidden, even when named explicitly.
+            return False
+        if not (path in self.literals or (self.pattern is not None and self.pattern.fullmatch(path))):
+            return False
+        if path in self.negated_literals or (self.negated_pattern is not None and
+                                             self.negated_pattern.fullmatch(path)):
+            return False
+        parent = path.rpartition("/")[0]
+        while parent:
+            if self.excluded(parent):
+                return False
+            parent = parent.rpartition("/")[0]
+        return True
+
+
+def _compile(patterns: list) -> tuple:
+    """Split patterns into a set of literal paths and one combined regex of the wildcard ones, or None."""
+    literals = set(pattern for pattern in patterns if not _WILDCARDS.search(pattern))
+    wildcards = [_translate(pattern) for pattern in patterns if _WILDCARDS.search(pattern)]
+    if len(wildcards) == 0:
+        return literals, None
+    return literals, re.compile("|".join("(?:{})".format(regex) for regex in wildcards))
+
+
+_WILDCARDS = re.compile(r"[*?\[]")
+_SEGMENT = r"(?!\.)[^/]*"  # one path segment that isn't hidden.
+
+
+def _translate(pattern: str) -> str:
+    """Translate a glob pattern into a regular expression matching full relative paths."""
+    regex = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        segment_start = i == 0 or pattern[i - 1] == "/"
+        if pattern.startswith("**", i) and segment_start and (i + 2 == len(pattern) or pattern[i + 2] == "/"):
+            if i + 2 == len(pattern):  # trailing globstar, anything below this point.
+                regex.append("{0}(?:/{0})*".format(_SEGMENT))
+            else:  # zero or more directories.
+                regex.append("(?:{}/)*".format(_SEGMENT))
+            i += 3
+            continue
+        if c == "*":
+            regex.append(_SEGMENT if segment_start else "[^/]*")
+        elif c == "?":
+            regex.append("(?!\\.)[^/]" if segment_start else "[^/]")
+        elif c == "[" and pattern.find("]", i + 2) != -1:
+            end = pattern.find("]", i + 2)
+            body = pattern[i + 1:end]
+            if body.startswith("!"):
+                body = "^" + body[1:]
+            regex.append("[{}]".format(body.replace("\\", "\\\\")))
+            i = end
+        else:
+            regex.append(re.escape(c))
+        i += 1
+    return "".join(regex)
+
+
+ScanResult = collections.namedtuple("ScanResult", ["dev", "whitelist", "cleanlist"])
+ScanResult.__doc__ = """Result of :func:`scan`: whether a git repository was found, and the whitelist and cleanlist hits."""
+
+
+def scan(root: str, wl: Matcher = None, cl: Matcher = None, check_dev: bool = True,
+         index_path: str = None) -> ScanResult:
+    """Walk the program directory once, collecting dev mode status, whitelist hits and cleanlist hits together.
+
+    The walk uses os.scandir and stops as soon as a .git entry is found when checking for a dev environment.
+    Hidden directories are skipped, and directories excluded by every list in use are pruned without being listed.
+
+    If an index_path is given, the listing of every directory is persisted there along with the directory's
+    modification time. Directories whose modification time hasn't changed since the last run are not listed again.
+
+    :param root: directory to scan.
+    :type root: str
+    :param wl: compiled whitelist to collect hits for, defaults to None.
+    :type wl: ghau.files.Matcher, optional
+    :param cl: compiled cleanlist to collect hits for, defaults to None.
+    :type cl: ghau.files.Matcher, optional
+    :param check_dev: look for a .git entry marking a dev environment, defaults to True.
+    :type check_dev: bool, optional
+    :param index_path: file to persist the directory listing index in, defaults to None.
+    :type index_path: str, optional
+
+    :returns ghau.files.ScanResult: dev mode status and the paths of files found through each list."""
+    matchers = [m for m in (wl, cl) if m is not None and not m.empty]
+    index = _load_index(index_path) if index_path is not None else {}
+    new_index = {}
+    wl_hits, cl_hits = [], []
+    stack = [""]
+    while stack:
+        relative = stack.pop()
+        dirpath = os.path.join(root, relative) if relative else root
+        files, dirs = _list_dir(dirpath, relative, index, new_index)
+        if check_dev and (".git" in dirs or ".git" in files):
+            message("Found git repository in {}".format(dirpath), "debug")
+            return ScanResult(True, wl_hits, cl_hits)
+        prefix = relative + "/" if relative else ""
+        for filename in files:
+            if wl is not None and wl.match(prefix + filename):
+                wl_hits.append(os.path.join(dirpath, filename))
+            if cl is not None and cl.match(prefix + filename):
+                cl_hits.append(os.path.join(dirpath, filename))
+        for dirname in dirs:
+            if dirname.startswith("."):
+                continue
+            if len(matchers) > 0 and all(m.excluded(prefix + dirname) for m in matchers):
+                continue
+            if len(matchers) > 0 or check_dev:
+                stack.append(prefix + dirname)
+    if index_path is not None and new_index != index:
+        _save_index(index_path, new_index)
+    return ScanResult(False, wl_hits, cl_hits)
+
+
+def _list_dir(dirpath: str, relative: str, index: dict, new_index: dict) -> tuple:
+    """Return the file and directory names in dirpath, reusing the index entry if the directory is unchanged."""
+    mtime = os.stat(dirpath).st_mtime_ns
+    cached = index.get(relative)
+    if cached is not None and cached[0] == mtime:
+        files, dirs = cached[1], cached[2]
+    else:
+        files, dirs = [], []
+        with os.scandir(dirpath) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.name)
+                else:
+                    files.append(entry.name)
+    new_index[relative] = [mtime, files, dirs]
+    return files, dirs
+
+
+def _load_index(path: str) -> dict:
+    """Load an index of file metadata, such as the directory listings used by :func:`scan`, returning an empty index
+    if it is unusable."""
+    try:
+        with open(path, "r") as fd:
+            return json.load(fd)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_index(path: str, index: dict):
+    """Atomically store an index loaded with :func:`_load_index`."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w") as fd:
+        json.dump(index, fd, separators=(",", ":"))
+    os.replace(path + ".tmp", path)
+
 
+def load_dict(name: str, root: str, dictobj, debug: bool = False) -> list:
+    """Filter directory based on given whitelist or cleanlist. Returns paths of matched files.
 
-def load_dict(name: str, root: str, dictobj: dict, debug: bool = False) -> list:
-    """Filter directory based on given cleanlist. Returns paths of given files. This function utilizes
-        wcmatch to identify files.
+        Hidden directories are not searched and excluded directories are pruned without being walked.
+        See :func:`scan` to collect several lists in a single walk.
 
         :param name: what to call this event in the debug logs.
         :type name: str
         :param root: directory to start the file search in.
         :type root: str
-        :param dictobj: unprocessed dictionary to load.
-        :type dictobj: dict
+        :param dictobj: unprocessed dictionary to load, or its already compiled matcher.
+        :type dictobj: dict or ghau.files.Matcher
         :param debug: send debug messages
         :type debug: bool
 
-        :returns list: paths of files found through the cleanlist."""
-    file_search = ""
-    exclusions = ""
-    f, e = 0, 0
-    for key in dictobj.keys():
-        if dictobj[key] is False:
-            if f == 0:  # wcmatch requires no '|' on the first entry.
-                file_search += key
-            else:
-                file_search += "|" + key
-            f += 1
-        elif dictobj[key] is True:
-            if e == 0:
-                exclusions += key
-            else:
-                exclusions += "|" + key
-            e += 1
-    message("{} file_search: {}".format(name, file_search), "debug")
-    message("{} exclusions: {}".format(name, exclusions), "debug")
+        :returns list: paths of files found through the list."""
+    matcher = dictobj if isinstance(dictobj, Matcher) else Matcher(dictobj)
     message("{} is searching for files in directory: {}".format(name, root), "debug")
-    pl = wcmatch.WcMatch(root, file_search, exclusions, flags=wcmatch.RECURSIVE | wcmatch.GLOBSTAR |
-                         wcmatch.PATHNAME).match()
-    return pl
+    return scan(root, cl=matcher, check_dev=False).cleanlist
@@ -0,0 +1,126 @@
+#  Copyright (c) 2020.  InValidFire
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+#  associated documentation files (the "Software"), to deal in the Software without restriction, including
+#  without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the
+#  following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all copies or substantial
+#  portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+#  CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+#  OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import os
+import time
+import shutil
+
+import ghau.files as gf
+import ghau.lazy as lazy
+
+futures = lazy.module("concurrent.futures")
+
+
+class FilePlan:
+    """Batch of filesystem operations making up one phase of an install, executed on a bounded thread pool.
+
+    On network filesystems and slow disks every file operation mostly waits on syscall latency, so running them
+    concurrently hides that latency. Operations run in an order that keeps them safe: parent directories are created
+    first (shallowest first), then files are deleted, then files are written, then directories left empty are
+    removed (deepest first).
+
+    :param workers: maximum amount of operations run at the same time, defaults to 8.
+    :type workers: int, optional
+    """
+    def __init__(self, workers: int = 8):
+        self.workers = workers
+        self.dirs = set()
+        self.deletes = []
+        self.writes = []
+        self.rmdirs = set()
+
+    def __len__(self):
+        return len(self.deletes) + len(self.writes)
+
+    def delete(self, path: str):
+        """Plan the removal of a file."""
+        self.deletes.append(path)
+
+    def write(self, dest: str, writer):
+        """Plan the creation or replacement of a file. writer is called with dest once its directory exists, and
+        must create the file there. An existing file is unlinked first, so hardlinks are never written through."""
+        self.dirs.add(os.path.dirname(dest))
+        self.writes.append((dest, writer))
+
+    def move(self, src: str, dest: str):
+        """Plan moving a file to dest, replacing any file already there."""
+        self.write(dest, lambda path: shutil.move(src, path))
+
+    def remove_dir(self, path: str, root: str):
+        """Plan the removal of a directory, and of its parents up to but excluding root, if they are empty once
+        every file operation ran."""
+        self.rmdirs.add((path, root))
+
+    def execute(self, timings: dict = None) -> dict:
+        """Run every planned operation.
+
+        :param timings: dict the seconds spent on each phase are added to, such as the timings of a
+            :class:`ghau.metrics.Span`, defaults to a new one.
+        :type timings: dict, optional
+
+        :returns dict: seconds spent on each phase: "mkdir", "delete", "write" and "rmdir"."""
+        totals = timings if timings is not None else {}
+        timings = {}
+        with futures.ThreadPoolExecutor(self.workers) as pool:
+            started = time.perf_counter()
+            for depth in sorted(set(_depth(path) for path in self.dirs)):  # parents before their children.
+                _run(pool, lambda path: os.makedirs(path, exist_ok=True),
+                     [path for path in self.dirs if _depth(path) == depth])
+            timings["mkdir"] = time.perf_counter() - started
+            started = time.perf_counter()
+            _run(pool, os.remove, self.deletes)
+            timings["delete"] = time.perf_counter() - started
+            started = time.perf_counter()
+            _run(pool, lambda op: _write(*op), self.writes)
+            timings["write"] = time.perf_counter() - started
+        started = time.perf_counter()
+        for path, root in sorted(self.rmdirs, key=lambda item: _depth(item[0]), reverse=True):  # children first.
+            _remove_empty_dirs(path, root)
+        timings["rmdir"] = time.perf_counter() - started
+        gf.message("Ran {} deletes and {} writes: {}".format(len(self.deletes), len(self.writes), ", ".join(
+            "{} {:.3f}s".format(phase, seconds) for phase, seconds in timings.items())), "debug")
+        for phase, seconds in timings.items():
+            totals[phase] = totals.get(phase, 0.0) + seconds
+        return totals
+
+
+def _run(pool: "futures.ThreadPoolExecutor", func, items: list):
+    """Apply func to every item on the pool, re-raising the first error once all of them finished."""
+    for future in [pool.submit(func, item) for item in items]:
+        future.result()
+
+
+def _write(dest: str, writer):
+    """Run a planned write, unlinking whatever is at dest first."""
+    if os.path.lexists(dest):
+        os.remove(dest)
+    writer(dest)
+
+
+def _remove_empty_dirs(path: str, root: str):
+    """Remove the given directory and each of its parents below root for as long as they are empty."""
+    root = os.path.normpath(root)
+    path = os.path.normpath(path)
+    while path.startswith(root + os.sep) and os.path.isdir(path) and len(os.listdir(path)) == 0:
+        os.rmdir(path)
+        path = os.path.dirname(path)
+
+
+def _depth(path: str) -> int:
+    """Return how deep the given path is."""
+    return os.path.normpath(path).count(os.sep)
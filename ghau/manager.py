@@ -0,0 +1,241 @@
+#  Copyright (c) 2020.  InValidFire
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+#  associated documentation files (the "Software"), to deal in the Software without restriction, including
+#  without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the
+#  following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all copies or substantial
+#  portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+#  CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+#  OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import os
+import sys
+import json
+
+import ghau.api as api
+import ghau.errors as ge
+import ghau.files as gf
+import ghau.lazy as lazy
+import ghau.update as gu
+
+requests = lazy.module("requests")
+futures = lazy.module("concurrent.futures")
+
+_CALLS_PER_CHECK = 2  # REST calls a release lookup costs, see ghau.update._load_release.
+_RELEASE_FIELDS = """tagName isPrerelease isDraft databaseId name createdAt publishedAt
+    releaseAssets(first: 100) { nodes { name size downloadUrl contentType } }"""
+
+
+class UpdateManager:
+    """Checks and installs updates for many repositories at once, such as a host program and its plugins.
+
+    Every repository is checked concurrently on a bounded worker pool sharing one pooled HTTP session. The rate limit
+    is tested once for the whole fleet and the remaining budget is split between the checks. When an authentication
+    token is given, every release lookup is batched into a single GraphQL query.
+
+    :param auth: authentication token used for accessing the Github API, defaults to None.
+    :type auth: str, optional
+    :param ratemin: minimum amount of API requests left before updates will stop, defaults to 20.
+    :type ratemin: int, optional
+    :param max_workers: maximum amount of repositories checked or installed at the same time, defaults to 8.
+    :type max_workers: int, optional
+    :param api_url: base url of the Github API, defaults to https://api.github.com.
+    :type api_url: str, optional
+    :param timeout: network timeout in seconds, either a number or a (connect, read) tuple, defaults to (5, 30).
+    :type timeout: float or tuple, optional
+    """
+    def __init__(self, auth: str = None, ratemin: int = 20, max_workers: int = 8, api_url: str = api.API_URL,
+                 timeout=(5, 30)):
+        self.auth = auth
+        self.ratemin = ratemin
+        self.max_workers = max_workers
+        self.api_url = api_url
+        self.session = api.build_session(auth, max_workers, timeout)
+        self.client = api.Client(auth, None, api_url, self.session)
+        self.updates = {}
+
+    def add(self, repo: str, version: str, **options) -> gu.Update:
+        """Add a repository to manage. Options are passed on to :class:`ghau.update.Update`,
+        usually including a program_dir for each repository.
+
+        Unless a cache_dir is given, each repository keeps its cache and downloads in ``.ghau/<owner>/<name>`` of its
+        program directory, so repositories sharing a program directory are checked concurrently without sharing
+        files.
+
+        :param repo: github repository to check for updates in.
+        :type repo: str
+        :param version: local version to check against online versions.
+        :type version: str
+
+        :returns ghau.update.Update: the update object of the repository, to configure its whitelist and cleanlist."""
+        options.setdefault("auth", self.auth)
+        options.setdefault("ratemin", self.ratemin)
+        options.setdefault("api_url", self.api_url)
+        if options.get("cache_dir") is None:
+            program_dir = options.get("program_dir")
+            program_dir = os.path.dirname(sys.argv[0]) if program_dir is None else program_dir
+            options["cache_dir"] = os.path.join(os.path.abspath(program_dir), ".ghau", *repo.split("/", 1))
+        update = gu.Update(version, repo, session=self.session, **options)
+        self.updates[repo] = update
+        return update
+
+    def check(self) -> dict:
+        """Check every managed repository and download the updates found.
+
+        :returns dict: maps each repository to its downloaded :class:`ghau.update.PendingUpdate`, None if no update
+            is required, or the error that stopped its check."""
+        plan = {}
+        repos = list(self.updates)
+        try:
+            core = self.client.rate_limit()
+        except ge.GithubRateLimitError as e:
+            return {repo: e for repo in repos}
+        budget = core["remaining"] - self.ratemin
+        releases = {}
+        if self.auth is not None and budget > 0:  # a single query covers the lookups without a constraint.
+            batched = [repo for repo in repos if self.updates[repo].constraint is None]
+            if len(batched) > 0:
+                budget -= 1
+            releases = self._load_releases_graphql(batched)
+        rest = [repo for repo in repos if repo not in releases]  # looked up through the REST API.
+        affordable = set(rest[:max(budget, 0) // _CALLS_PER_CHECK])
+        checked = [repo for repo in repos if repo in releases or repo in affordable]
+        gf.message("API requests remaining: {}, checking {} of {} repositories".format(
+            core["remaining"], len(checked), len(repos)), "info")
+        for repo in repos:
+            if repo not in releases and repo not in affordable:
+                plan[repo] = ge.GithubRateLimitError(core["reset"])
+        with futures.ThreadPoolExecutor(self.max_workers) as pool:
+            running = {pool.submit(self._check_one, repo, releases.get(repo)): repo for repo in checked}
+            for future in futures.as_completed(running):
+                plan[running[future]] = future.result()
+        return plan
+
+    def install(self, plan: dict) -> list:
+        """Install the updates in the given plan without rebooting.
+
+        Repositories installed into overlapping directories are installed one after the other,
+        every other group is installed in parallel.
+
+        :param plan: plan returned by :meth:`check`.
+        :type plan: dict
+
+        :returns list: repositories that were updated."""
+        pending = [repo for repo, result in plan.items() if isinstance(result, gu.PendingUpdate)]
+        groups = _group_overlapping(pending, lambda repo: self.updates[repo].program_dir)
+        installed = []
+        with futures.ThreadPoolExecutor(self.max_workers) as pool:
+            for done in pool.map(lambda group: self._install_group(group, plan), groups):
+                installed.extend(done)
+        return installed
+
+    def _check_one(self, repo: str, release):
+        """Check and download the update of a single repository, returning its plan entry."""
+        update = self.updates[repo]
+        try:
+            if isinstance(release, Exception):  # the batched lookup failed.
+                raise release
+            pending = update.check(ratetest=False, release=release)
+            if pending is not None:
+                update.fetch(pending)
+            return pending
+        except gu._HANDLED_ERRORS + (ge.RepositoryNotFoundError,) as e:
+            gf.message("{}: {}".format(repo, e.message), "info")
+            return e
+        except (requests.RequestException, OSError) as e:  # one failing repository shouldn't stop the others.
+            gf.message("{}: {}".format(repo, e), "warning")
+            return e
+
+    def _install_group(self, group: list, plan: dict) -> list:
+        """Install the updates of repositories sharing a directory one after the other."""
+        for repo in group:
+            self.updates[repo].install(plan[repo], reboot=False)
+        return group
+
+    def _load_releases_graphql(self, repos: list) -> dict:
+        """Look up the latest release of every repository in a single GraphQL query.
+
+        :returns dict: maps each repository to its latest release data, shaped like the REST API's,
+            or to the error describing why it has none. A failed query is the error of every repository.
+            Repositories whose newest releases are all drafts are left out, to be looked up through the REST API."""
+        if len(repos) == 0:  # every repository resolves its release through its release index.
+            return {}
+        parts = []
+        for i, repo in enumerate(repos):
+            owner, name = repo.split("/", 1)
+            parts.append("r{}: repository(owner: {}, name: {}) {{ latestRelease {{ {} }} "
+                         "releases(first: {}, orderBy: {{field: CREATED_AT, direction: DESC}}) "
+                         "{{ nodes {{ {} }} }} }}".format(i, json.dumps(owner), json.dumps(name), _RELEASE_FIELDS,
+                                                        gu._LATEST_PAGE_SIZE, _RELEASE_FIELDS))
+        try:
+            r = self.session.post(self.client.api_url + "/graphql",
+                                  json={"query": "query { " + " ".join(parts) + " }"})
+            self.client.calls += 1
+            api.check_response(r, "graphql")
+            data = r.json().get("data") or {}
+        except (ge.GhauError, requests.RequestException) as e:
+            gf.message("Batched release lookup failed: {}".format(getattr(e, "message", e)), "warning")
+            return {repo: e for repo in repos}
+        releases = {}
+        for i, repo in enumerate(repos):
+            node = data.get("r{}".format(i))
+            if node is None:
+                releases[repo] = ge.RepositoryNotFoundError(repo)
+                continue
+            if self.updates[repo].pre_releases:
+                nodes = node["releases"]["nodes"]
+                published = [release for release in nodes if not release["isDraft"]]
+                if len(published) == 0 and len(nodes) == gu._LATEST_PAGE_SIZE:  # older ones may be published.
+                    continue
+                release = published[0] if len(published) > 0 else None
+            else:
+                release = node["latestRelease"]
+            if release is None:
+                releases[repo] = ge.ReleaseNotFoundError(repo)
+            else:
+                releases[repo] = _rest_release(self.client.api_url, repo, release)
+        return releases
+
+
+def _rest_release(api_url: str, repo: str, node: dict) -> dict:
+    """Convert a GraphQL release node into the release data returned by the REST API."""
+    base = "{}/repos/{}".format(api_url, repo)
+    return {
+        "id": node["databaseId"],
+        "tag_name": node["tagName"],
+        "name": node["name"],
+        "prerelease": node["isPrerelease"],
+        "draft": node["isDraft"],
+        "created_at": node["createdAt"],
+        "published_at": node["publishedAt"],
+        "zipball_url": "{}/zipball/{}".format(base, node["tagName"]),
+        "assets_url": "{}/releases/{}/assets".format(base, node["databaseId"]),
+        "assets": [{"name": asset["name"], "size": asset["size"], "browser_download_url": asset["downloadUrl"],
+                    "content_type": asset["contentType"]} for asset in node["releaseAssets"]["nodes"]],
+    }
+
+
+def _group_overlapping(items: list, path_of) -> list:
+    """Group items whose directories are the same or nested in one another."""
+    groups = []
+    for item in items:
+        path = os.path.join(path_of(item), "")
+        merged = [item]
+        for group in [g for g in groups if any(_overlaps(path, os.path.join(path_of(other), "")) for other in g)]:
+            groups.remove(group)
+            merged.extend(group)
+        groups.append(merged)
+    return groups
+
+
+def _overlaps(a: str, b: str) -> bool:
+    """Return True if one of the given directories, ending in a separator, contains the other."""
+    return a.startswith(b) or b.startswith(a)
@@ -0,0 +1,212 @@
+#  Copyright (c) 2020.  InValidFire
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+#  associated documentation files (the "Software"), to deal in the Software without restriction, including
+#  without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the
+#  following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all copies or substantial
+#  portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+#  CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+#  OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import os
+import json
+import mmap
+import stat
+import time
+import hashlib
+import collections
+
+import ghau.files as gf
+import ghau.lazy as lazy
+
+futures = lazy.module("concurrent.futures")
+
+_RACY_NS = 2 * 10 ** 9  # files modified this recently may change again within the same mtime, so aren't recorded.
+
+Drift = collections.namedtuple("Drift", ["modified", "missing", "checked", "hashed"])
+Drift.__doc__ = """Result of :func:`verify`: the paths whose contents differ from the manifest, the paths missing locally,
+the amount of files compared and how many of them had to be hashed."""
+
+
+def blob_sha(path: str) -> str:
+    """Return the git blob SHA-1 of the given file, the same hash Github reports for it in a release's tree.
+
+    The file is memory-mapped and hashed in a single call, which releases the GIL for the whole file so several
+    files can be hashed in parallel on threads.
+
+    :param path: file to hash.
+    :type path: str"""
+    with open(path, "rb") as fd:
+        size = os.fstat(fd.fileno()).st_size
+        digest = hashlib.sha1("blob {}\0".format(size).encode("ascii"))
+        if size == 0:  # empty files can't be mapped.
+            return digest.hexdigest()
+        try:
+            with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                digest.update(mapped)
+        except (OSError, ValueError):  # filesystems without mmap support, or files too large for the address space.
+            for block in iter(lambda: fd.read(1024 * 1024), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def from_tree(tree: dict) -> dict:
+    """Build a manifest from a Github git tree API response, mapping each file path to its [sha, size].
+
+    Only regular files are included, submodules and symlinks are left to full updates.
+
+    :param tree: parsed response of a recursive git tree request.
+    :type tree: dict"""
+    return {item["path"]: [item["sha"], item["size"]] for item in tree["tree"]
+            if item["type"] == "blob" and item["mode"] != "120000"}
+
+
+def from_directory(root: str, paths) -> dict:
+    """Build a manifest by hashing the given relative paths in root. Paths that don't exist are left out.
+
+    :param root: directory the paths are relative to.
+    :type root: str
+    :param paths: relative paths to hash, using '/' separators.
+    :type paths: iterable"""
+    manifest = {}
+    for path in paths:
+        full_path = os.path.join(root, path)
+        if os.path.isfile(full_path):
+            manifest[path] = [blob_sha(full_path), os.path.getsize(full_path)]
+    return manifest
+
+
+def load(path: str, tag: str):
+    """Return the manifest stored at the given path if it was recorded for the given tag, otherwise None.
+
+    :param path: manifest file to read.
+    :type path: str
+    :param tag: release tag the manifest must describe.
+    :type tag: str"""
+    try:
+        with open(path, "r") as fd:
+            data = json.load(fd)
+    except (OSError, ValueError):
+        return None
+    if data.get("tag") != tag:
+        gf.message("Stored manifest is for {}, not {}".format(data.get("tag"), tag), "debug")
+        return None
+    return data["files"]
+
+
+def save(path: str, tag: str, manifest: dict):
+    """Store the manifest of the given tag at the given path.
+
+    :param path: manifest file to write.
+    :type path: str
+    :param tag: release tag the manifest describes.
+    :type tag: str
+    :param manifest: manifest to store.
+    :type manifest: dict"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as fd:
+        json.dump({"tag": tag, "files": manifest}, fd, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def diff(old: dict, new: dict, root: str) -> tuple:
+    """Compare two manifests and return the paths to fetch and the paths to delete.
+
+    A path is fetched when its hash changed or the file is missing from root, and deleted when it is no longer
+    part of the new manifest.
+
+    :param old: manifest of the installed release.
+    :type old: dict
+    :param new: manifest of the release being installed.
+    :type new: dict
+    :param root: directory the release is installed in.
+    :type root: str
+
+    :returns tuple: list of changed paths, list of removed paths."""
+    changed = [path for path, entry in new.items()
+               if path not in old or old[path][0] != entry[0] or not os.path.isfile(os.path.join(root, path))]
+    removed = [path for path in old if path not in new]
+    return changed, removed
+
+
+def verify(root: str, manifest: dict, wl=None, index_path: str = None, workers: int = None,
+           full: bool = False) -> Drift:
+    """Compare the files in root against a manifest, hashing them in parallel.
+
+    Files whose size differs are reported without being hashed. Files whose size and mtime match the record kept
+    at index_path from an earlier run reuse its hash, so only files touched since are read again.
+
+    :param root: directory the manifest's paths are relative to.
+    :type root: str
+    :param manifest: manifest to compare against, mapping each path to its [sha, size].
+    :type manifest: dict
+    :param wl: compiled whitelist, existing files it matches are skipped as they are expected to differ.
+    :type wl: ghau.files.Matcher, optional
+    :param index_path: file the size, mtime and hash of each file are recorded in between runs, defaults to None.
+    :type index_path: str, optional
+    :param workers: threads hashing files, defaults to the amount of CPUs.
+    :type workers: int, optional
+    :param full: hash every file, even the ones recorded with the same size and mtime, defaults to False.
+        Catches edits that restored the mtime of a file without changing its size.
+    :type full: bool, optional
+
+    :returns ghau.manifest.Drift: the drifted files."""
+    index = gf._load_index(index_path) if index_path is not None and not full else {}
+    new_index = {}
+    modified, missing, pending = [], [], []
+    skipped = 0
+    now = time.time_ns()
+    for path, (sha, size) in manifest.items():
+        if wl is not None and gf.is_protected(root, path, wl):
+            skipped += 1
+            continue
+        full_path = os.path.join(root, path)
+        try:
+            st = os.stat(full_path)
+        except FileNotFoundError:
+            missing.append(path)
+            continue
+        if not stat.S_ISREG(st.st_mode) or st.st_size != size:
+            modified.append(path)
+            continue
+        record = [st.st_size, st.st_mtime_ns]
+        if index.get(path, [None, None])[:2] == record:
+            new_index[path] = index[path]
+            if index[path][2] != sha:
+                modified.append(path)
+        else:
+            pending.append((path, full_path, record, now - st.st_mtime_ns > _RACY_NS))
+    if pending:
+        with futures.ThreadPoolExecutor(workers or os.cpu_count() or 1) as pool:
+            for (path, full_path, record, settled), digest in zip(pending, pool.map(_try_blob_sha,
+                                                                                    [p[1] for p in pending])):
+                if digest is None:
+                    missing.append(path)
+                    continue
+                if settled:
+                    new_index[path] = record + [digest]
+                if digest != manifest[path][0]:
+                    modified.append(path)
+    if index_path is not None and new_index != index:
+        gf._save_index(index_path, new_index)
+    checked = len(manifest) - skipped - len(missing)
+    gf.message("Verified {} files, hashed {}: {} modified, {} missing, {} whitelisted".format(
+        checked, len(pending), len(modified), len(missing), skipped), "debug")
+    return Drift(sorted(modified), sorted(missing), checked, len(pending))
+
+
+def _try_blob_sha(path: str):
+    """Return the blob SHA-1 of the given file, or None if it was removed before it could be hashed."""
+    try:
+        return blob_sha(path)
+    except FileNotFoundError:
+        return None
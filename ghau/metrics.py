@@ -0,0 +1,194 @@
+#  Copyright (c) 2020.  InValidFire
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+#  associated documentation files (the "Software"), to deal in the Software without restriction, including
+#  without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the
+#  following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all copies or substantial
+#  portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+#  CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+#  OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import os
+import json
+import time
+import threading
+import contextlib
+
+import ghau.files as gf
+
+
+class Span:
+    """Timing and cost of a single phase of an update.
+
+    :ivar name: name of the phase.
+    :ivar start: time the phase started, in seconds since the epoch.
+    :ivar duration: seconds the phase took.
+    :ivar bytes: bytes downloaded during the phase.
+    :ivar api_calls: Github API requests sent during the phase.
+    :ivar files: files written, moved or deleted during the phase.
+    :ivar timings: seconds spent on each step of the phase, such as the "mkdir", "delete", "write" and "rmdir"
+        steps of the file operations of the clean and install phases.
+    :ivar error: name of the exception that ended the phase, None if it completed."""
+    def __init__(self, name: str):
+        self.name = name
+        self.start = time.time()
+        self.duration = 0.0
+        self.bytes = 0
+        self.api_calls = 0
+        self.files = 0
+        self.timings = {}
+        self.error = None
+
+    def to_dict(self) -> dict:
+        """Return the span as a JSON serializable dict."""
+        return {"name": self.name, "start": self.start, "duration": self.duration, "bytes": self.bytes,
+                "api_calls": self.api_calls, "files": self.files, "timings": dict(self.timings), "error": self.error}
+
+    def __repr__(self):
+        return "Span({!r}, {:.3f}s)".format(self.name, self.duration)
+
+
+class Recorder:
+    """Records a :class:`Span` around each phase of an update and passes the finished spans to its hooks.
+
+    :param calls: function returning the Github API requests sent so far, defaults to not counting them.
+    :type calls: callable, optional
+    """
+    def __init__(self, calls=None):
+        self.calls = calls
+        self.hooks = []
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook):
+        """Call the given hook with every finished span.
+
+        :param hook: callable taking a :class:`Span`. Exceptions raised by it are logged and ignored.
+        :type hook: callable"""
+        self.hooks.append(hook)
+
+    def reset(self):
+        """Forget the spans of the previous run."""
+        with self._lock:
+            self.spans = []
+
+    @contextlib.contextmanager
+    def span(self, name: str):
+        """Context manager recording a span around the phase it wraps. The span is yielded so the phase can add
+        the bytes and files it handled."""
+        span = Span(name)
+        calls = self.calls() if self.calls is not None else 0
+        started = time.perf_counter()
+        try:
+            yield span
+        except Exception as e:  # exiting to reboot isn't an error.
+            span.error = type(e).__name__
+            raise
+        finally:
+            span.duration = time.perf_counter() - started
+            if self.calls is not None:
+                span.api_calls = self.calls() - calls
+            self._finish(span)
+
+    def _finish(self, span: Span):
+        """Store the finished span and pass it to the hooks."""
+        with self._lock:
+            self.spans.append(span)
+        gf.message("Phase {} took {:.3f}s, {} bytes, {} API calls, {} files{}".format(
+            span.name, span.duration, span.bytes, span.api_calls, span.files, "".join(
+                ", {} {:.3f}s".format(step, seconds) for step, seconds in span.timings.items())), "debug")
+        for hook in self.hooks:
+            try:
+                hook(span)
+            except Exception as e:  # a broken hook shouldn't stop the update.
+                gf.message("Metrics hook {} failed: {}".format(hook, e), "warning")
+
+    def export(self, path: str, labels: dict = None):
+        """Write the spans of the last run to the given file, in the Prometheus textfile format if it ends in
+        ``.prom``, as JSON otherwise. See :func:`write_prometheus` and :func:`write_json`."""
+        with self._lock:
+            spans = list(self.spans)
+        if path.endswith(".prom"):
+            write_prometheus(path, spans, labels)
+        else:
+            write_json(path, spans, labels)
+
+
+def _write_atomic(path: str, text: str):
+    """Write the given text to path through a temporary file, so collectors never read a partial file."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_path, "w") as fd:
+        fd.write(text)
+    os.replace(tmp_path, path)
+
+
+def write_json(path: str, spans: list, labels: dict = None):
+    """Write the given spans to a JSON file, along with the given labels and the time of writing.
+
+    :param path: file to write.
+    :type path: str
+    :param spans: spans to write.
+    :type spans: list
+    :param labels: values identifying the run, such as the repository.
+    :type labels: dict, optional"""
+    data = {"labels": labels or {}, "time": time.time(), "spans": [span.to_dict() for span in spans]}
+    _write_atomic(path, json.dumps(data, indent=2))
+
+
+_PROMETHEUS_METRICS = [
+    ("ghau_phase_duration_seconds", "duration", "Seconds the phase took during the last update run."),
+    ("ghau_phase_bytes", "bytes", "Bytes downloaded during the phase in the last update run."),
+    ("ghau_phase_api_calls", "api_calls", "Github API requests sent during the phase in the last update run."),
+    ("ghau_phase_files", "files", "Files written, moved or deleted during the phase in the last update run."),
+]
+
+
+def _label_string(labels: dict) -> str:
+    """Format the given labels for the Prometheus text format, escaping their values."""
+    return ",".join('{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                    for key, value in labels.items())
+
+
+def write_prometheus(path: str, spans: list, labels: dict = None):
+    """Write the given spans in the Prometheus text format, for the textfile collector of the node exporter.
+
+    Each metric is labelled with the phase and the given labels. Use one file per repository, as each write
+    replaces the file.
+
+    :param path: file to write, its name has to end in ``.prom`` for the textfile collector.
+    :type path: str
+    :param spans: spans to write.
+    :type spans: list
+    :param labels: labels added to every metric, such as the repository.
+    :type labels: dict, optional"""
+    labels = labels or {}
+    lines = []
+    for metric, attribute, description in _PROMETHEUS_METRICS:
+        lines.append("# HELP {} {}".format(metric, description))
+        lines.append("# TYPE {} gauge".format(metric))
+        for span in spans:
+            phase_labels = dict(labels, phase=span.name)
+            lines.append("{}{{{}}} {}".format(metric, _label_string(phase_labels), getattr(span, attribute)))
+    lines.append("# HELP ghau_step_duration_seconds Seconds a step of the phase took during the last update run.")
+    lines.append("# TYPE ghau_step_duration_seconds gauge")
+    for span in spans:
+        for step, seconds in span.timings.items():
+            step_labels = dict(labels, phase=span.name, step=step)
+            lines.append("ghau_step_duration_seconds{{{}}} {}".format(_label_string(step_labels), seconds))
+    failed = any(span.error is not None for span in spans)
+    lines.append("# HELP ghau_last_run_timestamp_seconds Time the last update run finished.")
+    lines.append("# TYPE ghau_last_run_timestamp_seconds gauge")
+    lines.append("ghau_last_run_timestamp_seconds{{{}}} {}".format(_label_string(labels), time.time()))
+    lines.append("# HELP ghau_last_run_success Whether every phase of the last update run completed.")
+    lines.append("# TYPE ghau_last_run_success gauge")
+    lines.append("ghau_last_run_success{{{}}} {}".format(_label_string(labels), 0 if failed else 1))
+    _write_atomic(path, "\n".join(lines) + "\n")
@@ -0,0 +1,308 @@
+#  Copyright (c) 2020.  InValidFire
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+#  associated documentation files (the "Software"), to deal in the Software without restriction, including
+#  without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the
+#  following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all copies or substantial
+#  portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+#  CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+#  OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Binary patches between two versions of a release asset.
+
+A patch rebuilds the new file from the old one with three kinds of operations, found by matching blocks of the
+new file against the old one, the way rsync does:
+
+- copy: a range of the old file, unchanged.
+- xor: a range of the old file, XORed with the patch data. Covers regions that mostly stayed the same, such as
+  code whose addresses shifted, as the XOR data is mostly zeroes and compresses well.
+- insert: new data.
+
+The operations are stored in a single zlib stream after a header holding the sizes of both files and the SHA-256
+of the new one. Patches are applied in a streaming fashion, holding at most a few chunks in memory regardless of
+the file sizes.
+"""
+import os
+import mmap
+import zlib
+import struct
+import hashlib
+import itertools
+
+import ghau.errors as ge
+import ghau.files as gf
+
+_MAGIC = b"GHAUPATCH1"
+_HEADER = struct.Struct(">10sQQ32s")  # magic, old size, new size, new SHA-256.
+_RANGE = struct.Struct(">QQ")  # offset in the old file, length.
+_LENGTH = struct.Struct(">Q")
+_COPY, _XOR, _INSERT, _END = b"c", b"x", b"i", b"e"
+_CHUNK = 1024 * 1024  # largest piece of data held in memory while applying, and largest single operation.
+_BLOCK = 256  # size of the blocks matched between the files when creating a patch.
+_EXTEND = 4096  # matches are extended by this much at a time.
+_XOR_MIN_SAME = 0.5  # share of equal bytes a region needs to be stored as xor instead of being searched again.
+
+
+def patch_name(name: str, from_tag: str, to_tag: str) -> str:
+    """Return the asset name of the patch from one version of an asset to another,
+    ``<name>.from-<from_tag>.to-<to_tag>.patch``."""
+    return "{}.from-{}.to-{}.patch".format(name, from_tag, to_tag)
+
+
+def is_patch(name: str) -> bool:
+    """Return True if the given asset name is a patch named by :func:`patch_name`."""
+    return name.endswith(".patch") and ".from-" in name and ".to-" in name
+
+
+def _xor(a: bytes, b: bytes) -> bytes:
+    """XOR two byte strings of the same length."""
+    return (int.from_bytes(a, "little") ^ int.from_bytes(b, "little")).to_bytes(len(a), "little")
+
+
+def _map(fd):
+    """Memory-map the given file for reading, or return empty bytes for an empty file, which can't be mapped."""
+    if os.fstat(fd.fileno()).st_size == 0:
+        return b""
+    return mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class _Writer:
+    """Writes patch operations to a zlib stream, merging consecutive operations of the same kind."""
+    def __init__(self, fd):
+        self.fd = fd
+        self.compressor = zlib.compressobj(9)
+        self.op = None  # pending operation: kind, old offset, data parts, length.
+        self.ops = 0
+
+    def add(self, kind: bytes, offset: int, data: bytes = b"", length: int = None):
+        length = len(data) if length is None else length
+        if length == 0:
+            return
+        op = self.op
+        if op is not None and op[0] == kind and op[3] + length <= _CHUNK and (
+                kind == _INSERT or op[1] + op[3] == offset):
+            op[2].append(data)
+            op[3] += length
+            return
+        self.flush()
+        self.op = [kind, offset, [data], length]
+
+    def flush(self):
+        if self.op is None:
+            return
+        kind, offset, parts, length = self.op
+        header = _LENGTH.pack(length) if kind == _INSERT else _RANGE.pack(offset, length)
+        self.fd.write(self.compressor.compress(kind + header))
+        if kind != _COPY:
+            for part in parts:
+                self.fd.write(self.compressor.compress(part))
+        self.op = None
+        self.ops += 1
+
+    def close(self):
+        self.flush()
+        self.fd.write(self.compressor.compress(_END))
+        self.fd.write(self.compressor.flush())
+
+
+def create(old_path: str, new_path: str, patch_path: str, block_size: int = _BLOCK) -> int:
+    """Create a patch rebuilding new_path from old_path. Used when publishing a release, see :func:`patch_name`
+    for the asset name :class:`ghau.update.Update` looks for.
+
+    Both files are memory-mapped. The old file is indexed by the checksum of each of its blocks, so memory use grows
+    with the old file's size divided by the block size. The new file is searched with a rolling checksum, like
+    rsync's, updated in constant time as the block slides forward by a byte.
+
+    :param old_path: previous version of the file.
+    :type old_path: str
+    :param new_path: new version of the file.
+    :type new_path: str
+    :param patch_path: file to write the patch to.
+    :type patch_path: str
+    :param block_size: size of the blocks matched between the files, defaults to 256. Smaller blocks find more
+        matches but take more memory and time.
+    :type block_size: int, optional
+
+    :returns int: size of the patch in bytes."""
+    with open(old_path, "rb") as old_fd, open(new_path, "rb") as new_fd:
+        old, new = _map(old_fd), _map(new_fd)
+        index = {}
+        for offset in range(0, len(old) - block_size + 1, block_size):
+            a, b = _checksum(old[offset:offset + block_size])
+            index.setdefault(a | b << 16, offset)
+        with open(patch_path, "wb") as fd:
+            fd.write(_HEADER.pack(_MAGIC, len(old), len(new), hashlib.sha256(new).digest()))
+            writer = _Writer(fd)
+            literal = 0
+            match = _find(index, old, new, 0, block_size)
+            while match is not None:
+                pos, offset = match
+                while pos > literal and offset > 0 and old[offset - 1] == new[pos - 1]:  # grow the match backwards.
+                    pos -= 1
+                    offset -= 1
+                _insert(writer, new, literal, pos)
+                literal = _extend(writer, old, new, pos, offset)
+                match = _find(index, old, new, literal, block_size)
+            _insert(writer, new, literal, len(new))
+            writer.close()
+            gf.message("Patch from {} to {}: {} operations".format(old_path, new_path, writer.ops), "debug")
+        for mapped in (old, new):
+            if isinstance(mapped, mmap.mmap):
+                mapped.close()
+    return os.path.getsize(patch_path)
+
+
+def _checksum(block) -> tuple:
+    """Return the two 16 bit sums of the rolling checksum of the given block: the sum of its bytes, and the sum of
+    those running sums."""
+    a = sum(block)
+    b = sum(itertools.accumulate(block))
+    return a & 0xFFFF, b & 0xFFFF
+
+
+def _find(index: dict, old, new, pos: int, block_size: int):
+    """Return the position of the next block of the new file from pos that is found in the old file, along with its
+    offset in the old file, or None if there is none."""
+    end = len(new) - block_size
+    if pos > end:
+        return None
+    a, b = _checksum(new[pos:pos + block_size])
+    while True:
+        offset = index.get(a | b << 16)
+        if offset is not None and old[offset:offset + block_size] == new[pos:pos + block_size]:
+            return pos, offset
+        if pos == end:
+            return None
+        out = new[pos]  # slide the block forward by one byte.
+        a = (a - out + new[pos + block_size]) & 0xFFFF
+        b = (b - block_size * out + a) & 0xFFFF
+        pos += 1
+
+
+def _insert(writer: _Writer, new, start: int, end: int):
+    """Write the new data between start and end as insert operations."""
+    for pos in range(start, end, _CHUNK):
+        writer.add(_INSERT, 0, new[pos:min(pos + _CHUNK, end)])
+
+
+def _extend(writer: _Writer, old, new, pos: int, offset: int) -> int:
+    """Write the match starting at pos in the new file and offset in the old one, extending it for as long as the
+    files stay equal or mostly equal. Returns the position in the new file the match ends at."""
+    while pos < len(new) and offset < len(old):
+        size = min(_EXTEND, len(new) - pos, len(old) - offset)
+        a, b = old[offset:offset + size], new[pos:pos + size]
+        if a == b:
+            writer.add(_COPY, offset, length=size)
+        else:
+            diff = _xor(a, b)
+            if diff.count(0) < size * _XOR_MIN_SAME:
+                same = size - len(diff.lstrip(b"\0"))  # keep the equal start, search again from the difference.
+                writer.add(_COPY, offset, length=same)
+                return pos + same
+            writer.add(_XOR, offset, diff)
+        pos += size
+        offset += size
+    return pos
+
+
+class _Reader:
+    """Reads the operations of a patch from its zlib stream, decompressing at most a chunk at a time."""
+    def __init__(self, fd, name: str):
+        self.fd = fd
+        self.name = name
+        self.decompressor = zlib.decompressobj()
+        self.buffer = b""
+        self.pos = 0
+
+    def read(self, size: int) -> bytes:
+        parts = []
+        while size > 0:
+            if self.pos == len(self.buffer):
+                data = self.decompressor.unconsumed_tail or self.fd.read(_CHUNK)
+                if not data:
+                    raise ge.PatchError(self.name, "patch is truncated")
+                self.buffer = self.decompressor.decompress(data, _CHUNK)
+                self.pos = 0
+                continue
+            part = self.buffer[self.pos:self.pos + size]
+            self.pos += len(part)
+            size -= len(part)
+            parts.append(part)
+        return b"".join(parts)
+
+
+def apply(old_path: str, patch_path: str, dest: str, sha256: str = None):
+    """Rebuild a file from its previous version and a patch made by :func:`create`, writing it to dest.
+
+    The result is written next to dest and only moved into place once its size and SHA-256 are verified.
+
+    :param old_path: previous version of the file.
+    :type old_path: str
+    :param patch_path: patch to apply.
+    :type patch_path: str
+    :param dest: file to write the new version to.
+    :type dest: str
+    :param sha256: expected SHA-256 hex digest of the new version, defaults to the one stored in the patch.
+    :type sha256: str, optional
+
+    :exception ghau.errors.PatchError: the patch is malformed or was made for another version of the file.
+    :exception ghau.errors.DownloadVerificationError: the patched file doesn't match the expected SHA-256."""
+    part_path = dest + ".part"
+    with open(patch_path, "rb") as fd:
+        header = fd.read(_HEADER.size)
+        if len(header) != _HEADER.size or header[:len(_MAGIC)] != _MAGIC:
+            raise ge.PatchError(patch_path, "not a ghau patch")
+        _, old_size, new_size, new_sha256 = _HEADER.unpack(header)
+        if os.path.getsize(old_path) != old_size:
+            raise ge.PatchError(patch_path, "made for a {} byte file, {} has {}".format(
+                old_size, old_path, os.path.getsize(old_path)))
+        reader = _Reader(fd, patch_path)
+        digest = hashlib.sha256()
+        written = 0
+        try:
+            with open(old_path, "rb") as old, open(part_path, "wb") as out:
+                while True:
+                    kind = reader.read(1)
+                    if kind == _END:
+                        break
+                    if kind == _INSERT:
+                        offset, (length,) = None, _LENGTH.unpack(reader.read(_LENGTH.size))
+                    elif kind in (_COPY, _XOR):
+                        offset, length = _RANGE.unpack(reader.read(_RANGE.size))
+                        if offset + length > old_size:
+                            raise ge.PatchError(patch_path, "range outside of the old file")
+                        old.seek(offset)
+                    else:
+                        raise ge.PatchError(patch_path, "unknown operation {!r}".format(kind))
+                    if written + length > new_size:
+                        raise ge.PatchError(patch_path, "output larger than {} bytes".format(new_size))
+                    while length > 0:
+                        size = min(length, _CHUNK)
+                        if kind == _COPY:
+                            data = old.read(size)
+                        elif kind == _XOR:
+                            data = _xor(old.read(size), reader.read(size))
+                        else:
+                            data = reader.read(size)
+                        out.write(data)
+                        digest.update(data)
+                        written += size
+                        length -= size
+            if written != new_size:
+                raise ge.DownloadVerificationError(dest, "{} bytes".format(new_size), "{} bytes".format(written))
+            expected = sha256 or new_sha256.hex()
+            if digest.hexdigest() != expected.lower():
+                raise ge.DownloadVerificationError(dest, "SHA-256 " + expected, "SHA-256 " + digest.hexdigest())
+            os.replace(part_path, dest)
+        finally:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+    gf.message("Applied patch {} to {}".format(patch_path, old_path), "debug")
@@ -0,0 +1,109 @@
+#  Copyright (c) 2020.  InValidFire
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+#  associated documentation files (the "Software"), to deal in the Software without restriction, including
+#  without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the
+#  following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all copies or substantial
+#  portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+#  CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+#  OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import random
+import time
+
+import ghau.files as gf
+
+_SECTION = "schedule"  # cache section of the check state, never a repository name as those contain a /.
+
+
+class Schedule:
+    """Decides when the next update check is due, persisting its state in the cache between runs.
+
+    A check is due once the check interval has passed since the last successful one, so processes started
+    inside the interval skip the network entirely. Each interval is stretched or shrunk by a random jitter
+    to spread the checks of many instances over time. Failed checks are retried after an exponential backoff,
+    starting at the retry delay and doubling with each consecutive failure up to the maximum backoff.
+
+    An interval of 0 disables the schedule: every check is due and no state is stored.
+
+    :param cache: cache to persist the check state in.
+    :type cache: ghau.cache.Cache
+    :param key: key the state is stored under, usually the repository name.
+    :type key: str
+    :param interval: minimum seconds between two successful checks, defaults to 0.
+    :type interval: float, optional
+    :param jitter: fraction an interval is randomly shortened or lengthened by, defaults to 0.1.
+    :type jitter: float, optional
+    :param retry_delay: seconds to wait after the first failed check, defaults to 60.
+    :type retry_delay: float, optional
+    :param max_backoff: maximum seconds to wait after consecutive failed checks, defaults to 86400.
+    :type max_backoff: float, optional
+    :param clock: function returning the current time in seconds since the epoch, defaults to time.time.
+    :type clock: callable, optional
+    :param rng: random generator used for the jitter, defaults to a new random.Random.
+    :type rng: random.Random, optional
+    """
+    def __init__(self, cache, key: str, interval: float = 0, jitter: float = 0.1, retry_delay: float = 60,
+                 max_backoff: float = 86400, clock=time.time, rng: random.Random = None):
+        self.cache = cache
+        self.key = key
+        self.interval = interval
+        self.jitter = jitter
+        self.retry_delay = retry_delay
+        self.max_backoff = max_backoff
+        self.clock = clock
+        self.rng = rng if rng is not None else random.Random()
+
+    @property
+    def state(self) -> dict:
+        """Persisted state: time of the last check, consecutive failures and the time the next check is due."""
+        return self.cache.get(_SECTION, self.key, {"last": None, "failures": 0, "next": 0})
+
+    def due(self) -> bool:
+        """Return True if an update check should run now."""
+        return self.interval <= 0 or self.clock() >= self.state["next"]
+
+    def wait_time(self) -> float:
+        """Return the seconds left until the next check is due."""
+        if self.interval <= 0:
+            return 0
+        return max(0.0, self.state["next"] - self.clock())
+
+    def success(self):
+        """Record a completed check, scheduling the next one an interval from now."""
+        if self.interval <= 0:
+            return
+        now = self.clock()
+        self._store({"last": now, "failures": 0, "next": now + self._jittered(self.interval)})
+
+    def failure(self, retry_at: float = None):
+        """Record a failed check, scheduling a retry after the backoff.
+
+        :param retry_at: earliest time the check may be retried, such as the reset time of the rate limit.
+        :type retry_at: float, optional"""
+        if self.interval <= 0:
+            return
+        now = self.clock()
+        failures = self.state["failures"] + 1
+        delay = self._jittered(min(self.retry_delay * 2 ** (failures - 1), self.max_backoff))
+        next_check = max(now + delay, retry_at if retry_at is not None else 0)
+        gf.message("Update check failed {} time(s) in a row, retrying in {:.0f} seconds.".format(
+            failures, next_check - now), "info")
+        self._store({"last": now, "failures": failures, "next": next_check})
+
+    def _jittered(self, delay: float) -> float:
+        """Randomly shorten or lengthen the given delay by up to the jitter fraction."""
+        return delay * (1 + self.jitter * (2 * self.rng.random() - 1))
+
+    def _store(self, state: dict):
+        """Persist the given state."""
+        self.cache.set(_SECTION, self.key, state)
+        self.cache.save()
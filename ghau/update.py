@@ -19,81 +19,185 @@
 #
 import os
 import sys
-import subprocess
+import shlex
+import shutil
+import time
+import threading
 
+import ghau.api as api
+import ghau.assets as gas
+import ghau.cache as gc
+import ghau.daemon as gd
 import ghau.errors as ge
 import ghau.files as gf
-from github import Github, RateLimitExceededException, UnknownObjectException, GitRelease
+import ghau.fsplan as fsplan
+import ghau.lazy as lazy
+import ghau.manifest as gm
+import ghau.metrics as gmet
+import ghau.patch as gp
+import ghau.schedule as gs
+import ghau.version as gv
 
+requests = lazy.module("requests")
+futures = lazy.module("concurrent.futures")
+subprocess = lazy.module("subprocess")
 
-def _find_release_asset(release: GitRelease.GitRelease, asset: str, debug: bool) -> str:  # TODO: detect asset use regex
-    """Return the requested asset's download url from the given release.
-    If no specific asset is requested, it will return the first one it comes across.
+_INDEX_PAGE_SIZE = 100  # releases per page of the release listing, the maximum Github allows.
+_LATEST_PAGE_SIZE = 10  # newest releases listed to find the latest pre-release, drafts among them are skipped.
+_INSTALLED_SECTION = "installed"  # cache section of the version last installed, by repository.
+_PREVIOUS_SECTION = "previous"  # cache section of the version kept by the last staged install, by repository.
+_SKIPPED_SECTION = "skipped"  # cache section of the versions rolled back from that check() won't offer again.
+_HANDLED_ERRORS = (ge.GithubRateLimitError, ge.GitRepositoryFoundError, ge.ReleaseNotFoundError, ge.ReleaseAssetError,
+                   ge.FileNotExeError, ge.FileNotScriptError, ge.NoAssetsFoundError, ge.InvalidDownloadTypeError,
+                   ge.LoopPreventionError, ge.DownloadVerificationError)
+
+
+def _load_assets(release: dict, client: api.Client, repo: str) -> gas.AssetIndex:
+    """Return the index of the assets of the given release.
+
+    The asset list included in the release data is used, so this only requests the asset listing when the
+    release data comes without one.
 
-    :exception ghau.errors.ReleaseAssetError: No asset by given name was found.
     :exception ghau.errors.NoAssetsFoundError: No assets found for given release."""
-    al = release.get_assets()
-    if al.totalCount == 0:  # if there are no assets, abort.
-        raise ge.NoAssetsFoundError(release.tag_name)
-    if asset is None:  # if no specific asset is requested, download the first it finds.
-        return al[0].browser_download_url
-    for item in al:  # otherwise, look for the specific asset requested.
-        if item.name == asset:
-            gf.message("Found asset {} with URL: {}".format(item.name, item.browser_download_url), "debug")
-            return item.browser_download_url
-        raise ge.ReleaseAssetError(release.tag_name, asset)  # no asset found by requested name? abort.
+    if "assets" in release:
+        index = gas.AssetIndex(release)
+    else:
+        index = gas.AssetIndex(release, client.get_pages(release["assets_url"], repo))
+        client.save()
+    if len(index) == 0:  # if there are no assets, abort.
+        raise ge.NoAssetsFoundError(release["tag_name"])
+    return index
+
+
+def _update_check(local, online):
+    """Compares the given versions, returns True if the online version is newer.
+
+    Versions are compared semantically, see :class:`ghau.version.Version`, so retagging or rolling back a release
+    doesn't count as an update. If either tag isn't a version, any difference counts as an update."""
+    local_version, online_version = gv.parse(local), gv.parse(online)
+    if local_version is None or online_version is None:
+        return online != local
+    return online_version > local_version
+
+
+def _load_release_index(repo: str, client: api.Client) -> list:
+    """Returns every published release of the repository whose tag is a version, sorted newest version first.
+
+    The index is kept in the client's cache. Each call only requests the newest page of the release listing,
+    which is free when Github answers it with a 304. The whole listing is only walked when there is no index yet,
+    or when more than a page of releases was published since the last call.
+
+    :exception ghau.errors.GithubRateLimitError: Hit the rate limit in the process of loading the releases.
+
+    :exception ghau.errors.RepositoryNotFoundError: Given repository is not found."""
+    try:
+        page, next_url = client.get("repos/{}/releases?per_page={}".format(repo, _INDEX_PAGE_SIZE), repo)
+        index = client.cache.get(repo, "release_index") if client.cache is not None else None
+        if next_url is None:  # the first page is the whole listing.
+            releases = page
+        elif index is None or not {release["id"] for release in index} & {release["id"] for release in page}:
+            gf.message("Loading the full release listing of {}".format(repo), "debug")
+            releases = page + client.get_pages(next_url, repo, cached=False)
+        else:  # releases newer than the oldest one on the page are all on it, anything missing was deleted.
+            oldest = min(release["id"] for release in page)
+            releases = page + [release for release in index if release["id"] < oldest]
+        releases = [release for release in releases if not release.get("draft") and gv.parse(release["tag_name"])]
+        releases.sort(key=lambda release: gv.Version(release["tag_name"]), reverse=True)
+        if client.cache is not None:
+            client.cache.set(repo, "release_index", releases)
+    finally:
+        client.save()
+    return releases
+
 
+def _select_release(repo: str, index: list, version: str, constraint: gv.Constraint, pre_releases: bool,
+                    allow_major: bool) -> dict:
+    """Returns the newest release of the index allowed by the given constraint.
 
-def _update_check(local, online):  # TODO Improve update detection, if it's newer, version number, etc.
-    """Compares the given versions, returns True if the values are different."""
-    x = True if online != local else False
-    return x
+    :exception ghau.errors.ReleaseNotFoundError: No release satisfies the constraint."""
+    local = gv.parse(version)
+    for release in index:
+        candidate = gv.Version(release["tag_name"])
+        if (release["prerelease"] or candidate.prerelease) and not pre_releases:
+            continue
+        if not allow_major and local is not None and candidate.major != local.major:
+            continue
+        if constraint.allows(candidate, prereleases=True):
+            gf.message("Release found {}".format(release["tag_name"]), "debug")
+            return release
+    gf.message("No release satisfies '{}'".format(constraint.spec), "debug")
+    raise ge.ReleaseNotFoundError(repo)
 
 
-def _load_release(repo: str, pre_releases: bool, auth, debug: bool) -> GitRelease.GitRelease:
+def _load_release(repo: str, pre_releases: bool, client: api.Client, debug: bool) -> dict:
     """Returns the latest release (or pre_release if enabled) for the loaded repository.
 
+    This costs a constant two API calls no matter how many releases the repository has: one for the repository
+    itself, and one for either the /releases/latest endpoint or the first page of the release listing. Both are
+    served from the client's cache when unchanged. Drafts, listed to users allowed to edit the releases, are skipped,
+    the whole listing is only walked if the first page holds nothing but drafts.
+
     :exception ghau.errors.ReleaseNotFoundError: No releases found for given repository.
 
     :exception ghau.errors.GithubRateLimitError: Hit the rate limit in the process of loading the release.
 
     :exception ghau.errors.RepositoryNotFoundError: Given repository is not found."""
-    g = Github(auth)
     try:
-        if g.get_repo(repo).get_releases().totalCount == 0:  # no releases found
-            gf.message("Release count is 0", "debug")
-            raise ge.ReleaseNotFoundError(repo)
+        repo_data = client.get_json("repos/{}".format(repo), repo)
         if pre_releases:
             gf.message("Accepting pre-releases", "debug")
-            return g.get_repo(repo).get_releases().reversed[0]
-        elif not pre_releases:
+            url = repo_data["url"] + "/releases?per_page={}".format(_LATEST_PAGE_SIZE)
+            releases, next_url = client.get(url, repo)  # listed newest first
+            published = [release for release in releases if not release.get("draft")]
+            if len(published) == 0 and next_url is not None:
+                gf.message("Newest releases are all drafts, loading the full release listing", "debug")
+                published = [release for release in client.get_pages(next_url, repo, cached=False)
+                             if not release.get("draft")]
+            if len(published) == 0:  # no releases found
+                gf.message("Release count is 0", "debug")
+                raise ge.ReleaseNotFoundError(repo)
+            release = published[0]
+        else:
             gf.message("Accepting full releases", "debug")
-            for release in g.get_repo(repo).get_releases().reversed:
-                gf.message("Checking release: {}".format(release.tag_name), "debug")
-                if not release.prerelease:
-                    gf.message("Release found {}".format(release.tag_name), "debug")
-                    return release
-            gf.message("Zero non-pre-release releases found", "debug")
-            raise(ge.ReleaseNotFoundError(repo))
-    except RateLimitExceededException:
-        reset_time = g.rate_limiting_resettime
-        raise ge.GithubRateLimitError(reset_time)
-    except UnknownObjectException:
-        raise ge.RepositoryNotFoundError(repo)
-
-
-def _run_cmd(command: str):
+            try:
+                release = client.get_json(repo_data["url"] + "/releases/latest", repo)
+            except ge.RepositoryNotFoundError:  # the repository exists, so a 404 here means no full release.
+                gf.message("Zero non-pre-release releases found", "debug")
+                raise ge.ReleaseNotFoundError(repo)
+    finally:
+        client.save()
+    gf.message("Release found {}".format(release["tag_name"]), "debug")
+    return release
+
+
+def _run_cmd(command: str, restart: str = "exec"):
     """Run the given command and close the python interpreter.
-    If no command is given, it will just close."""
+    If no command is given, it will just close.
+
+    With the exec restart strategy, the command replaces the interpreter in place, keeping its process id and
+    without a second interpreter running alongside it. Exit handlers and finally blocks don't run then.
+    The spawn strategy starts the command as a new process and exits."""
     if command is None:  # closes program without reboot if no command is given.
         sys.exit()
     if sys.platform == "win32":  # windows needs special treatment
-        data = command.split()
-        subprocess.call(data)  # windows terminal doesn't play nice with replacing the process. :(
-        sys.exit()
-    else:
-        subprocess.Popen(command)
+        subprocess.call(command)  # windows terminal doesn't play nice with replacing the process. :(
         sys.exit()
+    args = shlex.split(command)
+    if restart == "exec":
+        sys.stdout.flush()
+        sys.stderr.flush()
+        for handler in gf.log.handlers:
+            handler.flush()
+        os.execvp(args[0], args)
+    subprocess.Popen(args)
+    sys.exit()
+
+
+def _join(args: list) -> str:
+    """Join the given arguments into a command line, quoting them so paths with spaces survive :func:`_run_cmd`."""
+    if sys.platform == "win32":
+        return subprocess.list2cmdline(args)
+    return " ".join(shlex.quote(arg) for arg in args)
 
 
 def python(file: str) -> str:  # used by users to reboot to the given python file in the working directory.
@@ -108,11 +212,11 @@ def python(file: str) -> str:  # used by users to reboot to the given python fil
 
     :exception ghau.errors.FileNotScriptError: raised if the given file is not a python script.
     """
-    program_dir = os.path.realpath(os.path.dirname(sys.argv[0]))
+    program_dir = os.path.abspath(os.path.dirname(sys.argv[0]))  # keep symlinks, they may be flipped by an update.
     if file.endswith(".py"):
         executable = sys.executable
         file_path = os.path.join(program_dir, file)
-        return "{} {} -ghau".format(executable, file_path)
+        return _join([executable, file_path, "-ghau"])
     else:
         raise ge.FileNotScriptError(file)
 
@@ -129,7 +233,7 @@ def exe(file: str) -> str:  # added for consistency. Boots file in working direc
 
     :exception ghau.errors.FileNotExeError: raised if the given file is not an executable."""
     if file.endswith(".exe"):
-        return "{} -ghau".format(file)
+        return _join([file, "-ghau"])
     else:
         raise ge.FileNotExeError(file)
 
@@ -146,10 +250,42 @@ def cmd(command: str) -> str:  # same as exe
     return "{} -ghau".format(command)
 
 
+def _installed_names(name: str, version: str, tag: str) -> list:
+    """Return the names the installed version of the given asset of release tag may have, the same name first."""
+    names = [name]
+    for new, old in ((tag, version), (tag.lstrip("vV"), version.lstrip("vV"))):
+        candidate = name.replace(new, old) if new and old else name
+        if candidate not in names:
+            names.append(candidate)
+    return names
+
+
+class PendingUpdate:
+    """An update found by :meth:`ghau.update.Update.check`, downloaded by :meth:`ghau.update.Update.fetch` and
+    applied by :meth:`ghau.update.Update.install`.
+
+    :param release: release data of the update.
+    :type release: dict
+    :param cleanlist: files to delete before installing.
+    :type cleanlist: list
+    """
+    def __init__(self, release: dict, cleanlist: list):
+        self.release = release
+        self.tag = release["tag_name"]
+        self.cleanlist = cleanlist
+        self.path = None  # downloaded zip, or the staging folder of a delta update.
+        self.assets = None  # (downloaded file, asset name) of each asset in "asset" mode.
+        self.stream = False  # download the zip while installing it.
+        self.manifest = None  # release manifest in delta mode.
+        self.changed = None  # files staged by a delta update.
+        self.removed = None  # files deleted upstream in a delta update.
+
+
 class Update:
     """Main class used to trigger updates through ghau.
 
-    :param version: local version to check against online versions.
+    :param version: local version to check against online versions. A newer version installed by an earlier run,
+        recorded in the cache, is used instead.
     :type version: str
     :param repo: github repository to check for updates in.
         Must be publicly accessible unless you are using a Github Token.
@@ -158,11 +294,17 @@ class Update:
     :type pre-releases: bool, optional
     :param reboot: command intended to reboot the program after a successful update installs.
     :type reboot: str, optional
+    :param restart: how the reboot command is run, defaults to "exec". Either "exec", replacing the running process
+        in place with os.execvp, or "spawn", starting it as a new process before exiting. Windows always spawns.
+        To update servers without dropping connections, run them under :class:`ghau.daemon.Supervisor` instead.
+    :type restart: str, optional
     :param download: the type of download you wish to use for updates.
         Either "zip" (source code) or "asset" (uploaded files), defaults to "zip".
     :type download: str, optional
-    :param asset: name of asset to download when set to "asset" mode.
-    :type asset: str, optional.
+    :param asset: name of asset to download when set to "asset" mode, or a list of names to download several.
+        Names can be patterns with wildcards and {version}, {tag}, {os} and {arch} placeholders, such as
+        "myapp-{version}-{os}-{arch}.tar.gz", or compiled regular expressions. See :class:`ghau.assets.AssetIndex`.
+    :type asset: str or list, optional.
     :param auth: authentication token used for accessing the Github API, defaults to None.
     :type auth: str, optional
     :param ratemin: minimum amount of API requests left before updates will stop, defaults to 20.
@@ -170,24 +312,172 @@ class Update:
     :type ratemin: int, optional.
     :param debug: receive debug messages regarding the update process, defaults to False.
     :type debug: bool, optional.
+    :param cache_dir: directory ghau keeps its metadata cache in, defaults to ".ghau" in the program directory.
+    :type cache_dir: str, optional.
+    :param api_url: base url of the Github API, defaults to https://api.github.com.
+    :type api_url: str, optional.
+    :param session: HTTP session shared by every network phase of the update, defaults to a pooled session
+        built from pool_size and timeout. Mostly useful for injecting a session in tests.
+    :type session: requests.Session, optional.
+    :param pool_size: connections kept alive per host, defaults to 10.
+    :type pool_size: int, optional.
+    :param timeout: network timeout in seconds, either a number or a (connect, read) tuple, defaults to (5, 30).
+    :type timeout: float or tuple, optional.
+    :param stream_zip: in "zip" mode, extract files while the zipball downloads instead of saving it to
+        update.zip first, defaults to False. Files are extracted into the cache's downloads folder, or the staging
+        folder of a staged install, and only moved into the program directory once the whole archive arrived and
+        passed its CRC checks, so a download failing midway leaves the program as it was.
+    :type stream_zip: bool, optional.
+    :param delta: in "zip" mode, only download the files that changed since the installed release,
+        defaults to False. The release's file manifest is compared against the installed one, stored in the
+        cache directory, and files removed upstream are deleted unless whitelisted.
+    :type delta: bool, optional.
+    :param raw_url: base url single files are downloaded from in delta mode,
+        defaults to https://raw.githubusercontent.com.
+    :type raw_url: str, optional.
+    :param scan_index: keep an index of directory listings in the cache directory, so directories left unchanged
+        since the last run aren't listed again when scanning the program directory, defaults to False.
+    :type scan_index: bool, optional.
+    :param program_dir: directory the program is installed in, defaults to the directory of the running script.
+    :type program_dir: str, optional.
+    :param download_workers: assets downloaded at the same time in "asset" mode, defaults to 4.
+    :type download_workers: int, optional.
+    :param segments: parallel connections used to download a single large asset in byte ranges, defaults to 4.
+        Keep pool_size at or above download_workers * segments so every connection is reused.
+    :type segments: int, optional.
+    :param fs_workers: file operations run at the same time while cleaning and installing, defaults to 8.
+    :type fs_workers: int, optional.
+    :param staged: build each update in a sibling staging directory, hardlinking unchanged files, then switch to it
+        with a directory rename, or by flipping the symlink if the program directory is one, defaults to False.
+        The previous version is kept next to it for :meth:`rollback`.
+    :type staged: bool, optional.
+    :param artifact_cache: artifact store consulted before downloading a zip or asset from Github and filled after,
+        so a fleet sharing it downloads each release once and reinstalls don't download anything. Either a directory,
+        which may be on a network share, or the url of a server started with :func:`ghau.artifacts.serve`,
+        defaults to None. Zips and assets without a published checksum are installed from the store as is, so only
+        use a store writable by trusted machines. See :class:`ghau.artifacts.ArtifactStore`.
+    :type artifact_cache: str, optional.
+    :param artifact_cache_size: maximum size in bytes of a directory artifact store, the least recently used
+        artifacts are evicted past it, defaults to 1 GiB.
+    :type artifact_cache_size: int, optional.
+    :param constraint: version constraint the installed release has to satisfy, such as "~=2.3" or ">=2, <3",
+        defaults to None. See :class:`ghau.version.Constraint`. When set, or when allow_major is False, the newest
+        release by version is picked from an index of every release kept in the cache, rather than the most
+        recently published one. Prereleases are only picked if pre_releases is enabled.
+    :type constraint: str, optional.
+    :param allow_major: allow updating to a different major version, defaults to True.
+    :type allow_major: bool, optional.
+    :param binary_patches: in asset mode, when the release publishes a binary patch from the installed version of an
+        asset, named ``<asset>.from-<version>.to-<tag>.patch``, download it and apply it to the installed asset
+        instead of downloading the full asset, defaults to True. Falls back to the full asset if the patched file
+        doesn't verify. Patches are made with :func:`ghau.patch.create`, or ``python -m ghau make-patch``.
+    :type binary_patches: bool, optional.
+    :param metrics_file: file the timing and cost of each phase of the last run is written to, in the Prometheus
+        textfile format if it ends in .prom, as JSON otherwise, defaults to None. See :mod:`ghau.metrics` and
+        :meth:`add_hook`.
+    :type metrics_file: str, optional.
+    :param check_interval: minimum seconds between two update checks, defaults to 0 (check every time).
+        The time of the last check is kept in the cache directory, so :meth:`update` skips the network entirely
+        when the program restarts within the interval. See :class:`ghau.schedule.Schedule`.
+    :type check_interval: float, optional.
+    :param check_jitter: fraction each interval is randomly shortened or lengthened by, so many instances started
+        together spread their checks out, defaults to 0.1.
+    :type check_jitter: float, optional.
+    :param retry_delay: seconds before retrying a failed check, doubled with each consecutive failure up to a day,
+        defaults to 60. Checks stopped by the rate limit are not retried before it resets.
+    :type retry_delay: float, optional.
+    :param clock: function returning the current time in seconds since the epoch, used by the check schedule,
+        defaults to time.time.
+    :type clock: callable, optional.
     """
     def __init__(self, version: str, repo: str, pre_releases: bool = False,
                  reboot: str = None, download: str = "zip",
-                 asset: str = None, auth: str = None, ratemin: int = 20, debug: bool = False):
+                 asset: str = None, auth: str = None, ratemin: int = 20, debug: bool = False,
+                 cache_dir: str = None, api_url: str = api.API_URL, session=None, pool_size: int = 10,
+                 timeout=(5, 30), stream_zip: bool = False, delta: bool = False, raw_url: str = api.RAW_URL,
+                 scan_index: bool = False, program_dir: str = None, download_workers: int = 4, segments: int = 4,
+                 fs_workers: int = 8, staged: bool = False, check_interval: float = 0, check_jitter: float = 0.1,
+                 retry_delay: float = 60, clock=time.time, artifact_cache: str = None,
+                 artifact_cache_size: int = 1024 ** 3, constraint: str = None, allow_major: bool = True,
+                 metrics_file: str = None, binary_patches: bool = True, restart: str = "exec"):
         self.auth = auth
         self.ratemin = ratemin
         self.debug = debug
         self.version = version
         self.repo = repo
         self.pre_releases = pre_releases
-        self.whitelist = {"!**": False}  # wcmatch requires item in its file_search parameter or it pulls everything.
+        self.allow_major = allow_major
+        # releases are resolved through the release index only when they need more than the latest release.
+        self.constraint = None if constraint is None and allow_major else gv.Constraint(constraint or "")
+        self.whitelist = {"!**": False}  # negated globstar, matches nothing until entries are added.
         self.cleanlist = {"!**": False}
         self.reboot = reboot
+        self.restart = restart
         self.download = download
         self.asset = asset
-        self.program_dir = os.path.realpath(os.path.dirname(sys.argv[0]))
+        self.download_workers = download_workers
+        self.segments = segments
+        self.binary_patches = binary_patches
+        self.fs_workers = fs_workers
+        self.staged = staged
+        self.stream_zip = stream_zip
+        self.delta = delta
+        self.scan_index = scan_index
+        if program_dir is None:
+            program_dir = os.path.dirname(sys.argv[0])
+        program_dir = os.path.abspath(program_dir)
+        # a symlinked program directory is kept as is, so staged installs can flip it to the new version.
+        self.program_dir = program_dir if os.path.islink(program_dir) else os.path.realpath(program_dir)
+        self.previous_dir = self.program_dir + ".ghau-previous"
+        self.cache_dir = cache_dir if cache_dir is not None else os.path.join(self.program_dir, ".ghau")
+        self.cache = gc.Cache(os.path.join(self.cache_dir, "cache.json"))
+        installed = gv.parse(self.cache.get(_INSTALLED_SECTION, repo) or "")
+        if installed is not None and installed > (gv.parse(self.version) or installed):
+            self.version = installed.tag  # installed by an earlier run that didn't reboot into it.
+        self._client_args = (api_url, session, pool_size, timeout, raw_url)
+        self._client = None
+        self._client_lock = threading.Lock()
+        self.manifest_path = os.path.join(self.cache_dir, "manifest.json")
+        self.scan_index_path = os.path.join(self.cache_dir, "scan.json")
+        self.verify_index_path = os.path.join(self.cache_dir, "verify.json")
+        self.download_dir = os.path.join(self.cache_dir, "downloads")
+        self.artifacts = None
+        if artifact_cache is not None:
+            import ghau.artifacts as ga  # only loaded with an artifact cache, as it pulls in http.server.
+            self.artifacts = ga.open_store(artifact_cache, max_size=artifact_cache_size)  # never send the token.
+        self.schedule = gs.Schedule(self.cache, repo, check_interval, check_jitter, retry_delay, clock=clock)
+        self.metrics = gmet.Recorder(self._api_calls)
+        self.metrics_file = metrics_file
+        self._cancel = threading.Event()
 
-    def update(self):
+    @property
+    def client(self) -> api.Client:
+        """Client sending the Github API requests of this update. Built on first use, so the network libraries are
+        only loaded once a check actually runs."""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = api.Client(self.auth, self.cache, *self._client_args)
+        return self._client
+
+    def _api_calls(self) -> int:
+        """Return the Github API requests sent so far, without building the client."""
+        return self._client.calls if self._client is not None else 0
+
+    def add_hook(self, hook):
+        """Call the given hook with the :class:`ghau.metrics.Span` of each phase once it finishes, to watch the
+        duration, bytes downloaded, API calls and files touched of updates.
+
+        :param hook: callable taking a :class:`ghau.metrics.Span`.
+        :type hook: callable"""
+        self.metrics.add_hook(hook)
+
+    def _export_metrics(self):
+        """Write the spans of the last run to the metrics file, if one is set."""
+        if self.metrics_file is not None:
+            self.metrics.export(self.metrics_file, {"repo": self.repo})
+
+    def update(self, reboot: bool = True, release: dict = None):
         """Check for updates and install if an update is found.
 
         All expected exceptions triggered during the run of this method are automatically handled.
@@ -195,41 +485,604 @@ class Update:
 
         An error message will be printed to the console summarizing what occurred when this happens.
 
+        See :meth:`check_async` to check and download in the background instead.
+
+        Does nothing if the next check is not due yet and no release is given, see the check_interval parameter of
+        :class:`Update`, or if the program is run by a :class:`ghau.daemon.Supervisor`, which checks for updates
+        itself.
+
+        :param reboot: run the reboot command and exit once an update is installed, defaults to True.
+        :type reboot: bool, optional
+        :param release: release data received from Github, such as by :class:`ghau.webhook.WebhookListener`,
+            installed right away without looking up the latest release. Ignored if :meth:`accepts` rejects it.
+        :type release: dict, optional
+
+        :returns ghau.update.PendingUpdate: the installed update when not rebooting, or None if none was installed.
+
         :exception ghau.errors.InvalidDownloadTypeError: an unexpected value was given to the download parameter of
             :class:`ghau.update.Update`."""
+        try:  # booting after an update and checks that aren't due return before anything heavy is loaded.
+            ge.argtest(sys.argv, "-ghau")
+        except ge.LoopPreventionError as e:
+            gf.message(e.message, "warning")
+            return
+        if gd.supervised():
+            gf.message("Skipping update check, updates are installed by the supervisor.", "debug")
+            return
+        if release is not None and not self.accepts(release):
+            gf.message("Skipping release {}, it isn't accepted by this update.".format(release["tag_name"]), "info")
+            return
+        if release is None and not self.schedule.due():
+            gf.message("Skipping update check, next check due in {:.0f} seconds.".format(self.schedule.wait_time()),
+                       "info")
+            return
+        self.metrics.reset()
+        try:
+            with self.metrics.span("update"):
+                if release is None:
+                    pending = self._scheduled(self.check, stream=self.stream_zip)
+                else:  # the release is known, so no API request is needed to check it.
+                    pending = self._scheduled(lambda: self.check(ratetest=False, release=release),
+                                              stream=self.stream_zip)
+                if pending is not None:
+                    self.install(pending, reboot)
+        except _HANDLED_ERRORS + (ge.RepositoryNotFoundError, ge.UpdateCancelledError) as e:
+            gf.message(e.message, "warning")
+            return
+        except requests.RequestException as e:  # Github unreachable, retried once the schedule allows.
+            gf.message("Update check failed: {}".format(e), "warning")
+            return
+        finally:
+            self._export_metrics()
+        return pending
+
+    def _scheduled(self, check, stream: bool = False):
+        """Run the given check and download the update it finds, recording the outcome in the check schedule.
+
+        Rate limit errors, network errors and failed download verifications are retried with a backoff,
+        any other outcome completes the check."""
         try:
+            pending = check()
+            if pending is not None:
+                self.fetch(pending, stream=stream)
+        except (ge.LoopPreventionError, ge.GitRepositoryFoundError, ge.UpdateCancelledError):
+            raise  # no check was made.
+        except ge.GithubRateLimitError as e:
+            self.schedule.failure(e.resettime)
+            raise
+        except (requests.RequestException, ge.DownloadVerificationError):
+            self.schedule.failure()
+            raise
+        except _HANDLED_ERRORS:
+            self.schedule.success()
+            raise
+        self.schedule.success()
+        return pending
+
+    def check(self, ratetest: bool = True, release: dict = None):
+        """Check for an update without downloading it.
+
+        :param ratetest: test the available API rate before checking, defaults to True.
+        :type ratetest: bool, optional
+        :param release: latest release data if it was already looked up, skipping the release lookup.
+        :type release: dict, optional
+
+        :returns ghau.update.PendingUpdate: the update to pass to :meth:`fetch`, or None if no update is required.
+
+        :exception ghau.errors.InvalidDownloadTypeError: an unexpected value was given to the download parameter of
+            :class:`ghau.update.Update`."""
+        if self.download not in ("zip", "asset"):
+            raise ge.InvalidDownloadTypeError(self.download)
+        with self.metrics.span("argtest"):
             ge.argtest(sys.argv, "-ghau")
-            ge.devtest(self.program_dir)
-            ge.ratetest(self.ratemin, self.auth)
-            wl = gf.load_dict("Whitelist", self.program_dir, self.whitelist, self.debug)
-            cl = gf.load_dict("Cleanlist", self.program_dir, self.cleanlist, self.debug)
-            latest_release = _load_release(self.repo, self.pre_releases, self.auth, self.debug)
-            do_update = _update_check(self.version, latest_release.tag_name)
-            if do_update:
-                gf.clean_files(cl, self.debug)
-                if self.download == "zip":
-                    gf.message("Downloading Zip", "debug")
-                    gf.download(latest_release.zipball_url, os.path.join(self.program_dir, "update.zip"), self.debug)
-                    gf.extract_zip(self.program_dir, os.path.join(self.program_dir, "update.zip"), wl, self.debug)
-                    gf.message("Updated from {} to {}".format(self.version, latest_release.tag_name), "info")
-                    _run_cmd(self.reboot)
-                    sys.exit()
-                if self.download == "asset":
-                    gf.message("Downloading Asset", "debug")
-                    asset_link = _find_release_asset(latest_release, self.asset, self.debug)
-                    gf.download(asset_link, self.asset, self.debug)
-                    gf.message("Updated from {} to {}".format(self.version, latest_release.tag_name), "info")
-                    _run_cmd(self.reboot)
-                    sys.exit()
-                else:
-                    raise ge.InvalidDownloadTypeError(self.download)
+        with self.metrics.span("scan"):
+            scan = gf.scan(self.program_dir, cl=gf.Matcher(self.cleanlist),
+                           index_path=self.scan_index_path if self.scan_index else None)
+        with self.metrics.span("devtest"):
+            ge.devtest(self.program_dir, scan)
+        self._check_cancelled()
+        if ratetest:
+            with self.metrics.span("ratetest"):
+                ge.ratetest(self.ratemin, self.client)
+            self._check_cancelled()
+        with self.metrics.span("release"):
+            if release is not None:
+                latest_release = release
+            elif self.constraint is not None:
+                index = _load_release_index(self.repo, self.client)
+                latest_release = _select_release(self.repo, index, self.version, self.constraint, self.pre_releases,
+                                                  self.allow_major)
+            else:
+                latest_release = _load_release(self.repo, self.pre_releases, self.client, self.debug)
+        if not _update_check(self.version, latest_release["tag_name"]):
+            gf.message("No update required.", "info")
+            return None
+        if latest_release["tag_name"] in (self.cache.get(_SKIPPED_SECTION, self.repo) or []):
+            gf.message("Skipping {}, it was rolled back before.".format(latest_release["tag_name"]), "info")
+            return None
+        return PendingUpdate(latest_release, scan.cleanlist)
+
+    def accepts(self, release: dict) -> bool:
+        """Return True if the given release may be installed: it is published, it is only a pre-release if
+        pre_releases is enabled, and it satisfies the constraint and allow_major parameters of :class:`Update`.
+
+        :param release: release data as returned by the releases API.
+        :type release: dict"""
+        if release.get("draft"):
+            return False
+        if self.constraint is None:
+            return self.pre_releases or not release.get("prerelease")
+        try:
+            _select_release(self.repo, [release], self.version, self.constraint, self.pre_releases, self.allow_major)
+        except ge.ReleaseNotFoundError:
+            return False
+        return True
+
+    def fetch(self, pending, stream: bool = False):
+        """Download the given update without installing it. Only touches the cache directory.
+
+        :param pending: update returned by :meth:`check`.
+        :type pending: ghau.update.PendingUpdate
+        :param stream: in "zip" mode, leave the download to :meth:`install` so it can install while streaming,
+            defaults to False.
+        :type stream: bool, optional
+
+        :returns ghau.update.PendingUpdate: the given update, ready to pass to :meth:`install`."""
+        with self.metrics.span("fetch") as span:
+            span.bytes = self._fetch(pending, stream)
+        return pending
+
+    def _fetch(self, pending, stream: bool) -> int:
+        """Download the given update for :meth:`fetch`, returning the amount of bytes transferred."""
+        release = pending.release
+        os.makedirs(self.download_dir, exist_ok=True)
+        if self.download == "asset":
+            gf.message("Downloading Assets", "debug")
+            index = _load_assets(release, self.client, self.repo)
+            patterns = self.asset if isinstance(self.asset, (list, tuple)) else [self.asset]
+            assets = [index.find(pattern) for pattern in patterns]  # fail before downloading anything.
+            pending.assets = [(os.path.join(self.download_dir, asset["name"]), asset["name"]) for asset in assets]
+            with futures.ThreadPoolExecutor(self.download_workers) as pool:
+                downloads = [pool.submit(self._fetch_asset, pending.tag, index, asset["name"], path)
+                             for asset, (path, _) in zip(assets, pending.assets)]
+                return sum(future.result() for future in downloads)
+        if self.delta:
+            pending.manifest = self._release_manifest(pending.tag)
+            transferred = self._fetch_delta(pending) if pending.manifest is not None else None
+            if transferred is not None:
+                return transferred
+        path = os.path.join(self.download_dir, "update.zip")
+        if self.artifacts is not None and self.artifacts.get(self.repo, pending.tag, "zipball", path):
+            pending.path = path
+            return 0
+        if stream:
+            pending.stream = True
+            return 0
+        gf.message("Downloading Zip", "debug")
+        pending.path = path
+        transferred = gf.download(release["zipball_url"], pending.path, self.debug, self.client.session,
+                                  cancel=self._cancel)
+        if self.artifacts is not None:
+            self.artifacts.put(self.repo, pending.tag, "zipball", pending.path)
+        return transferred
+
+    def install(self, pending, reboot: bool = True):
+        """Install an update downloaded by :meth:`fetch`, then reboot using the reboot command.
+
+        Apart from a streamed zip, this does no network I/O, so the application can call it whenever it is ready.
+
+        :param pending: update returned by :meth:`fetch`.
+        :type pending: ghau.update.PendingUpdate
+        :param reboot: run the reboot command and exit once installed, defaults to True.
+        :type reboot: bool, optional"""
+        wl = gf.Matcher(self.whitelist)  # compiled once, checked against each installed file.
+        if self.staged:
+            with self.metrics.span("stage"):
+                target = self._build_staging(pending)
+        else:
+            target = self.program_dir
+            if pending.stream:
+                with self.metrics.span("stream") as span:
+                    self._stream_to_downloads(pending, span)
+            with self.metrics.span("clean") as span:
+                gf.clean_files(pending.cleanlist, self.debug, self.fs_workers, span.timings)
+                span.files = len(pending.cleanlist)
+        with self.metrics.span("install") as span:
+            if pending.assets is not None:
+                plan = fsplan.FilePlan(self.fs_workers)
+                for path, name in pending.assets:
+                    plan.move(path, os.path.join(target, name))
+                plan.execute(span.timings)
+                span.files = len(plan)
+            elif pending.changed is not None:
+                span.files = self._install_delta(pending, wl, target, span.timings)
+            elif pending.stream:  # staged, a failure leaves the staging folder behind and the program as is.
+                span.files, span.bytes = self._stream_zip(pending, target, wl)
             else:
-                gf.message("No update required.", True)
-        except (ge.GithubRateLimitError, ge.GitRepositoryFoundError, ge.ReleaseNotFoundError, ge.ReleaseAssetError,
-                ge.FileNotExeError, ge.FileNotScriptError, ge.NoAssetsFoundError, ge.InvalidDownloadTypeError,
-                ge.LoopPreventionError) as e:
-            gf.message(e.message, True)
+                span.files = gf.extract_zip(target, pending.path, wl, self.debug, self.fs_workers, span.timings)
+        if self.staged:
+            with self.metrics.span("switch"):
+                self._switch_to(target)
+            self.cache.set(_PREVIOUS_SECTION, self.repo, self.version)  # saved along with the new version below.
+        if pending.manifest is not None:
+            gm.save(self.manifest_path, pending.tag, pending.manifest)
+        gf.message("Updated from {} to {}".format(self.version, pending.tag), "info")
+        self._record(pending.tag)
+        if reboot:
+            self._export_metrics()
+            _run_cmd(self.reboot, self.restart)
+            sys.exit()
+
+    def _stream_zip(self, pending, target: str, wl: gf.Matcher) -> tuple:
+        """Extract the zipball of the given update into target while it downloads.
+
+        :returns tuple: the amount of files extracted and of bytes downloaded."""
+        gf.message("Streaming Zip", "debug")
+        with self.client.session.get(pending.release["zipball_url"], stream=True) as r:
+            r.raise_for_status()
+            body = gf.ResponseReader(r)
+            files = gf.extract_zip_stream(target, body, wl, self.debug)
+            return files, body.tell()
+
+    def _stream_to_downloads(self, pending, span):
+        """Stream the zipball of the given update into the downloads folder, to be installed like a delta update
+        replacing every file once the download completed."""
+        staging = os.path.join(self.download_dir, "stream")
+        shutil.rmtree(staging, ignore_errors=True)
+        try:
+            span.files, span.bytes = self._stream_zip(pending, staging, gf.Matcher({}))
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        pending.path = staging
+        pending.changed = sorted(os.path.relpath(os.path.join(dirpath, filename), staging).replace(os.sep, "/")
+                                 for dirpath, _, filenames in os.walk(staging) for filename in filenames)
+        pending.removed = []
+
+    def _record(self, version: str):
+        """Set the installed version, keeping it in the cache so later runs don't install the same release again."""
+        self.version = version
+        self.cache.set(_INSTALLED_SECTION, self.repo, version)
+        self.cache.save()
+
+    def check_async(self, callback=None, timeout: float = None) -> "futures.Future":
+        """Check for an update and download it on a background daemon thread.
+
+        The main thread never waits on the network. The returned future resolves to the downloaded
+        :class:`ghau.update.PendingUpdate`, or None if no update is required, and the application decides when to
+        pass it to :meth:`install`. Expected ghau errors are logged and set as the future's exception.
+
+        :param callback: called with the future once it is done.
+        :type callback: callable, optional
+        :param timeout: seconds after which the background check is cancelled, defaults to no limit.
+        :type timeout: float, optional
+
+        :returns concurrent.futures.Future: future of the background check."""
+        future = futures.Future()
+        if callback is not None:
+            future.add_done_callback(callback)
+        self._cancel.clear()
+        timer = None
+        if timeout is not None:
+            timer = threading.Timer(timeout, self._cancel.set)
+            timer.daemon = True
+            timer.start()
+        thread = threading.Thread(target=self._run_async, args=(future, timer), name="ghau-check", daemon=True)
+        thread.start()
+        return future
+
+    def check_periodically(self, callback=None) -> threading.Thread:
+        """Check for an update and download it on a background daemon thread whenever the next check is due.
+
+        Requires a check_interval, see :class:`Update`. Each check resolves a new future passed to the callback,
+        exactly like :meth:`check_async`. The checks stop once :meth:`cancel` is called.
+
+        :param callback: called with the future of each check once it is done.
+        :type callback: callable, optional
+
+        :returns threading.Thread: the thread running the checks."""
+        if self.schedule.interval <= 0:
+            raise ValueError("check_periodically requires a check_interval")
+        self._cancel.clear()
+        thread = threading.Thread(target=self._run_periodic, args=(callback,), name="ghau-periodic", daemon=True)
+        thread.start()
+        return thread
+
+    def cancel(self):
+        """Cancel a background check started by :meth:`check_async` or :meth:`check_periodically`.
+        It stops at the next phase or download read."""
+        self._cancel.set()
+
+    def _run_periodic(self, callback):
+        """Run a check each time the schedule is due for :meth:`check_periodically`, until cancelled."""
+        while not self._cancel.wait(self.schedule.wait_time()):
+            future = futures.Future()
+            if callback is not None:
+                future.add_done_callback(callback)
+            self._run_async(future, None)
+            if self.schedule.due():  # nothing was scheduled, the check could not run at all.
+                gf.message("Stopping periodic update checks.", "info")
+                return
+
+    def _run_async(self, future: "futures.Future", timer):
+        """Run the check and download for :meth:`check_async`, resolving the given future."""
+        if not future.set_running_or_notify_cancel():
             return
+        self.metrics.reset()
+        try:
+            pending = self._scheduled(self.check)
+            self._check_cancelled()
+            future.set_result(pending)
+        except _HANDLED_ERRORS + (ge.UpdateCancelledError,) as e:
+            gf.message(e.message, "warning")
+            future.set_exception(e)
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            if timer is not None:
+                timer.cancel()
+            self._export_metrics()
+
+    def _check_cancelled(self):
+        """Raise if the running check has been cancelled.
+
+        :exception ghau.errors.UpdateCancelledError: the check was cancelled or timed out."""
+        if self._cancel.is_set():
+            raise ge.UpdateCancelledError
+
+    def _fetch_asset(self, tag: str, index: gas.AssetIndex, name: str, path: str):
+        """Download a single asset to the given path, verifying it against its published checksum if any.
+        Returns the amount of bytes transferred."""
+        asset = index.select(name, self.client.session)
+        if self.artifacts is not None and self.artifacts.get(self.repo, tag, asset.name, path, asset.sha256):
+            return 0
+        transferred = 0
+        if self.binary_patches:
+            transferred, patched = self._patch_asset(tag, index, asset, path)
+            if patched:
+                if self.artifacts is not None:
+                    self.artifacts.put(self.repo, tag, asset.name, path, asset.sha256)
+                return transferred
+        transferred += gf.download_segmented(asset.url, path, self.debug, self.client.session, size=asset.size,
+                                            sha256=asset.sha256, segments=self.segments, cancel=self._cancel)
+        if self.artifacts is not None:
+            self.artifacts.put(self.repo, tag, asset.name, path, asset.sha256)
+        return transferred
+
+    def _patch_asset(self, tag: str, index: gas.AssetIndex, asset, path: str) -> tuple:
+        """Rebuild the given asset at path by applying the binary patch from the installed version, if the release
+        publishes one and the installed asset is in the program directory.
+
+        The installed asset is looked up under the name of the new one, or that name with the version it contains
+        replaced by the installed version, such as app-1.0.0.zip for app-1.1.0.zip.
+
+        :returns tuple: the amount of bytes transferred and whether the asset was rebuilt."""
+        name = gp.patch_name(asset.name, self.version, tag)
+        installed = None
+        for candidate in _installed_names(asset.name, self.version, tag):
+            if os.path.isfile(os.path.join(self.program_dir, candidate)):
+                installed = os.path.join(self.program_dir, candidate)
+                break
+        if name not in index.names or installed is None:
+            return 0, False
+        patch = index.select(name, self.client.session)
+        if patch.size >= asset.size:
+            return 0, False
+        patch_path = path + ".patch"
+        transferred = 0
+        try:
+            transferred = gf.download(patch.url, patch_path, self.debug, self.client.session, size=patch.size,
+                                      sha256=patch.sha256, cancel=self._cancel)
+            gp.apply(installed, patch_path, path, asset.sha256)
+        except (ge.PatchError, ge.DownloadVerificationError, requests.RequestException) as e:
+            gf.message("{} Downloading the full asset instead.".format(getattr(e, "message", e)), "warning")
+            return transferred, False
+        finally:
+            if os.path.exists(patch_path):
+                os.remove(patch_path)
+        gf.message("Patched {} from {} to {} with a {} byte download".format(asset.name, self.version, tag,
+                                                                             transferred), "info")
+        return transferred, True
+
+    def _release_manifest(self, tag: str):
+        """Return the file manifest of the given tag from its git tree, or None if Github truncated the tree."""
+        tree = self.client.get_json("repos/{}/git/trees/{}?recursive=1".format(self.repo, tag), self.repo, cached=False)
+        self.client.save()
+        if tree.get("truncated"):
+            gf.message("File tree of {} is too large to diff, using a full download.".format(tag), "info")
+            return None
+        return gm.from_tree(tree)
+
+    def _fetch_delta(self, pending):
+        """Download only the files that changed between the installed version and the given update.
+
+        Changed files are staged in the download directory until installed. Returns the amount of bytes transferred,
+        or None without downloading anything when a full download would be cheaper.
+
+        :exception ghau.errors.DownloadVerificationError: a fetched file doesn't match the release manifest."""
+        installed = gm.load(self.manifest_path, self.version)
+        if installed is None:
+            try:
+                installed = gm.from_tree(self.client.get_json("repos/{}/git/trees/{}?recursive=1".format(
+                    self.repo, self.version), self.repo, cached=False))
+            except ge.RepositoryNotFoundError:  # installed version isn't tagged upstream, hash the local files.
+                installed = gm.from_directory(self.program_dir, pending.manifest.keys())
+        changed, removed = gm.diff(installed, pending.manifest, self.program_dir)
+        cleaned = set(os.path.relpath(path, self.program_dir).replace(os.sep, "/") for path in pending.cleanlist)
+        changed += [path for path in pending.manifest if path in cleaned and path not in changed]  # cleaned first.
+        if len(changed) > len(pending.manifest) / 2:
+            gf.message("{} of {} files changed, using a full download.".format(len(changed), len(pending.manifest)),
+                       "debug")
+            return None
+        wl = gf.Matcher(self.whitelist)
+        changed = [path for path in changed if not gf.is_protected(self.program_dir, path, wl)]
+        staging = os.path.join(self.download_dir, "delta")
+        transferred = self._fetch_files(pending.tag, pending.manifest, changed, staging)
+        pending.path, pending.changed, pending.removed = staging, changed, removed
+        return transferred
+
+    def _fetch_files(self, tag: str, manifest: dict, paths: list, staging: str) -> int:
+        """Download the given files of a release into the staging directory one by one, checking each against the
+        manifest. Returns the amount of bytes transferred.
+
+        :exception ghau.errors.DownloadVerificationError: a fetched file doesn't match the manifest."""
+        transferred = 0
+        for path in paths:
+            dest = os.path.join(staging, path)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            transferred += gf.download(self.client.file_url(self.repo, tag, path), dest, self.debug,
+                                       self.client.session, size=manifest[path][1], cancel=self._cancel)
+            sha = gm.blob_sha(dest)
+            if sha != manifest[path][0]:
+                raise ge.DownloadVerificationError(dest, "blob " + manifest[path][0], sha)
+        return transferred
+
+    def _install_delta(self, pending, wl: gf.Matcher, target: str, timings: dict = None):
+        """Move the files staged by :meth:`_fetch_delta` into the target directory and delete the files removed
+        upstream, along with the directories they leave empty, adding the time spent on each file operation phase
+        to timings. Returns the amount of files moved or deleted."""
+        plan = fsplan.FilePlan(self.fs_workers)
+        for path in pending.changed:
+            if gf.is_protected(target, path, wl):
+                gf.message("Skipping whitelisted file: {}".format(path), "debug")
+                continue
+            plan.move(os.path.join(pending.path, path), os.path.join(target, path))
+        for path in pending.removed:
+            dest = os.path.join(target, path)
+            if not wl.match(path) and os.path.isfile(dest):
+                gf.message("Removing file deleted upstream: {}".format(dest), "debug")
+                plan.delete(dest)
+                plan.remove_dir(os.path.dirname(dest), target)
+        plan.execute(timings)
+        shutil.rmtree(pending.path, ignore_errors=True)
+        gf.message("Installed {} files and removed {}.".format(len(pending.changed), len(pending.removed)), "info")
+        return len(plan)
+
+    def verify(self, repair: bool = False, workers: int = None, full: bool = False):
+        """Compare the program directory against the file manifest of the installed version, reporting the files that
+        drifted from it and optionally restoring them.
+
+        The manifest stored by the last delta update is used when it describes the installed version, otherwise
+        it is built from the release's file tree and stored. Whitelisted files are skipped. Files are hashed in
+        parallel and only when their size or mtime changed since the last verification, see
+        :func:`ghau.manifest.verify`.
+
+        :param repair: download the drifted files of the installed version and put them back, defaults to False.
+        :type repair: bool, optional
+        :param workers: threads hashing files, defaults to the amount of CPUs.
+        :type workers: int, optional
+        :param full: hash every file instead of trusting the ones unchanged since the last verification,
+            defaults to False.
+        :type full: bool, optional
+
+        :returns ghau.manifest.Drift: the files that drifted, as found before repairing them.
+
+        :exception ghau.errors.ManifestNotFoundError: the installed version's file tree is too large to list.
+        :exception ghau.errors.RepositoryNotFoundError: the installed version isn't tagged upstream.
+        :exception ghau.errors.DownloadVerificationError: a repaired file doesn't match the manifest."""
+        self.metrics.reset()
+        try:
+            manifest = gm.load(self.manifest_path, self.version)
+            if manifest is None:
+                manifest = self._release_manifest(self.version)
+                if manifest is None:
+                    raise ge.ManifestNotFoundError(self.version)
+                gm.save(self.manifest_path, self.version, manifest)
+            wl = gf.Matcher(self.whitelist)
+            with self.metrics.span("verify") as span:
+                drift = gm.verify(self.program_dir, manifest, wl, self.verify_index_path, workers, full)
+                span.files = drift.hashed
+            if not drift.modified and not drift.missing:
+                gf.message("All {} files match version {}.".format(drift.checked, self.version), "info")
+                return drift
+            gf.message("{} files modified and {} missing from version {}.".format(
+                len(drift.modified), len(drift.missing), self.version), "warning")
+            if repair:
+                self._repair(manifest, drift.modified + drift.missing)
+            return drift
+        finally:
+            self._export_metrics()
+
+    def _repair(self, manifest: dict, paths: list):
+        """Download the given files of the installed version and move them into the program directory."""
+        staging = os.path.join(self.download_dir, "repair")
+        with self.metrics.span("repair") as span:
+            span.bytes = self._fetch_files(self.version, manifest, paths, staging)
+            plan = fsplan.FilePlan(self.fs_workers)
+            for path in paths:
+                plan.move(os.path.join(staging, path), os.path.join(self.program_dir, path))
+            plan.execute(span.timings)
+            span.files = len(plan)
+        shutil.rmtree(staging, ignore_errors=True)
+        gf.message("Repaired {} files.".format(len(paths)), "info")
+
+    def rollback(self, skip: bool = False):
+        """Switch back to the version kept by the last staged install, and record it as the installed version.
+
+        The version rolled back from is kept in its place, so calling this again rolls forward.
+
+        :param skip: never offer the version rolled back from again in :meth:`check`, for a release that turned out
+            to be broken, defaults to False.
+        :type skip: bool, optional
+
+        :exception ghau.errors.NoPreviousVersionError: no previous version was kept."""
+        if not os.path.lexists(self.previous_dir):
+            raise ge.NoPreviousVersionError(self.previous_dir)
+        previous = self.cache.get(_PREVIOUS_SECTION, self.repo)
+        if os.path.islink(self.program_dir):
+            current = os.path.realpath(self.program_dir)
+            gf.replace_symlink(self.program_dir, os.path.realpath(self.previous_dir))
+            gf.replace_symlink(self.previous_dir, current)
+        else:
+            swap_dir = self.program_dir + ".ghau-swap"
+            os.rename(self.program_dir, swap_dir)
+            os.rename(self.previous_dir, self.program_dir)
+            os.rename(swap_dir, self.previous_dir)
+        if skip:
+            skipped = self.cache.get(_SKIPPED_SECTION, self.repo) or []
+            self.cache.set(_SKIPPED_SECTION, self.repo, skipped + [self.version])
+        if previous is not None:  # unknown when the previous version was kept by an older ghau.
+            self.cache.set(_PREVIOUS_SECTION, self.repo, self.version)
+            self._record(previous)
+        else:
+            self.cache.save()
+        gf.message("Rolled back to the previous version of {}".format(self.program_dir), "info")
+
+    def _build_staging(self, pending) -> str:
+        """Create the staging directory of a staged install, hardlinking the current version's files into it.
+
+        Cleanlist hits and ghau's downloads are left out. Returns the path of the staging directory."""
+        current = os.path.realpath(self.program_dir)
+        if os.path.islink(self.program_dir):  # every version gets its own directory, the symlink picks one.
+            staging = "{}-{}".format(current, pending.tag)
+            if staging == current:
+                staging += ".ghau-staging"
+        else:
+            staging = self.program_dir + ".ghau-staging"
+        if os.path.lexists(staging):  # left over from an interrupted install.
+            shutil.rmtree(staging)
+        gf.message("Staging {} in {}".format(pending.tag, staging), "debug")
+        skip = set(os.path.join(current, os.path.relpath(path, self.program_dir)) for path in pending.cleanlist)
+        prune = set([os.path.join(current, os.path.relpath(self.download_dir, self.program_dir))])
+        gf.link_tree(current, staging, skip, prune)
+        return staging
+
+    def _switch_to(self, staging: str):
+        """Make the given staging directory the live version, keeping the current version for :meth:`rollback`."""
+        if os.path.islink(self.previous_dir):
+            old_previous = os.path.realpath(self.previous_dir)
+            if old_previous not in (staging, os.path.realpath(self.program_dir)):
+                shutil.rmtree(old_previous, ignore_errors=True)
+        elif os.path.lexists(self.previous_dir):
+            shutil.rmtree(self.previous_dir)
+        if os.path.islink(self.program_dir):
+            current = os.path.realpath(self.program_dir)
+            gf.replace_symlink(self.program_dir, staging)
+            gf.replace_symlink(self.previous_dir, current)
+        else:  # the only window where the program directory is missing is between these two renames.
+            os.rename(self.program_dir, self.previous_dir)
+            os.rename(staging, self.program_dir)
+        gf.message("Switched {} to the staged version".format(self.program_dir), "debug")
 
     def wl_test(self):
         """Test the whitelist and output what's protected.
@@ -0,0 +1,141 @@
+#  Copyright (c) 2020.  InValidFire
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+#  associated documentation files (the "Software"), to deal in the Software without restriction, including
+#  without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the
+#  following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all copies or substantial
+#  portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+#  CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+#  OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import re
+import functools
+
+import ghau.errors as ge
+
+_VERSION = re.compile(r"^[vV]?(\d+)(?:\.(\d+))?(?:\.(\d+))?(?:-?([0-9A-Za-z][0-9A-Za-z.-]*))?(?:\+([0-9A-Za-z.-]+))?$")
+_CLAUSE = re.compile(r"^(~=|==|!=|>=|<=|>|<|\^|~)?\s*(\S+)$")
+
+
+@functools.total_ordering
+class Version:
+    """Semantic version parsed from a release tag, ordered as described by https://semver.org.
+
+    A leading v is ignored and missing minor or patch numbers count as 0, so ``v2``, ``2.0`` and ``2.0.0`` are equal.
+    Prereleases like ``2.0.0-rc.1`` or ``2.0.0rc1`` sort before their release, build metadata is ignored.
+
+    :param tag: tag to parse.
+    :type tag: str
+
+    :exception ValueError: the tag is not a version."""
+    def __init__(self, tag: str):
+        match = _VERSION.match(tag.strip())
+        if match is None:
+            raise ValueError("'{}' is not a version".format(tag))
+        self.tag = tag
+        self.release = tuple(int(part or 0) for part in match.group(1, 2, 3))
+        self.precision = len([part for part in match.group(1, 2, 3) if part is not None])  # numbers written out.
+        self.pre = tuple(match.group(4).split(".")) if match.group(4) else ()
+
+    @property
+    def major(self) -> int:
+        return self.release[0]
+
+    @property
+    def prerelease(self) -> bool:
+        return len(self.pre) > 0
+
+    def _key(self) -> tuple:
+        """Sort key, numeric prerelease identifiers sort numerically and before alphanumeric ones."""
+        pre = tuple((0, int(part), "") if part.isdigit() else (1, 0, part) for part in self.pre)
+        return self.release, len(self.pre) == 0, pre
+
+    def __eq__(self, other):
+        return isinstance(other, Version) and self._key() == other._key()
+
+    def __lt__(self, other):
+        return self._key() < other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __repr__(self):
+        return "Version({!r})".format(self.tag)
+
+
+def parse(tag: str):
+    """Return the :class:`Version` of the given tag, or None if it is not a version."""
+    try:
+        return Version(tag)
+    except ValueError:
+        return None
+
+
+class Constraint:
+    """Set of comma separated version clauses a release has to satisfy, such as ``>=2.1, <3`` or ``~=2.3``.
+
+    Supported operators are ``==``, ``!=``, ``>=``, ``<=``, ``>`` and ``<``, along with:
+
+    - ``~=X.Y``: compatible release, at least X.Y within X.*. ``~=X.Y.Z`` stays within X.Y.*.
+    - ``^X.Y.Z``: at least X.Y.Z without a major bump.
+    - ``~X.Y.Z``: at least X.Y.Z without a minor bump.
+
+    A clause without an operator means ``==``. Prereleases only satisfy a constraint if allowed.
+
+    :param spec: constraint to parse, an empty string allows every version.
+    :type spec: str
+
+    :exception ghau.errors.InvalidVersionConstraintError: the constraint could not be parsed."""
+    def __init__(self, spec: str):
+        self.spec = spec
+        self.clauses = []
+        for clause in filter(None, (part.strip() for part in spec.split(","))):
+            match = _CLAUSE.match(clause)
+            version = parse(match.group(2)) if match is not None else None
+            if version is None:
+                raise ge.InvalidVersionConstraintError(spec)
+            op = match.group(1) or "=="
+            if op in ("~=", "^", "~"):
+                if op == "~=" and version.precision < 2:
+                    raise ge.InvalidVersionConstraintError(spec)
+                keep = {"~=": version.precision - 1, "^": 1, "~": 2}[op]
+                self.clauses.append((">=", version))
+                self.clauses.append(("prefix", version.release[:keep]))
+            else:
+                self.clauses.append((op, version))
+
+    def allows(self, version: Version, prereleases: bool = False) -> bool:
+        """Return True if the given version satisfies every clause.
+
+        :param version: version to test.
+        :type version: ghau.version.Version
+        :param prereleases: allow prerelease versions, defaults to False.
+        :type prereleases: bool, optional"""
+        if version.prerelease and not prereleases:
+            return False
+        for op, other in self.clauses:
+            if op == "prefix":
+                ok = version.release[:len(other)] == other
+            elif op == "==":
+                ok = version == other
+            elif op == "!=":
+                ok = version != other
+            elif op == ">=":
+                ok = version >= other
+            elif op == "<=":
+                ok = version <= other
+            elif op == ">":
+                ok = version > other
+            else:
+                ok = version < other
+            if not ok:
+                return False
+        return True
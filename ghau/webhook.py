@@ -0,0 +1,292 @@
+#  Copyright (c) 2020.  InValidFire
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+#  associated documentation files (the "Software"), to deal in the Software without restriction, including
+#  without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the
+#  following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all copies or substantial
+#  portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+#  CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+#  OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Listener for Github release webhooks, installing updates as soon as they are published.
+
+Instead of polling the API on a schedule, Github posts every published release to the listener. It checks the
+signature of the payload against the webhook's secret and hands the release data from the payload to
+:meth:`ghau.update.Update.update`, so finding the release costs no API request and updates start within seconds of
+publishing no matter how many instances are running.
+
+Add a webhook to the repository (or its organization) with the ``application/json`` content type, a secret and the
+"Releases" event, pointing to each instance or to a proxy in front of them::
+
+    listener = ghau.webhook.WebhookListener(update, os.environ["GHAU_WEBHOOK_SECRET"], "0.0.0.0:9000")
+    listener.run()  # installs each release and reboots into it.
+
+Programs that have their own main loop call :meth:`WebhookListener.start` instead and poll
+:meth:`WebhookListener.wait` for releases. Missed deliveries aren't retried by Github, so keep a long check_interval
+on the update as a fallback. See :func:`send` to post recorded payloads to a listener when testing.
+"""
+import hmac
+import json
+import uuid
+import hashlib
+import threading
+import collections
+
+import ghau.daemon as gd
+import ghau.files as gf
+import ghau.lazy as lazy
+import ghau.version as gv
+
+server = lazy.module("http.server")
+request = lazy.module("urllib.request")
+error = lazy.module("urllib.error")
+
+SIGNATURE_HEADER = "X-Hub-Signature-256"
+EVENT_HEADER = "X-GitHub-Event"
+DELIVERY_HEADER = "X-GitHub-Delivery"
+_RELEASE_ACTIONS = ("published", "released")  # "released" also covers pre-releases turned into releases.
+_MAX_BODY = 25 * 1024 ** 2  # the largest payload Github sends.
+_DELIVERIES_KEPT = 256
+
+
+def sign(secret: str, body: bytes) -> str:
+    """Return the signature Github sends along with the given payload, as the value of the X-Hub-Signature-256
+    header.
+
+    :param secret: secret of the webhook.
+    :type secret: str
+    :param body: payload as sent.
+    :type body: bytes"""
+    return "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def verify_signature(secret: str, body: bytes, signature: str) -> bool:
+    """Return True if the given X-Hub-Signature-256 header value is the signature of the payload.
+
+    :param secret: secret of the webhook.
+    :type secret: str
+    :param body: payload as received.
+    :type body: bytes
+    :param signature: value of the X-Hub-Signature-256 header, None if missing.
+    :type signature: str"""
+    if not signature:
+        return False
+    return hmac.compare_digest(sign(secret, body).encode(), signature.encode(errors="replace"))
+
+
+def release_from_payload(payload: dict, repo: str):
+    """Return the release published by the given release event payload, or None if the event didn't publish a
+    release of the given repository.
+
+    The release in the payload has the same fields as the one returned by the releases API, asset list included.
+
+    :param payload: decoded payload of a release event.
+    :type payload: dict
+    :param repo: repository the releases are expected from, as "owner/name".
+    :type repo: str"""
+    if payload.get("action") not in _RELEASE_ACTIONS:
+        return None
+    repository = payload.get("repository") or {}
+    if str(repository.get("full_name", "")).lower() != repo.lower():
+        return None
+    release = payload.get("release")
+    if not isinstance(release, dict) or "tag_name" not in release or release.get("draft"):
+        return None
+    return release
+
+
+def send(url: str, payload, secret: str, event: str = "release", timeout: float = 10) -> int:
+    """Post the given payload to a webhook listener, signed the way Github signs it. Used to test listeners with
+    recorded payloads.
+
+    :param url: url of the listener.
+    :type url: str
+    :param payload: payload to send, either encoded or as a dict.
+    :type payload: bytes or dict
+    :param secret: secret of the webhook.
+    :type secret: str
+    :param event: name of the event, sent in the X-GitHub-Event header, defaults to "release".
+    :type event: str, optional
+    :param timeout: seconds to wait for the response, defaults to 10.
+    :type timeout: float, optional
+
+    :returns int: HTTP status of the response."""
+    body = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+    headers = {"Content-Type": "application/json", SIGNATURE_HEADER: sign(secret, body), EVENT_HEADER: event,
+               DELIVERY_HEADER: str(uuid.uuid4())}
+    try:
+        with request.urlopen(request.Request(url, body, headers, method="POST"), timeout=timeout) as response:
+            return response.status
+    except error.HTTPError as e:
+        return e.code
+
+
+def _newer(release: dict, than: dict) -> bool:
+    """Return True if the given release is newer than the other, or if either tag isn't a version."""
+    version, other = gv.parse(release["tag_name"]), gv.parse(than["tag_name"])
+    return version is None or other is None or version > other
+
+
+class WebhookListener:
+    """HTTP server receiving Github release webhooks for the repository of the given update.
+
+    Each accepted release is kept until it is taken by :meth:`wait` or installed by :meth:`run`. When several
+    arrive in the meantime, only the newest is kept. Releases the update wouldn't install, see
+    :meth:`ghau.update.Update.accepts`, are ignored.
+
+    Responses are sent before the update runs: 401 for payloads without a valid signature, 202 for accepted
+    releases and 200 for pings, other events and deliveries already received.
+
+    :param update: update configuration of the program.
+    :type update: ghau.update.Update
+    :param secret: secret of the webhook.
+    :type secret: str
+    :param address: address to listen on, as ``host:port``, ``[ipv6 host]:port`` or ``unix:/path``. Port 0 picks
+        a free port, see :attr:`port`.
+    :type address: str
+    :param max_body: largest payload accepted in bytes, defaults to 25 MiB, the largest Github sends.
+    :type max_body: int, optional
+
+    :exception ValueError: the secret is empty. Unsigned webhooks would let anyone trigger updates.
+    """
+    def __init__(self, update, secret: str, address: str, max_body: int = _MAX_BODY):
+        if not secret:
+            raise ValueError("a webhook secret is required")
+        self.update = update
+        self.secret = secret
+        self.address = address
+        self.max_body = max_body
+        self.server = None
+        self._pending = None
+        self._deliveries = collections.deque(maxlen=_DELIVERIES_KEPT)
+        self._condition = threading.Condition()
+        self._stopped = False
+
+    @property
+    def port(self) -> int:
+        """Port the listener is bound to, None when not started or listening on a unix socket."""
+        if self.server is None or not isinstance(self.server.server_address, tuple):
+            return None
+        return self.server.server_address[1]
+
+    def start(self):
+        """Start listening in a background thread.
+
+        :returns ghau.webhook.WebhookListener: the listener."""
+        sock = gd.listen(self.address)
+        self.server = server.ThreadingHTTPServer(sock.getsockname(), _handler(self), bind_and_activate=False)
+        self.server.socket.close()
+        self.server.socket = sock
+        self.server.server_address = sock.getsockname()
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="ghau-webhook", daemon=True).start()
+        gf.message("Listening for release webhooks of {} on {}".format(self.update.repo, self.address), "info")
+        return self
+
+    def stop(self):
+        """Stop listening, waking up :meth:`wait` and :meth:`run`."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def wait(self, timeout: float = None):
+        """Wait for a release to be received and return it, or None if none arrived within the timeout or the
+        listener was stopped.
+
+        :param timeout: seconds to wait, defaults to waiting until a release arrives.
+        :type timeout: float, optional
+
+        :returns dict: release data to pass to :meth:`ghau.update.Update.update`."""
+        with self._condition:
+            self._condition.wait_for(lambda: self._pending is not None or self._stopped, timeout)
+            release, self._pending = self._pending, None
+            return release
+
+    def run(self, reboot: bool = True):
+        """Listen and install each received release until :meth:`stop` is called, or until rebooting into an
+        installed update.
+
+        :param reboot: run the reboot command of the update once an update is installed, defaults to True.
+        :type reboot: bool, optional"""
+        if self.server is None:
+            self.start()
+        try:
+            while not self._stopped:
+                release = self.wait(1)
+                if release is not None:
+                    self.update.update(reboot, release=release)
+        finally:
+            self.stop()
+
+    def _receive(self, event: str, delivery: str, body: bytes) -> int:
+        """Handle a verified delivery, returning the status to respond with."""
+        if event == "ping":
+            return 200
+        if event != "release":
+            gf.message("Ignoring {} webhook event".format(event), "debug")
+            return 200
+        with self._condition:
+            if delivery in self._deliveries:
+                gf.message("Ignoring delivery {} received twice".format(delivery), "debug")
+                return 200
+        try:
+            payload = json.loads(body.decode())
+        except ValueError:
+            return 400
+        release = release_from_payload(payload, self.update.repo) if isinstance(payload, dict) else None
+        if release is None or not self.update.accepts(release):
+            gf.message("Ignoring release webhook: {} {}".format(
+                payload.get("action") if isinstance(payload, dict) else None,
+                (release or {}).get("tag_name")), "debug")
+            return 200
+        gf.message("Release {} received by webhook".format(release["tag_name"]), "info")
+        with self._condition:
+            if delivery in self._deliveries:  # the same delivery was queued by another thread meanwhile.
+                return 200
+            if delivery:  # only queued deliveries are remembered, so redeliveries of rejected ones are handled.
+                self._deliveries.append(delivery)
+            if self._pending is None or _newer(release, self._pending):
+                self._pending = release
+            self._condition.notify_all()
+        return 202
+
+
+def _handler(listener: WebhookListener):
+    """Return the request handler class of the given listener."""
+    class Handler(server.BaseHTTPRequestHandler):
+        timeout = 30  # don't let a client holding back its payload keep a thread forever.
+
+        def do_POST(self):
+            try:
+                length = int(self.headers.get("Content-Length"))
+            except (TypeError, ValueError):
+                return self._respond(411)
+            if length < 0 or length > listener.max_body:
+                return self._respond(413)
+            body = self.rfile.read(length)
+            if not verify_signature(listener.secret, body, self.headers.get(SIGNATURE_HEADER)):
+                gf.message("Rejected webhook with an invalid signature", "warning")
+                return self._respond(401)
+            self._respond(listener._receive(self.headers.get(EVENT_HEADER), self.headers.get(DELIVERY_HEADER), body))
+
+        def _respond(self, status: int):
+            self.send_response(status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            gf.message("Webhook: " + format % args, "debug")
+
+    return Handler
@@ -0,0 +1,43 @@
+#  Copyright (c) 2020.  InValidFire
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+#  associated documentation files (the "Software"), to deal in the Software without restriction, including
+#  without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the
+#  following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all copies or substantial
+#  portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+#  CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+#  OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import shlex
+import sys
+
+import pytest
+
+import ghau.errors as ge
+import ghau.update as gu
+
+
+def test_python_quotes_paths(tmp_path, monkeypatch):
+    program_dir = tmp_path / "my program"
+    monkeypatch.setattr(sys, "argv", [str(program_dir / "main.py")])
+    monkeypatch.setattr(sys, "executable", "/opt/my python/bin/python")
+    assert shlex.split(gu.python("main.py")) == ["/opt/my python/bin/python", str(program_dir / "main.py"), "-ghau"]
+
+
+def test_exe_quotes_paths():
+    assert shlex.split(gu.exe("my app.exe")) == ["my app.exe", "-ghau"]
+
+
+@pytest.mark.parametrize("builder, file, error", [(gu.python, "main.exe", ge.FileNotScriptError),
+                                                  (gu.exe, "main.py", ge.FileNotExeError)])
+def test_wrong_file_type(builder, file, error):
+    with pytest.raises(error):
+        builder(file)
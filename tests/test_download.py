@@ -0,0 +1,115 @@
+#  Copyright (c) 2020.  InValidFire
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+#  associated documentation files (the "Software"), to deal in the Software without restriction, including
+#  without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the
+#  following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all copies or substantial
+#  portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+#  CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+#  OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import hashlib
+import http.server
+import threading
+
+import pytest
+import requests
+
+import ghau.files as gf
+
+FILES = {"/v1": b"version one " * 5000, "/v2": b"version two " * 5000}
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == "/truncated":
+            self.send_response(200)
+            self.send_header("Content-Length", "100000")
+            self.end_headers()
+            self.wfile.write(b"x" * 1000)
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        data = self.server.files[self.path]
+        etag = '"{}"'.format(hashlib.sha256(data).hexdigest())
+        start = 0
+        if self.headers.get("Range") and self.headers.get("If-Range") in (None, etag):
+            start = int(self.headers["Range"][len("bytes="):].rstrip("-"))
+        self.send_response(206 if start else 200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(data) - start))
+        if start:
+            self.send_header("Content-Range", "bytes {}-{}/{}".format(start, len(data) - 1, len(data)))
+        self.end_headers()
+        self.wfile.write(data[start:])
+
+
+@pytest.fixture
+def server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.files = dict(FILES)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _url(server, path):
+    return "http://127.0.0.1:{}{}".format(server.server_address[1], path)
+
+
+def test_resumes_the_same_file(server, tmp_path):
+    dest = str(tmp_path / "file")
+    data = FILES["/v1"]
+    gf._write_part_info(dest + ".part", _url(server, "/v1"), '"{}"'.format(hashlib.sha256(data).hexdigest()))
+    with open(dest + ".part", "wb") as fd:
+        fd.write(data[:1000])
+    assert gf.download(_url(server, "/v1"), dest, False) == len(data) - 1000
+    assert open(dest, "rb").read() == data
+
+
+def test_leftover_of_another_url_is_discarded(server, tmp_path):
+    dest = str(tmp_path / "file")
+    data = FILES["/v1"]
+    gf._write_part_info(dest + ".part", _url(server, "/v1"), '"{}"'.format(hashlib.sha256(data).hexdigest()))
+    with open(dest + ".part", "wb") as fd:
+        fd.write(data[:1000])
+    gf.download(_url(server, "/v2"), dest, False)
+    assert open(dest, "rb").read() == FILES["/v2"]
+
+
+def test_leftover_without_record_is_discarded(server, tmp_path):
+    dest = str(tmp_path / "file")
+    with open(dest + ".part", "wb") as fd:
+        fd.write(FILES["/v1"][:1000])
+    gf.download(_url(server, "/v2"), dest, False)
+    assert open(dest, "rb").read() == FILES["/v2"]
+
+
+def test_leftover_of_a_changed_file_is_discarded(server, tmp_path):
+    dest = str(tmp_path / "file")
+    data = FILES["/v1"]
+    gf._write_part_info(dest + ".part", _url(server, "/v1"), '"{}"'.format(hashlib.sha256(data).hexdigest()))
+    with open(dest + ".part", "wb") as fd:
+        fd.write(data[:1000])
+    server.files["/v1"] = FILES["/v2"]  # republished under the same url.
+    gf.download(_url(server, "/v1"), dest, False)
+    assert open(dest, "rb").read() == FILES["/v2"]
+
+
+def test_truncated_body_raises_a_requests_exception(server, tmp_path):
+    with pytest.raises(requests.RequestException):
+        gf.download(_url(server, "/truncated"), str(tmp_path / "file"), False)
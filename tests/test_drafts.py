@@ -0,0 +1,123 @@
+#  Copyright (c) 2020.  InValidFire
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+#  associated documentation files (the "Software"), to deal in the Software without restriction, including
+#  without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the
+#  following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all copies or substantial
+#  portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+#  CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+#  OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import http.server
+import json
+import threading
+import urllib.parse
+
+import pytest
+
+import ghau.errors as ge
+import ghau.manager as gman
+import ghau.update as gu
+
+REPO = "owner/app"
+
+
+def _release(number: int, draft: bool = False, prerelease: bool = False) -> dict:
+    tag = "v1.{}.0".format(number)
+    return {"id": number, "tag_name": tag, "name": tag, "draft": draft, "prerelease": prerelease,
+            "created_at": "2026-01-01T00:00:00Z", "published_at": None if draft else "2026-01-01T00:00:00Z",
+            "assets": []}
+
+
+def _node(release: dict) -> dict:
+    return {"databaseId": release["id"], "tagName": release["tag_name"], "name": release["name"],
+            "isDraft": release["draft"], "isPrerelease": release["prerelease"], "createdAt": release["created_at"],
+            "publishedAt": release["published_at"], "releaseAssets": {"nodes": []}}
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    """Serves the releases of REPO, newest first, to a user allowed to see its drafts."""
+    def log_message(self, *args):
+        pass
+
+    def _json(self, data, headers: dict = None):
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        base = "http://{}:{}".format(*self.server.server_address)
+        if url.path == "/repos/" + REPO:
+            return self._json({"url": base + url.path})
+        per_page, page = int(query["per_page"][0]), int(query.get("page", ["1"])[0])
+        releases = self.server.releases[(page - 1) * per_page:page * per_page]
+        headers = {}
+        if page * per_page < len(self.server.releases):
+            headers["Link"] = '<{}{}?per_page={}&page={}>; rel="next"'.format(base, url.path, per_page, page + 1)
+        self._json(releases, headers)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        releases = self.server.releases
+        latest = next((release for release in releases if not release["draft"] and not release["prerelease"]), None)
+        self._json({"data": {"r0": {"latestRelease": _node(latest) if latest is not None else None,
+                                    "releases": {"nodes": [_node(release)
+                                                           for release in releases[:gu._LATEST_PAGE_SIZE]]}}}})
+
+
+@pytest.fixture
+def server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+LISTINGS = {
+    "drafts first": ([_release(9, draft=True), _release(8, draft=True), _release(7, prerelease=True), _release(6)],
+                     "v1.7.0"),
+    "a page of drafts": ([_release(n, draft=True) for n in range(40, 10, -1)] + [_release(5)], "v1.5.0"),
+    "only drafts": ([_release(9, draft=True)], None),
+}
+
+
+@pytest.mark.parametrize("listing", sorted(LISTINGS))
+def test_rest_skips_drafts(server, tmp_path, listing):
+    server.releases, expected = LISTINGS[listing]
+    update = gu.Update("v0.1.0", REPO, pre_releases=True, program_dir=str(tmp_path),
+                       api_url="http://{}:{}".format(*server.server_address))
+    if expected is None:
+        with pytest.raises(ge.ReleaseNotFoundError):
+            gu._load_release(REPO, True, update.client, False)
+    else:
+        assert gu._load_release(REPO, True, update.client, False)["tag_name"] == expected
+
+
+@pytest.mark.parametrize("listing", sorted(LISTINGS))
+def test_graphql_skips_drafts(server, tmp_path, listing):
+    server.releases, expected = LISTINGS[listing]
+    manager = gman.UpdateManager(auth="token", api_url="http://{}:{}".format(*server.server_address))
+    manager.add(REPO, "v0.1.0", pre_releases=True, program_dir=str(tmp_path))
+    releases = manager._load_releases_graphql([REPO])
+    if listing == "a page of drafts":
+        assert REPO not in releases  # left to the REST lookup, which walks the listing.
+    elif expected is None:
+        assert isinstance(releases[REPO], ge.ReleaseNotFoundError)
+    else:
+        assert releases[REPO]["tag_name"] == expected
@@ -0,0 +1,52 @@
+#  Copyright (c) 2020.  InValidFire
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+#  associated documentation files (the "Software"), to deal in the Software without restriction, including
+#  without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the
+#  following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all copies or substantial
+#  portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+#  CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+#  OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import threading
+
+import ghau.cache as gc
+import ghau.manager as gman
+import ghau.update as gu
+
+REPOS = ["bench/f{}-s64".format(files) for files in range(1, 21)]
+
+
+def test_repositories_sharing_a_program_dir_are_checked_concurrently(github, tmp_path):
+    manager = gman.UpdateManager(api_url=github.url, max_workers=8)
+    for repo in REPOS:
+        manager.add(repo, "v0.9.0", program_dir=str(tmp_path))
+    plan = manager.check()
+    assert all(isinstance(plan[repo], gu.PendingUpdate) for repo in REPOS), plan
+    assert len(set(update.cache.path for update in manager.updates.values())) == len(REPOS)
+    for repo, update in manager.updates.items():
+        assert gc.Cache(update.cache.path).data.get(repo), repo
+
+
+def test_cache_saved_from_many_threads(tmp_path):
+    cache = gc.Cache(str(tmp_path / "cache.json"))
+
+    def fill(section):
+        for i in range(50):
+            cache.set(section, str(i), i)
+            cache.save()
+
+    threads = [threading.Thread(target=fill, args=("s{}".format(n),)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(gc.Cache(cache.path).data) == ["s{}".format(n) for n in range(8)]
@@ -0,0 +1,85 @@
+#  Copyright (c) 2020.  InValidFire
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+#  associated documentation files (the "Software"), to deal in the Software without restriction, including
+#  without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the
+#  following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all copies or substantial
+#  portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+#  CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+#  OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import os
+
+import pytest
+
+import ghau.files as gf
+
+# expected results are the files the wcmatch based lists matched before Matcher replaced them.
+FILES = ["main.py", "README.md", ".env", "config.json", "a1.txt", "ab.txt", "data/a.txt", "data/b.json", "data/.hidden",
+         "data/sub/c.txt", "data/sub/d.py", "lib/x.py", "lib/y.pyc", "lib/cache/z.pyc", "docs/index.md",
+         "docs/img/logo.png", ".git/config"]
+VISIBLE = [path for path in FILES if not path.startswith(".") and "/." not in path]
+
+CASES = [
+    ({"main.py": False}, ["main.py"]),
+    ({"data/sub/c.txt": False}, ["data/sub/c.txt"]),
+    ({"missing.py": False}, []),
+    ({"*.py": False}, ["main.py"]),
+    ({"*": False}, ["README.md", "a1.txt", "ab.txt", "config.json", "main.py"]),
+    ({"**": False}, VISIBLE),
+    ({"**/*.py": False}, ["data/sub/d.py", "lib/x.py", "main.py"]),
+    ({"data/*": False}, ["data/a.txt", "data/b.json"]),
+    ({"data/**": False}, ["data/a.txt", "data/b.json", "data/sub/c.txt", "data/sub/d.py"]),
+    ({"data/**/*.txt": False}, ["data/a.txt", "data/sub/c.txt"]),
+    ({"**/*.pyc": False}, ["lib/cache/z.pyc", "lib/y.pyc"]),
+    ({"a?.txt": False}, ["a1.txt", "ab.txt"]),
+    ({"a[0-9].txt": False}, ["a1.txt"]),
+    ({"a[!0-9].txt": False}, ["ab.txt"]),
+    ({"*.py|*.md": False}, ["README.md", "main.py"]),
+    ({"**/*.py": False, "!lib/*": False}, ["data/sub/d.py", "main.py"]),
+    ({"**": False, "!**/*.pyc": False}, [path for path in VISIBLE if not path.endswith(".pyc")]),
+    ({"**": False, "data": True}, [path for path in VISIBLE if not path.startswith("data/")]),
+    ({"**/*.txt": False, "data/sub": True}, ["a1.txt", "ab.txt", "data/a.txt"]),
+    ({"**/*.pyc": False, "lib/cache": True}, ["lib/y.pyc"]),
+    ({"**": False, "d*": True}, [path for path in VISIBLE if not path.startswith("d")]),
+    ({"**/*": False, "**/sub": True}, [path for path in VISIBLE if "/sub/" not in path]),
+    ({".env": False}, []),
+    ({"data/.hidden": False}, []),
+    ({"**/.*": False}, []),
+    ({".git/config": False}, []),
+]
+
+
+@pytest.mark.parametrize("dictobj, expected", CASES)
+def test_match(dictobj, expected):
+    matcher = gf.Matcher(dictobj)
+    assert sorted(path for path in FILES if matcher.match(path)) == sorted(expected)
+
+
+@pytest.mark.parametrize("dictobj, expected", CASES)
+def test_scan(tmp_path, dictobj, expected):
+    for path in FILES:
+        os.makedirs(os.path.dirname(str(tmp_path / path)), exist_ok=True)
+        (tmp_path / path).write_text(path)
+    hits = gf.scan(str(tmp_path), cl=gf.Matcher(dictobj), check_dev=False).cleanlist
+    assert sorted(os.path.relpath(hit, str(tmp_path)).replace(os.sep, "/") for hit in hits) == sorted(expected)
+
+
+def test_empty():
+    assert gf.Matcher({}).empty
+    assert gf.Matcher({"data": True}).empty
+    assert not gf.Matcher({"*.py": False}).empty
+
+
+def test_excluded():
+    matcher = gf.Matcher({"**": False, "data/sub|docs": True, "lib/*": True})
+    assert matcher.excluded("data/sub") and matcher.excluded("docs") and matcher.excluded("lib/cache")
+    assert not matcher.excluded("data") and not matcher.excluded("lib")
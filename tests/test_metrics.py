@@ -0,0 +1,35 @@
+#  Copyright (c) 2020.  InValidFire
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+#  associated documentation files (the "Software"), to deal in the Software without restriction, including
+#  without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the
+#  following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all copies or substantial
+#  portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+#  CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+#  OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import json
+
+import ghau.update as gu
+
+
+def test_file_operation_timings_are_exported(github, tmp_path):
+    program_dir = tmp_path / "program"
+    program_dir.mkdir()
+    (program_dir / "stale.txt").write_text("stale")
+    metrics_file = tmp_path / "metrics.json"
+    update = gu.Update("v0.9.0", "bench/f10-s100", program_dir=str(program_dir), api_url=github.url,
+                       metrics_file=str(metrics_file))
+    update.cl_files("stale.txt")
+    assert update.update(reboot=False) is not None
+    spans = {span["name"]: span for span in json.loads(metrics_file.read_text())["spans"]}
+    assert set(spans["clean"]["timings"]) == {"mkdir", "delete", "write", "rmdir"}
+    assert spans["install"]["timings"]["write"] > 0
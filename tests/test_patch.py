@@ -0,0 +1,153 @@
+#  Copyright (c) 2020.  InValidFire
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+#  associated documentation files (the "Software"), to deal in the Software without restriction, including
+#  without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the
+#  following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all copies or substantial
+#  portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+#  CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+#  OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import functools
+import hashlib
+import http.server
+import os
+import random
+import threading
+
+import pytest
+
+import ghau.assets as gas
+import ghau.errors as ge
+import ghau.patch as gp
+import ghau.update as gu
+
+RNG = random.Random(4)
+OLD = RNG.randbytes(300000)
+
+
+def _edited(data: bytes) -> bytes:
+    """Return data with a few insertions, deletions and flipped bytes, like a rebuilt binary."""
+    data = bytearray(data)
+    for _ in range(20):
+        pos = RNG.randrange(len(data))
+        data[pos:pos + RNG.randrange(0, 50)] = RNG.randbytes(RNG.randrange(0, 200))
+    for _ in range(500):
+        data[RNG.randrange(len(data))] ^= 1
+    return bytes(data)
+
+
+CASES = {
+    "identical": (OLD, OLD),
+    "edited": (OLD, _edited(OLD)),
+    "shifted": (OLD, b"header" + OLD),
+    "truncated": (OLD, OLD[:100000]),
+    "appended": (OLD, OLD + RNG.randbytes(5000)),
+    "unrelated": (OLD, RNG.randbytes(20000)),
+    "repeated": (OLD[:1000] * 50, OLD[:1000] * 60),
+    "empty old": (b"", RNG.randbytes(1000)),
+    "empty new": (OLD, b""),
+    "tiny": (b"abc", b"abd"),
+}
+
+
+def _write(path, data: bytes) -> str:
+    with open(str(path), "wb") as fd:
+        fd.write(data)
+    return str(path)
+
+
+@pytest.mark.parametrize("case", sorted(CASES))
+@pytest.mark.parametrize("block_size", [16, 256])
+def test_round_trip(tmp_path, case, block_size):
+    old, new = CASES[case]
+    old_path, new_path = _write(tmp_path / "old", old), _write(tmp_path / "new", new)
+    size = gp.create(old_path, new_path, str(tmp_path / "patch"), block_size)
+    gp.apply(old_path, str(tmp_path / "patch"), str(tmp_path / "out"))
+    assert (tmp_path / "out").read_bytes() == new
+    if case in ("identical", "edited", "shifted", "truncated", "appended"):
+        assert size < len(new) // 10 + 200
+
+
+def test_checksum_rolls():
+    data = RNG.randbytes(2000)
+    a, b = gp._checksum(data[:256])
+    for pos in range(1, len(data) - 256):
+        out = data[pos - 1]
+        a = (a - out + data[pos + 255]) & 0xFFFF
+        b = (b - 256 * out + a) & 0xFFFF
+        assert (a, b) == gp._checksum(data[pos:pos + 256])
+
+
+def _patch(tmp_path, old=OLD, new=CASES["edited"][1]) -> tuple:
+    old_path, new_path = _write(tmp_path / "old", old), _write(tmp_path / "new", new)
+    gp.create(old_path, new_path, str(tmp_path / "patch"))
+    return old_path, str(tmp_path / "patch")
+
+
+def test_wrong_old_file(tmp_path):
+    old_path, patch_path = _patch(tmp_path)
+    _write(old_path, OLD[:-1])
+    with pytest.raises(ge.PatchError):
+        gp.apply(old_path, patch_path, str(tmp_path / "out"))
+    _write(old_path, b"x" + OLD[1:])
+    with pytest.raises(ge.DownloadVerificationError):
+        gp.apply(old_path, patch_path, str(tmp_path / "out"))
+    assert not (tmp_path / "out").exists() and not (tmp_path / "out.part").exists()
+
+
+@pytest.mark.parametrize("corrupt", [lambda data: data[:len(data) // 2], lambda data: b"NOTAPATCH!" + data[10:]])
+def test_corrupt_patch(tmp_path, corrupt):
+    old_path, patch_path = _patch(tmp_path)
+    _write(patch_path, corrupt((tmp_path / "patch").read_bytes()))
+    with pytest.raises(ge.PatchError):
+        gp.apply(old_path, patch_path, str(tmp_path / "out"))
+
+
+def test_expected_sha256(tmp_path):
+    old_path, patch_path = _patch(tmp_path)
+    with pytest.raises(ge.DownloadVerificationError):
+        gp.apply(old_path, patch_path, str(tmp_path / "out"), sha256=hashlib.sha256(b"other").hexdigest())
+
+
+@pytest.fixture
+def files(tmp_path):
+    directory = tmp_path / "served"
+    directory.mkdir()
+    handler = functools.partial(http.server.SimpleHTTPRequestHandler, directory=str(directory))
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server.directory = directory
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize("installed_name, asset_name", [("app.bin", "app.bin"), ("app-0.9.0.bin", "app-1.0.0.bin"),
+                                                        ("app-v0.9.0.bin", "app-v1.0.0.bin")])
+def test_patch_asset(tmp_path, files, installed_name, asset_name):
+    new = CASES["edited"][1]
+    program_dir = tmp_path / "program"
+    program_dir.mkdir()
+    _write(program_dir / installed_name, OLD)
+    patch_name = gp.patch_name(asset_name, "v0.9.0", "v1.0.0")
+    _write(files.directory / asset_name, new)
+    gp.create(str(program_dir / installed_name), str(files.directory / asset_name), str(files.directory / patch_name))
+    base = "http://127.0.0.1:{}/".format(files.server_address[1])
+    assets = [{"name": name, "browser_download_url": base + name, "size": os.path.getsize(str(files.directory / name)),
+               "digest": "sha256:" + hashlib.sha256((files.directory / name).read_bytes()).hexdigest()}
+              for name in (asset_name, patch_name)]
+    index = gas.AssetIndex({"tag_name": "v1.0.0", "assets": assets})
+    update = gu.Update("v0.9.0", "bench/f1-s4", program_dir=str(program_dir))
+    path = str(tmp_path / "download")
+    transferred, patched = update._patch_asset("v1.0.0", index, index.select(asset_name), path)
+    assert patched and transferred == assets[1]["size"] < len(new)
+    assert open(path, "rb").read() == new
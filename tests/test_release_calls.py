@@ -0,0 +1,64 @@
+#  Copyright (c) 2020.  InValidFire
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+#  associated documentation files (the "Software"), to deal in the Software without restriction, including
+#  without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the
+#  following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all copies or substantial
+#  portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+#  CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+#  OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import os
+
+import pytest
+import requests
+
+import ghau.update as gu
+
+REPO = "bench/f10-s100"
+
+
+@pytest.mark.parametrize("pre_releases", [False, True])
+def test_check_costs_at_most_two_calls(github, tmp_path, pre_releases):
+    update = gu.Update("v0.9.0", REPO, pre_releases=pre_releases, program_dir=str(tmp_path), api_url=github.url)
+    pending = update.check(ratetest=False)
+    assert pending is not None and pending.tag == "v1.0.0"
+    assert update.client.calls <= 2
+
+
+@pytest.mark.parametrize("pre_releases", [False, True])
+def test_repeated_check_costs_at_most_two_calls(github, tmp_path, pre_releases):
+    update = gu.Update("v1.0.0", REPO, pre_releases=pre_releases, program_dir=str(tmp_path), api_url=github.url)
+    for _ in range(3):
+        calls = update.client.calls
+        assert update.check(ratetest=False) is None
+        assert update.client.calls - calls <= 2
+
+
+def test_delta_update_keeps_trees_out_of_the_cache(github, tmp_path):
+    update = gu.Update("v0.9.0", REPO, program_dir=str(tmp_path), api_url=github.url, delta=True)
+    assert update.update(reboot=False) is not None
+    with open(os.path.join(update.cache_dir, "cache.json")) as fd:
+        assert "git/trees" not in fd.read()
+
+
+def _stats(github) -> dict:
+    return requests.get(github.url + "/_stats").json()
+
+
+def test_repeated_check_is_served_from_the_cache(github, tmp_path):
+    first = gu.Update("v0.9.0", REPO, program_dir=str(tmp_path), api_url=github.url).check(ratetest=False)
+    requests.post(github.url + "/_reset")
+    update = gu.Update("v0.9.0", REPO, program_dir=str(tmp_path), api_url=github.url)  # a later run.
+    pending = update.check(ratetest=False)
+    stats = _stats(github)
+    assert update.client.calls == stats["api_requests"] == stats["not_modified"] > 0
+    assert pending.release == first.release
@@ -0,0 +1,51 @@
+#  Copyright (c) 2020.  InValidFire
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+#  associated documentation files (the "Software"), to deal in the Software without restriction, including
+#  without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the
+#  following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all copies or substantial
+#  portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+#  CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+#  OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import pytest
+
+import ghau.update as gu
+
+REPO = "bench/f10-s64"
+
+
+def _update(github, tmp_path, version="v0.9.0"):
+    program_dir = tmp_path / "program"
+    program_dir.mkdir(exist_ok=True)
+    return gu.Update(version, REPO, program_dir=str(program_dir), api_url=github.url, staged=True)
+
+
+@pytest.mark.parametrize("skip", [False, True])
+def test_rollback_records_the_previous_version(github, tmp_path, skip):
+    update = _update(github, tmp_path)
+    assert update.update(reboot=False) is not None
+    assert update.version == "v1.0.0"
+    update.rollback(skip=skip)
+    assert update.version == "v0.9.0"
+    restarted = _update(github, tmp_path, "v0.1.0")
+    assert restarted.version == "v0.9.0"
+    pending = restarted.check(ratetest=False)
+    assert (pending is None) == skip
+
+
+def test_rollback_twice_rolls_forward(github, tmp_path):
+    update = _update(github, tmp_path)
+    update.update(reboot=False)
+    update.rollback()
+    update.rollback()
+    assert update.version == "v1.0.0"
+    assert _update(github, tmp_path).version == "v1.0.0"
@@ -0,0 +1,106 @@
+#  Copyright (c) 2020.  InValidFire
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+#  associated documentation files (the "Software"), to deal in the Software without restriction, including
+#  without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the
+#  following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all copies or substantial
+#  portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+#  CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+#  OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import random
+
+import pytest
+
+import ghau.cache as gc
+import ghau.schedule as gs
+
+
+class Clock:
+    """Fake clock, moved forward by the tests."""
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _schedule(tmp_path, clock, **kwargs):
+    cache = gc.Cache(str(tmp_path / "cache.json"))
+    return gs.Schedule(cache, "bench/repo", clock=clock, rng=random.Random(0), **kwargs)
+
+
+def test_disabled(tmp_path):
+    clock = Clock()
+    schedule = _schedule(tmp_path, clock)
+    schedule.success()
+    schedule.failure()
+    assert schedule.due() and schedule.wait_time() == 0
+    assert not (tmp_path / "cache.json").exists()
+
+
+def test_interval(tmp_path):
+    clock = Clock()
+    schedule = _schedule(tmp_path, clock, interval=3600, jitter=0)
+    assert schedule.due()
+    schedule.success()
+    assert not schedule.due() and schedule.wait_time() == 3600
+    clock.now += 3599
+    assert not schedule.due() and schedule.wait_time() == 1
+    clock.now += 1
+    assert schedule.due() and schedule.wait_time() == 0
+
+
+def test_state_persists(tmp_path):
+    clock = Clock()
+    _schedule(tmp_path, clock, interval=3600, jitter=0).success()
+    clock.now += 60
+    restarted = _schedule(tmp_path, clock, interval=3600, jitter=0)
+    assert not restarted.due() and restarted.wait_time() == 3540
+
+
+@pytest.mark.parametrize("jitter", [0.1, 0.5])
+def test_jitter_bounds(tmp_path, jitter):
+    clock = Clock()
+    schedule = _schedule(tmp_path, clock, interval=1000, jitter=jitter)
+    waits = set()
+    for _ in range(200):
+        schedule.success()
+        wait = schedule.wait_time()
+        assert 1000 * (1 - jitter) <= wait <= 1000 * (1 + jitter)
+        waits.add(round(wait))
+    assert min(waits) < 1000 < max(waits)  # spread on both sides of the interval.
+
+
+def test_backoff_grows_and_resets(tmp_path):
+    clock = Clock()
+    schedule = _schedule(tmp_path, clock, interval=3600, jitter=0, retry_delay=60, max_backoff=400)
+    waits = []
+    for _ in range(5):
+        schedule.failure()
+        waits.append(schedule.wait_time())
+        clock.now = schedule.state["next"]
+        assert schedule.due()
+    assert waits == [60, 120, 240, 400, 400]
+    assert schedule.state["failures"] == 5
+    schedule.success()
+    assert schedule.state["failures"] == 0 and schedule.wait_time() == 3600
+    schedule.failure()
+    assert schedule.wait_time() == 60
+
+
+def test_retry_at(tmp_path):
+    clock = Clock()
+    schedule = _schedule(tmp_path, clock, interval=3600, jitter=0, retry_delay=60)
+    schedule.failure(retry_at=clock.now + 900)
+    assert schedule.wait_time() == 900
+    schedule.failure(retry_at=clock.now + 10)  # the backoff wins when it's later.
+    assert schedule.wait_time() == 120
@@ -0,0 +1,64 @@
+#  Copyright (c) 2020.  InValidFire
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+#  associated documentation files (the "Software"), to deal in the Software without restriction, including
+#  without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the
+#  following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all copies or substantial
+#  portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+#  CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+#  OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import os
+
+import ghau.errors as ge
+import ghau.files as gf
+import ghau.update as gu
+
+REPO = "bench/f20-s64"
+
+
+def _program(tmp_path):
+    program_dir = tmp_path / "program"
+    program_dir.mkdir()
+    (program_dir / "old.txt").write_text("old")
+    return program_dir
+
+
+def test_stream_install(github, tmp_path):
+    program_dir = _program(tmp_path)
+    update = gu.Update("v0.9.0", REPO, program_dir=str(program_dir), api_url=github.url, stream_zip=True)
+    update.cl_files("old.txt")
+    assert update.update(reboot=False) is not None
+    installed = sorted(os.path.relpath(os.path.join(dirpath, name), str(program_dir)).replace(os.sep, "/")
+                       for dirpath, _, names in os.walk(str(program_dir)) if ".ghau" not in dirpath for name in names)
+    assert installed == sorted(github.repo(REPO).files["v1.0.0"])
+
+
+def test_failed_stream_leaves_the_program_as_is(github, tmp_path, monkeypatch):
+    program_dir = _program(tmp_path)
+    extract_zip_stream = gf.extract_zip_stream
+
+    def broken(extract_path, stream, wl, debug=False):
+        stream.read(1024)
+        os.makedirs(extract_path, exist_ok=True)
+        with open(os.path.join(extract_path, "partial.py"), "w") as fd:
+            fd.write("partial")
+        raise ge.DownloadVerificationError("partial.py", "CRC 1", "CRC 2")
+
+    monkeypatch.setattr(gf, "extract_zip_stream", broken)
+    update = gu.Update("v0.9.0", REPO, program_dir=str(program_dir), api_url=github.url, stream_zip=True)
+    update.cl_files("old.txt")
+    assert update.update(reboot=False) is None
+    assert sorted(os.listdir(str(program_dir))) == [".ghau", "old.txt"]
+    assert update.version == "v0.9.0"
+    monkeypatch.setattr(gf, "extract_zip_stream", extract_zip_stream)
+    assert update.update(reboot=False) is not None
+    assert not os.path.exists(str(program_dir / "old.txt"))
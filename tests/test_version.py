@@ -0,0 +1,118 @@
+#  Copyright (c) 2020.  InValidFire
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+#  associated documentation files (the "Software"), to deal in the Software without restriction, including
+#  without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the
+#  following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all copies or substantial
+#  portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+#  CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+#  OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import pytest
+
+import ghau.errors as ge
+import ghau.update as gu
+import ghau.version as gv
+
+
+@pytest.mark.parametrize("tag, release, pre", [
+    ("v1.2.3", (1, 2, 3), ()),
+    ("V2", (2, 0, 0), ()),
+    ("2.1", (2, 1, 0), ()),
+    ("1.0.0-rc.1", (1, 0, 0), ("rc", "1")),
+    ("1.0.0rc1", (1, 0, 0), ("rc1",)),
+    ("1.0.0+build.5", (1, 0, 0), ()),
+    ("1.0.0-beta+exp.sha.5114f85", (1, 0, 0), ("beta",)),
+])
+def test_parse(tag, release, pre):
+    version = gv.parse(tag)
+    assert version.release == release and version.pre == pre
+    assert version.prerelease == bool(pre)
+
+
+@pytest.mark.parametrize("tag", ["", "latest", "v", "1.2.3.4", "release-1.0"])
+def test_parse_invalid(tag):
+    assert gv.parse(tag) is None
+    with pytest.raises(ValueError):
+        gv.Version(tag)
+
+
+def test_equal_versions():
+    assert gv.Version("v2") == gv.Version("2.0") == gv.Version("2.0.0") == gv.Version("2.0.0+build")
+    assert len({gv.Version("v2"), gv.Version("2.0.0")}) == 1
+
+
+def test_ordering():  # the precedence example of semver.org, plus a release of the next minor version.
+    tags = ["1.0.0-alpha", "1.0.0-alpha.1", "1.0.0-alpha.beta", "1.0.0-beta", "1.0.0-beta.2", "1.0.0-beta.11",
+            "1.0.0-rc.1", "1.0.0", "1.1.0-rc.1", "v1.1.0"]
+    versions = [gv.Version(tag) for tag in tags]
+    assert sorted(reversed(versions)) == versions
+    for older, newer in zip(versions, versions[1:]):
+        assert older < newer
+
+
+@pytest.mark.parametrize("spec, allowed, refused", [
+    ("", ["0.1.0", "3.0.0"], []),
+    ("1.2.3", ["v1.2.3", "1.2.3+build"], ["1.2.4"]),
+    ("==1.2", ["1.2.0"], ["1.2.1"]),
+    ("!=1.2.3", ["1.2.2", "1.2.4"], ["1.2.3"]),
+    (">=2.1, <3", ["2.1.0", "2.9.9"], ["2.0.9", "3.0.0"]),
+    (">2, <=2.5", ["2.0.1", "2.5.0"], ["2.0.0", "2.5.1"]),
+    ("^1.2.3", ["1.2.3", "1.9.0"], ["1.2.2", "2.0.0"]),
+    ("^0.2.3", ["0.2.3", "0.9.0"], ["0.2.2", "1.0.0"]),
+    ("~1.2.3", ["1.2.3", "1.2.9"], ["1.2.2", "1.3.0"]),
+    ("~=2.3", ["2.3.0", "2.9.0"], ["2.2.9", "3.0.0"]),
+    ("~=2.3.1", ["2.3.1", "2.3.9"], ["2.3.0", "2.4.0"]),
+    ("~=2.3, !=2.4.0", ["2.3.5", "2.4.1"], ["2.4.0"]),
+])
+def test_constraint(spec, allowed, refused):
+    constraint = gv.Constraint(spec)
+    for tag in allowed:
+        assert constraint.allows(gv.Version(tag)), tag
+    for tag in refused:
+        assert not constraint.allows(gv.Version(tag)), tag
+
+
+def test_constraint_prereleases():
+    constraint = gv.Constraint(">=1.0")
+    assert not constraint.allows(gv.Version("2.0.0-rc.1"))
+    assert constraint.allows(gv.Version("2.0.0-rc.1"), prereleases=True)
+    assert not constraint.allows(gv.Version("1.0.0-rc.1"), prereleases=True)
+
+
+@pytest.mark.parametrize("spec", ["~=2", ">=", "latest", ">=1.0, nope", "=>1.0"])
+def test_invalid_constraint(spec):
+    with pytest.raises(ge.InvalidVersionConstraintError):
+        gv.Constraint(spec)
+
+
+def _release(tag, prerelease=False, draft=False):
+    return {"tag_name": tag, "prerelease": prerelease, "draft": draft}
+
+
+@pytest.mark.parametrize("options, release, accepted", [
+    ({}, _release("v2.0.0"), True),
+    ({}, _release("v1.1.0", draft=True), False),
+    ({}, _release("v1.1.0-rc.1", prerelease=True), False),
+    ({"pre_releases": True}, _release("v1.1.0-rc.1", prerelease=True), True),
+    ({"allow_major": False}, _release("v1.5.0"), True),
+    ({"allow_major": False}, _release("v2.0.0"), False),
+    ({"allow_major": False}, _release("v0.9.0"), False),
+    ({"allow_major": False, "pre_releases": True}, _release("v1.6.0-rc.1", prerelease=True), True),
+    ({"allow_major": False}, _release("v1.6.0-rc.1"), False),
+    ({"constraint": "~=1.2"}, _release("v1.4.0"), True),
+    ({"constraint": "~=1.2"}, _release("v1.1.0"), False),
+    ({"constraint": ">=1, <3"}, _release("v2.0.0"), True),
+    ({"constraint": ">=1, <3", "allow_major": False}, _release("v2.0.0"), False),
+])
+def test_update_accepts(tmp_path, options, release, accepted):
+    update = gu.Update("v1.2.0", "bench/f1-s4", program_dir=str(tmp_path), **options)
+    assert update.accepts(release) == accepted
@@ -0,0 +1,65 @@
+#  Copyright (c) 2020.  InValidFire
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+#  associated documentation files (the "Software"), to deal in the Software without restriction, including
+#  without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the
+#  following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all copies or substantial
+#  portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+#  CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+#  OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+import ghau.update as gu
+import ghau.webhook as gw
+
+SECRET = "secret"
+
+
+@pytest.fixture
+def listener(tmp_path):
+    update = gu.Update("v0.9.0", "bench/f10-s100", program_dir=str(tmp_path), api_url="http://127.0.0.1:9")
+    listener = gw.WebhookListener(update, SECRET, "127.0.0.1:0").start()
+    yield listener
+    listener.stop()
+
+
+def _post(listener, body: bytes, headers: dict) -> int:
+    request = urllib.request.Request("http://127.0.0.1:{}/".format(listener.port), body, headers, method="POST")
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def _delivery(body: bytes, delivery: str = "1") -> dict:
+    return {gw.SIGNATURE_HEADER: gw.sign(SECRET, body), gw.EVENT_HEADER: "release", gw.DELIVERY_HEADER: delivery}
+
+
+def test_redelivery_of_rejected_payload_is_handled(listener):
+    assert _post(listener, b"{not json", _delivery(b"{not json")) == 400
+    body = json.dumps({"action": "published", "repository": {"full_name": "bench/f10-s100"},
+                       "release": {"tag_name": "v1.0.0", "draft": False, "prerelease": False}}).encode()
+    assert _post(listener, body, _delivery(body)) == 202
+    assert listener.wait(1)["tag_name"] == "v1.0.0"
+    assert _post(listener, body, _delivery(body)) == 200  # queued once already.
+    assert listener.wait(0.1) is None
+
+
+def test_junk_signature_is_rejected(listener):
+    body = b"{}"
+    assert _post(listener, body, {gw.SIGNATURE_HEADER: "sha256=\xe9\xe9", gw.EVENT_HEADER: "release"}) == 401
+    assert _post(listener, body, {gw.SIGNATURE_HEADER: gw.sign("other", body), gw.EVENT_HEADER: "release"}) == 401
@@ -0,0 +1,124 @@
+#  Copyright (c) 2020.  InValidFire
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+#  associated documentation files (the "Software"), to deal in the Software without restriction, including
+#  without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the
+#  following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all copies or substantial
+#  portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+#  CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+#  OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import io
+import os
+import zipfile
+
+import pytest
+
+import ghau.errors as ge
+import ghau.files as gf
+
+FILES = {"main.py": b"print('hello')\n" * 200, "data/blob.bin": os.urandom(70000), "empty.txt": b""}
+
+
+class Unseekable(io.RawIOBase):
+    """Write-only stream zipfile can't seek in, so it writes data descriptors after each member."""
+    def __init__(self):
+        self.data = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.data += b
+        return len(b)
+
+
+class Trickle(io.RawIOBase):
+    """Read-only stream returning at most size bytes per read, like a slow download."""
+    def __init__(self, data: bytes, size: int = 7):
+        self.stream = io.BytesIO(data)
+        self.size = size
+
+    def read(self, n=-1):
+        return self.stream.read(min(self.size, n) if n >= 0 else self.size)
+
+
+def _zip(compression=zipfile.ZIP_DEFLATED, seekable=True, force_zip64=False) -> bytes:
+    out = io.BytesIO() if seekable else Unseekable()
+    with zipfile.ZipFile(out, "w", compression) as zf:
+        zf.writestr("repo-abc123/", b"")
+        for name, data in FILES.items():
+            info = zipfile.ZipInfo("repo-abc123/" + name)
+            info.compress_type = compression
+            with zf.open(info, "w", force_zip64=force_zip64) as fd:
+                fd.write(data)
+    return bytes(out.getvalue() if seekable else out.data)
+
+
+def _extracted(path) -> dict:
+    files = {}
+    for dirpath, _, filenames in os.walk(str(path)):
+        for filename in filenames:
+            with open(os.path.join(dirpath, filename), "rb") as fd:
+                files[os.path.relpath(os.path.join(dirpath, filename), str(path)).replace(os.sep, "/")] = fd.read()
+    return files
+
+
+@pytest.mark.parametrize("compression, seekable, force_zip64", [
+    (zipfile.ZIP_STORED, True, False),
+    (zipfile.ZIP_DEFLATED, True, False),
+    (zipfile.ZIP_DEFLATED, False, False),  # data descriptors.
+    (zipfile.ZIP_STORED, True, True),
+    (zipfile.ZIP_DEFLATED, True, True),
+    (zipfile.ZIP_DEFLATED, False, True),
+])
+def test_extract(tmp_path, compression, seekable, force_zip64):
+    archive = _zip(compression, seekable, force_zip64)
+    for stream in (io.BytesIO(archive), Trickle(archive)):
+        target = tmp_path / str(id(stream))
+        assert gf.extract_zip_stream(str(target), stream, gf.Matcher({})) == len(FILES)
+        assert _extracted(target) == FILES
+
+
+def test_data_descriptors_are_used():
+    archive = _zip(seekable=False)
+    assert all(info.flag_bits & 0x08 for info in zipfile.ZipFile(io.BytesIO(archive)).infolist() if not info.is_dir())
+
+
+def test_whitelist(tmp_path):
+    (tmp_path / "main.py").write_bytes(b"local")
+    assert gf.extract_zip_stream(str(tmp_path), io.BytesIO(_zip()), gf.Matcher({"*.py": False})) == len(FILES) - 1
+    assert (tmp_path / "main.py").read_bytes() == b"local"
+    assert (tmp_path / "data" / "blob.bin").read_bytes() == FILES["data/blob.bin"]
+
+
+def test_bad_crc(tmp_path):
+    archive = bytearray(_zip(zipfile.ZIP_STORED))
+    offset = archive.index(b"repo-abc123/main.py") - 30  # local header of main.py, its CRC is at byte 14.
+    archive[offset + 14] ^= 0xFF
+    with pytest.raises(ge.DownloadVerificationError):
+        gf.extract_zip_stream(str(tmp_path), io.BytesIO(bytes(archive)), gf.Matcher({}))
+
+
+@pytest.mark.parametrize("compression, seekable", [(zipfile.ZIP_STORED, True), (zipfile.ZIP_DEFLATED, True),
+                                                   (zipfile.ZIP_DEFLATED, False)])
+def test_truncated(tmp_path, compression, seekable):
+    archive = _zip(compression, seekable)
+    central_directory = archive.index(b"PK\x01\x02")
+    cuts = list(range(0, central_directory, 997)) + [archive.index(b"PK\x03\x04", 100), central_directory]
+    for cut in cuts:  # inside headers, member data and descriptors, and right between two members.
+        with pytest.raises(ge.DownloadVerificationError):
+            gf.extract_zip_stream(str(tmp_path), io.BytesIO(archive[:cut]), gf.Matcher({}))
+
+
+def test_stored_with_descriptor_is_refused(tmp_path):
+    with pytest.raises(ge.DownloadVerificationError):
+        gf.extract_zip_stream(str(tmp_path), io.BytesIO(_zip(zipfile.ZIP_STORED, seekable=False)), gf.Matcher({}))